@@ -0,0 +1,312 @@
+"""Admission control for the API: per-client token buckets and a global
+limit on in-flight database work, both shared by all gunicorn workers.
+
+Every ``/api/`` request first pays a route-specific cost out of its client's
+token bucket (429 when the bucket is empty), then takes one of
+``DB_MAX_CONCURRENCY`` slots for the duration of the request. When all slots
+are busy it waits in a bounded queue for up to ``DB_QUEUE_TIMEOUT_MS``; a
+full queue or an expired wait is shed immediately with 503.
+
+Streaming endpoints (attachment uploads and downloads) are rate limited but
+hold no slot while bytes move; they take one with ``db_slot()`` around each
+of their short queries, so slow clients cannot use up database admission.
+
+With several tenants (see ``tenancy``) buckets and slots are per tenant,
+sized by the tenant's ``rate_limit_*``/``max_concurrency``/``queue_size``
+settings, so a busy hospital queues behind its own requests only.
+"""
+import math
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, jsonify, request
+
+from shared_state import SharedRegion, SlotSemaphore, key_hash as shared_key_hash
+from tenancy import DEFAULT_TENANT
+
+RATE_LIMIT_CAPACITY = float(os.getenv('RATE_LIMIT_CAPACITY', '120'))
+RATE_LIMIT_REFILL_PER_SEC = float(os.getenv('RATE_LIMIT_REFILL_PER_SEC', '20'))
+DB_MAX_CONCURRENCY = int(os.getenv('DB_MAX_CONCURRENCY', '8'))
+DB_QUEUE_SIZE = int(os.getenv('DB_QUEUE_SIZE', '32'))
+DB_QUEUE_TIMEOUT_MS = int(os.getenv('DB_QUEUE_TIMEOUT_MS', '2000'))
+
+# Token cost of a request. Point lookups are cheapest, unfiltered list
+# endpoints scan whole tables and exports serialize every row.
+POINT_COST = 1
+WRITE_COST = 2
+SCAN_COST = 5
+ROUTE_COSTS = {
+    'get_low_stock': 3,
+    'get_today_appointments': 2,
+    'get_patients_list': 3,
+    'get_doctors_list': 2,
+    'get_departments_list': 1,
+    'get_appointments_list': 5,
+    'get_test_types_list': 1,
+    'get_expiring_stock': 3,
+    'inventory_forecast': 10,
+    'get_entity_stats': 4,
+    'report_image': 10,
+    'auto_schedule_appointments': 20,
+    'reschedule_doctor_day': 10,
+    'export_patients_json': 20,
+    'export_patients_csv': 20,
+}
+
+# Endpoints that never touch the database or must stay reachable under load.
+EXEMPT_ENDPOINTS = {'index', 'static', 'static_asset', 'admission_metrics', 'resource_metrics', 'inventory_metrics',
+                    'audit_metrics', 'report_metrics', 'tenant_info', 'profile_list', 'profile_flame',
+                    'profile_detail'}
+
+# (endpoint, method) pairs that stream a body: they take a slot per query with db_slot().
+STREAMING_ENDPOINTS = {('record_attachments', 'POST'), ('patient_test_attachments', 'POST'),
+                       ('manage_attachment', 'GET')}
+
+BUCKET_SLOTS = 4096
+BUCKET_PROBES = 8
+_BUCKET = struct.Struct('<Qdd')  # key hash, tokens, last refill (epoch seconds)
+
+COUNTERS = ('admitted', 'queued', 'rejected_rate_limit', 'rejected_queue_full', 'rejected_queue_timeout')
+_COUNTER = struct.Struct('<q')
+_COUNTERS_SIZE = _COUNTER.size * len(COUNTERS)
+
+
+class Overloaded(Exception):
+    """No DB slot became free in time; answered with 503."""
+
+
+@contextmanager
+def db_slot():
+    """Holds one of the tenant's DB slots for a short section of a streaming endpoint.
+
+    A no-op when the request already holds a slot or admission is not installed;
+    raises ``Overloaded`` when shed.
+    """
+    acquire = current_app.extensions.get('admission')
+    if acquire is None or g.get('db_slot') is not None:
+        yield
+        return
+    slots, slot = acquire()
+    try:
+        yield
+    finally:
+        slots.release(slot)
+
+
+def request_cost(endpoint, method, view_args):
+    """Token cost of a request to ``endpoint``."""
+    if endpoint in ROUTE_COSTS:
+        return ROUTE_COSTS[endpoint]
+    if method not in ('GET', 'HEAD'):
+        return WRITE_COST
+    return POINT_COST if view_args else SCAN_COST
+
+
+def client_key():
+    """Identifies the caller by authenticated user, falling back to the remote address.
+
+    Never by a client-chosen header: a fresh value per request would get a
+    full bucket every time and evict other clients' buckets.
+    """
+    principal = g.get('principal')
+    if principal is not None:
+        return f"user:{principal.user_id}"
+    return f"addr:{request.remote_addr or 'unknown'}"
+
+
+class RateLimiter:
+    """Token buckets per client in a shared, fixed-size open-addressing table."""
+
+    def __init__(self, capacity=RATE_LIMIT_CAPACITY, refill_per_sec=RATE_LIMIT_REFILL_PER_SEC,
+                 region_name='rate_limit.bin'):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.region = SharedRegion(region_name, _COUNTERS_SIZE + BUCKET_SLOTS * _BUCKET.size)
+
+    def consume(self, key, cost, now=None, capacity=None, refill_per_sec=None):
+        """Takes ``cost`` tokens from ``key``'s bucket.
+
+        Returns ``(allowed, retry_after_seconds)``.
+        """
+        now = time.time() if now is None else now
+        capacity = self.capacity if capacity is None else capacity
+        refill_per_sec = self.refill_per_sec if refill_per_sec is None else refill_per_sec
+        key_hash = shared_key_hash(key)
+        start = key_hash % BUCKET_SLOTS
+        with self.region.locked() as buf:
+            victim = None
+            victim_age = None
+            for probe in range(BUCKET_PROBES):
+                offset = _COUNTERS_SIZE + ((start + probe) % BUCKET_SLOTS) * _BUCKET.size
+                slot_hash, tokens, updated = _BUCKET.unpack_from(buf, offset)
+                if slot_hash == key_hash:
+                    break
+                # Reuse the stalest probed slot; an idle bucket is full anyway.
+                if victim is None or updated < victim_age:
+                    victim, victim_age = offset, updated
+            else:
+                offset, tokens, updated = victim, capacity, now
+
+            tokens = min(capacity, tokens + (now - updated) * refill_per_sec)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            _BUCKET.pack_into(buf, offset, key_hash, tokens, now)
+            if allowed:
+                return True, 0
+            if refill_per_sec <= 0:
+                return False, 60  # The bucket never refills; any retry hint will do
+            return False, math.ceil((cost - tokens) / refill_per_sec)
+
+    def increment(self, *counters):
+        with self.region.locked() as buf:
+            for counter in counters:
+                offset = COUNTERS.index(counter) * _COUNTER.size
+                value, = _COUNTER.unpack_from(buf, offset)
+                _COUNTER.pack_into(buf, offset, value + 1)
+
+    def counters(self):
+        buf = self.region.buf
+        return {name: _COUNTER.unpack_from(buf, i * _COUNTER.size)[0] for i, name in enumerate(COUNTERS)}
+
+
+class ConcurrencyLimiter:
+    """Bounds in-flight DB work across workers, with a bounded wait queue."""
+
+    def __init__(self, limit=DB_MAX_CONCURRENCY, queue_size=DB_QUEUE_SIZE,
+                 queue_timeout_ms=DB_QUEUE_TIMEOUT_MS, name='db_slots'):
+        self.slots = SlotSemaphore(name, limit)
+        self.queue = SlotSemaphore(f'{name}_queue', queue_size) if queue_size else None
+        self.queue_timeout = queue_timeout_ms / 1000.0
+
+    def acquire(self):
+        """Returns ``(slot, reason)``; ``slot`` is ``None`` when shed."""
+        slot = self.slots.try_acquire()
+        if slot is not None:
+            return slot, None
+        if self.queue is None:
+            return None, 'rejected_queue_full'
+        ticket = self.queue.try_acquire()
+        if ticket is None:
+            return None, 'rejected_queue_full'
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+            delay = 0.002
+            while time.monotonic() < deadline:
+                time.sleep(delay)
+                slot = self.slots.try_acquire()
+                if slot is not None:
+                    return slot, 'queued'
+                delay = min(delay * 2, 0.05)
+            return None, 'rejected_queue_timeout'
+        finally:
+            self.queue.release(ticket)
+
+    def release(self, slot):
+        self.slots.release(slot)
+
+
+class TenantLimiters:
+    """One ``ConcurrencyLimiter`` per tenant, created on first use."""
+
+    def __init__(self, default=None):
+        self.default = default or ConcurrencyLimiter()
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def for_tenant(self, tenant):
+        if tenant is None or tenant.id == DEFAULT_TENANT:
+            return self.default
+        limiter = self._limiters.get(tenant.id)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(tenant.id)
+                if limiter is None:
+                    limiter = self._limiters[tenant.id] = ConcurrencyLimiter(
+                        limit=tenant.max_concurrency or DB_MAX_CONCURRENCY,
+                        queue_size=tenant.queue_size if tenant.queue_size is not None else DB_QUEUE_SIZE,
+                        name=f'db_slots_{tenant.id}')
+        return limiter
+
+    def in_flight(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+        limiters[DEFAULT_TENANT] = self.default
+        return {tenant_id: limiter.slots.held_locally() for tenant_id, limiter in sorted(limiters.items())}
+
+
+def init_admission(app, rate_limiter=None, concurrency_limiter=None):
+    """Installs the admission hooks and the ``/api/metrics/admission`` endpoint.
+
+    Runs after ``tenancy`` has resolved ``g.tenant``, when it is installed,
+    and after ``auth`` has set ``g.principal``, which keys the buckets.
+    """
+    limiter = rate_limiter or RateLimiter()
+    tenant_limiters = TenantLimiters(concurrency_limiter)
+    concurrency = tenant_limiters.default
+
+    def acquire_slot():
+        """``(slots, slot)`` for the current tenant; raises ``Overloaded`` when shed."""
+        slots = tenant_limiters.for_tenant(g.get('tenant'))
+        slot, reason = slots.acquire()
+        if slot is None:
+            limiter.increment(reason)
+            raise Overloaded()
+        if reason:
+            limiter.increment(reason)
+        return slots, slot
+
+    app.extensions['admission'] = acquire_slot
+
+    @app.before_request
+    def admit_request():
+        if not request.path.startswith('/api/') or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        if request.method == 'OPTIONS':
+            return None
+        tenant = g.get('tenant')
+        cost = request_cost(request.endpoint, request.method, request.view_args)
+        if tenant is None:
+            allowed, retry_after = limiter.consume(client_key(), cost)
+        else:
+            allowed, retry_after = limiter.consume(f"{tenant.id}:{client_key()}", cost,
+                                                   capacity=tenant.rate_limit_capacity,
+                                                   refill_per_sec=tenant.rate_limit_refill_per_sec)
+        if not allowed:
+            limiter.increment('rejected_rate_limit')
+            response = jsonify({"error": "Rate limit exceeded. Please slow down."})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+
+        if (request.endpoint, request.method) not in STREAMING_ENDPOINTS:
+            g.db_slot = acquire_slot()
+        limiter.increment('admitted')
+        return None
+
+    @app.errorhandler(Overloaded)
+    def server_busy(error):
+        response = jsonify({"error": "Server is busy. Please try again shortly."})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    @app.teardown_request
+    def release_request(error=None):
+        held = g.pop('db_slot', None)
+        if held is not None:
+            slots, slot = held
+            slots.release(slot)
+
+    @app.route('/api/metrics/admission', methods=['GET'])
+    def admission_metrics():
+        return jsonify({
+            "counters": limiter.counters(),
+            "in_flight_this_worker": concurrency.slots.held_locally(),
+            "in_flight_by_tenant": tenant_limiters.in_flight(),
+            "max_concurrency": concurrency.slots.slots,
+            "queue_size": concurrency.queue.slots if concurrency.queue else 0,
+        }), 200
+
+    return limiter, concurrency
@@ -0,0 +1,235 @@
+"""Chunked, memory-efficient DataFrame loading for the analytics reports.
+
+The report functions in 1.1.ipynb used to ``fetchall()`` a list of dicts and
+then build a DataFrame from it, holding two full copies of the data with
+object dtypes. The helpers here stream rows through a server-side cursor,
+convert each chunk to compact dtypes (categoricals for repeated strings,
+datetime64 for dates) and only ever keep the compact form. Integers stay
+int64: the reports do arithmetic on id and count columns, and a downcast
+int8/int16 column would silently wrap around.
+"""
+import os
+import re
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pandas as pd
+import pymysql
+from dotenv import load_dotenv
+from pandas.api.types import union_categoricals
+
+from db_routing import Router
+
+load_dotenv()
+
+DEFAULT_CHUNKSIZE = int(os.getenv('ANALYTICS_CHUNKSIZE', '50000'))
+
+# A string column is stored as a categorical when at most this fraction of
+# its values are distinct (gender, blood_type, status, specialization, ...).
+CATEGORY_RATIO = 0.5
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$')
+
+
+_router = None
+
+
+def get_stream_connection():
+    """Opens a streaming connection, on a healthy replica when one is configured."""
+    global _router
+    if _router is None:
+        _router = Router({
+            "host": os.getenv('DB_HOST'),
+            "port": int(os.getenv('DB_PORT')),
+            "user": os.getenv('DB_USER'),
+            "password": os.getenv('DB_PASSWORD'),
+            "database": os.getenv('DB_NAME'),
+            "charset": "utf8mb4",
+        })
+    return pymysql.connect(**_router.read_config(), cursorclass=pymysql.cursors.SSCursor)
+
+
+def _check_identifier(name):
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid column name: {name!r}")
+    return name
+
+
+def build_query(sql, filters=None, date_column=None, start=None, end=None, order_by=None):
+    """Appends WHERE and ORDER BY clauses so filtering happens in MySQL.
+
+    ``filters`` maps column names to a value (equality), a list/tuple/set
+    (``IN``) or ``None`` (``IS NULL``). ``start``/``end`` bound
+    ``date_column`` inclusively. Returns ``(sql, params)``.
+    """
+    conditions = []
+    params = []
+    for column, value in (filters or {}).items():
+        column = _check_identifier(column)
+        if value is None:
+            conditions.append(f"{column} IS NULL")
+        elif isinstance(value, (list, tuple, set)):
+            if not value:
+                conditions.append("1 = 0")
+                continue
+            conditions.append(f"{column} IN ({', '.join(['%s'] * len(value))})")
+            params.extend(value)
+        else:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+    if date_column and start is not None:
+        conditions.append(f"{_check_identifier(date_column)} >= %s")
+        params.append(start)
+    if date_column and end is not None:
+        conditions.append(f"{_check_identifier(date_column)} <= %s")
+        params.append(end)
+
+    sql = sql.strip().rstrip(';')
+    if conditions:
+        keyword = 'AND' if re.search(r'\bWHERE\b', sql, re.IGNORECASE) else 'WHERE'
+        sql += f"\n{keyword} " + ' AND '.join(conditions)
+    if order_by:
+        sql += f"\nORDER BY {order_by}"
+    return sql, tuple(params)
+
+
+def _first_valid(series):
+    index = series.first_valid_index()
+    return None if index is None else series[index]
+
+
+def compact_frame(df, categories=None):
+    """Converts a freshly built chunk to compact dtypes."""
+    for column in df.columns:
+        series = df[column]
+        if series.dtype != object and not isinstance(series.dtype, pd.StringDtype):
+            continue
+        sample = _first_valid(series)
+        if sample is None:
+            continue
+        if isinstance(sample, bool):
+            continue
+        if isinstance(sample, int):
+            df[column] = pd.to_numeric(series)
+        elif isinstance(sample, (Decimal, float)):
+            # Money columns become float64 for vectorized sums. That is binary floating
+            # point, not exact decimal arithmetic: round report totals to cents.
+            df[column] = pd.to_numeric(series, errors='coerce').astype('float64')
+        elif isinstance(sample, (datetime, date)):
+            df[column] = pd.to_datetime(series, errors='coerce')
+        elif isinstance(sample, timedelta):
+            df[column] = pd.to_timedelta(series, errors='coerce')
+        elif isinstance(sample, str):
+            forced = categories is not None and column in categories
+            if forced or series.nunique(dropna=True) <= CATEGORY_RATIO * len(series):
+                df[column] = series.astype('category')
+    return df
+
+
+def stream_frames(sql, params=None, chunksize=DEFAULT_CHUNKSIZE, categories=None, connection=None):
+    """Yields compact DataFrame chunks for ``sql`` using a server-side cursor."""
+    owns_connection = connection is None
+    if owns_connection:
+        connection = get_stream_connection()
+    cursor = connection.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute(sql, params or ())
+        columns = [col[0] for col in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield compact_frame(pd.DataFrame.from_records(rows, columns=columns), categories)
+    finally:
+        cursor.close()
+        if owns_connection:
+            connection.close()
+
+
+def _concat(frames):
+    if len(frames) == 1:
+        return frames[0]
+    columns = list(frames[0].columns)
+    cat_columns = [c for c in columns
+                   if all(isinstance(f[c].dtype, pd.CategoricalDtype) for f in frames)]
+    merged = {c: union_categoricals([f[c] for f in frames], ignore_order=True) for c in cat_columns}
+    df = pd.concat([f.drop(columns=cat_columns) for f in frames], ignore_index=True)
+    for column in cat_columns:
+        df[column] = pd.Categorical(merged[column])
+    return df[columns]
+
+
+def load_frame(sql, params=None, chunksize=DEFAULT_CHUNKSIZE, categories=None, connection=None):
+    """Loads a whole result set as one compact DataFrame.
+
+    Only compact chunks are ever held in memory, so peak usage is roughly the
+    size of the final frame plus one chunk. Returns an empty DataFrame when
+    the query matches no rows.
+    """
+    frames = list(stream_frames(sql, params, chunksize, categories, connection))
+    if not frames:
+        return pd.DataFrame()
+    return _concat(frames)
+
+
+def _plain_index(part):
+    """Drops empty groups and turns a categorical index into a plain one."""
+    part = part[part != 0]
+    if isinstance(part.index, pd.CategoricalIndex):
+        part.index = part.index.astype(object)
+    elif isinstance(part.index, pd.MultiIndex):
+        part.index = pd.MultiIndex.from_tuples(list(part.index), names=part.index.names)
+    return part
+
+
+def chunked_groupby(sql, by, params=None, value=None, how='count',
+                    chunksize=DEFAULT_CHUNKSIZE, connection=None):
+    """Aggregates a result set chunk by chunk without materializing it.
+
+    ``how`` is ``'count'`` (rows per group, or non-null ``value`` per group)
+    or ``'sum'`` (sum of ``value`` per group). Works for data sets larger
+    than memory since only the running per-group totals are kept.
+    """
+    if how not in ('count', 'sum'):
+        raise ValueError("how must be 'count' or 'sum'")
+    total = None
+    for chunk in stream_frames(sql, params, chunksize, connection=connection):
+        grouped = chunk.groupby(by, observed=True)
+        part = grouped.size() if value is None else getattr(grouped[value], how)()
+        part = _plain_index(part)
+        total = part if total is None else total.add(part, fill_value=0)
+    if total is None:
+        return pd.Series(dtype='float64')
+    return total.sort_values(ascending=False)
+
+
+def count_values(sql, count_columns, keep_columns=(), params=None,
+                 chunksize=DEFAULT_CHUNKSIZE, connection=None):
+    """Counts the values of several columns in a single streaming pass.
+
+    Only ``keep_columns`` are retained row by row (e.g. ages for a box plot),
+    everything else is reduced to per-chunk ``value_counts`` as it arrives.
+    Returns ``(counts, frame)`` where ``counts`` maps each column to its
+    value counts in descending order.
+    """
+    counts = {column: None for column in count_columns}
+    kept = []
+    for chunk in stream_frames(sql, params, chunksize, connection=connection):
+        for column in count_columns:
+            part = _plain_index(chunk[column].value_counts())
+            counts[column] = part if counts[column] is None else counts[column].add(part, fill_value=0)
+        if keep_columns:
+            kept.append(chunk[list(keep_columns)])
+    for column, total in counts.items():
+        if total is None:
+            counts[column] = pd.Series(dtype='int64', name='count')
+        else:
+            counts[column] = total.astype('int64').sort_values(ascending=False)
+    frame = _concat(kept) if kept else pd.DataFrame(columns=list(keep_columns))
+    return counts, frame
+
+
+def chunked_value_counts(sql, column, params=None, chunksize=DEFAULT_CHUNKSIZE, connection=None):
+    """Equivalent of ``load_frame(sql)[column].value_counts()`` in constant memory."""
+    counts, _ = count_values(sql, [column], params=params, chunksize=chunksize, connection=connection)
+    return counts[column]
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, jsonify, send_file
 import pymysql
 from datetime import datetime, timedelta
 import os
@@ -6,6 +6,29 @@ from dotenv import load_dotenv
 import io
 import json
 from flask_cors import CORS # Import CORS
+from admission import init_admission
+import db_resilience
+from db_resilience import CircuitOpenError
+from db_routing import DB_REPLICA_MAX_LAG_S
+from tenancy import DEFAULT_TENANT, TenantRegistry, current_tenant_id, use_tenant
+from auth import init_auth
+from profiling import init_profiling
+from static_assets import init_static_assets
+from resources import Resource, Session, register_resource, stats as resource_stats
+from coalesce import coalesced, flights, init_coalescing
+from query_cache import QueryCache, TableVersions
+from reference_data import ReferenceSnapshot, ReferenceTable
+from inventory import init_inventory
+from stats import init_stats
+from audit import init_audit
+from attachments import init_attachments
+from report_images import init_report_images
+from patient_matching import init_patient_matching, on_patient_write
+from claims import init_claims
+from dunning import init_dunning
+from scheduler import init_scheduler
+from archive import init_archive
+from sequences import init_sequences
 
 
 load_dotenv()
@@ -13,7 +36,7 @@ load_dotenv()
 # Flask app initialization
 app = Flask(__name__)
 CORS(app) # Enable CORS for all origins by default (for development)
-# Database configuration
+# Database configuration (defaults for every hospital in TENANTS_FILE)
 db_config = {
     "host": os.getenv('DB_HOST'),
     "port": int(os.getenv('DB_PORT')),
@@ -24,9 +47,25 @@ db_config = {
     "cursorclass": pymysql.cursors.DictCursor
 }
 
+# Each request is served from its hospital's database; reads go to that hospital's
+# healthy replicas, writes and recent writers to its primary
+tenants = TenantRegistry(db_config)
+tenants.init_app(app)
+
 def get_db_connection():
-    """Establishes a new database connection."""
-    return pymysql.connect(**db_config)
+    """Establishes a new database connection bounded by the route's query deadline."""
+    return tenants.connect()
+
+init_auth(app, get_db_connection) # Signed-token login and per-route role checks
+init_admission(app) # Per-tenant, per-user rate limits and caps on in-flight DB work
+init_profiling(app) # cProfile and stack samples of requests that ask for it, or a sampled few
+init_coalescing(app) # Identical concurrent GETs share one query
+
+# Reference data and dropdown lists are cached per worker and invalidated through
+# shared per-table versions; with replicas, results read right after a write are
+# not cached until replication has had time to catch up.
+query_cache = QueryCache(TableVersions(namespace=current_tenant_id),
+                         settle_s=DB_REPLICA_MAX_LAG_S if tenants.has_replicas() else 0.0)
 
 # --- Error Handlers ---
 @app.errorhandler(404)
@@ -41,1004 +80,240 @@ def internal_error(error):
 def bad_request(error):
     return jsonify({"error": "Bad request. Please check your request data."}), 400
 
+@app.errorhandler(CircuitOpenError)
+def database_unavailable(error):
+    response = jsonify({"error": "Database is temporarily unavailable. Please try again shortly."})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
 # --- Frontend Routes ---
-@app.route('/')
-def index():
-    return render_template('index.html')
+init_static_assets(app) # Index rendered once; hashed, precompressed assets after `flask build-assets`
 
 # -----------------------------------------------------------
 # API Endpoints (from your provided 1.1.py, kept as is)
 # -----------------------------------------------------------
 
-# --- Patients API ---
-@app.route('/api/patients', methods=['GET', 'POST'])
-@app.route('/api/patients/<int:patient_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_patients(patient_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if patient_id:
-                cursor.execute("SELECT * FROM patient WHERE patient_id = %s", (patient_id,))
-                patient = cursor.fetchone()
-                if patient:
-                    # Convert date/time objects to strings if present
-                    for key, value in patient.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            patient[key] = str(value)
-                    return jsonify(patient), 200
-                return jsonify({"error": "Patient not found"}), 404
-            else:
-                cursor.execute("SELECT patient_id, name, age, gender, blood_type, phone, email, disease, created_at as registrationDate FROM patient")
-                patients = cursor.fetchall()
-                # Convert date/time objects to strings for all patients
-                for p in patients:
-                    for key, value in p.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            p[key] = str(value)
-                return jsonify(patients), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['name', 'age', 'gender']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = """
-            INSERT INTO patient (name, age, gender, blood_type, address, phone, email, 
-                                insurance_provider_id, insurance_policy_number, primary_physician,
-                                emergency_contact, emergency_phone, medical_history,
-                                current_medications, allergies, disease)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (
-                data['name'], data['age'], data['gender'], data.get('blood_type'), data.get('address'),
-                data.get('phone'), data.get('email'), data.get('insurance_provider_id'),
-                data.get('insurance_policy_number'), data.get('primary_physician'),
-                data.get('emergency_contact'), data.get('emergency_phone'), data.get('medical_history'),
-                data.get('current_medications'), data.get('allergies'), data.get('disease')
-            ))
-            conn.commit()
-            return jsonify({"message": "Patient added successfully", "id": cursor.lastrowid}), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            if not data:
-                return jsonify({"error": "No data provided for update"}), 400
-            
-            updates = {k: v for k, v in data.items() if v is not None}
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(patient_id)
-            
-            sql = f"UPDATE patient SET {set_clause} WHERE patient_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Patient updated successfully"}), 200
-            return jsonify({"error": "Patient not found"}), 404
-        
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM patient WHERE patient_id = %s", (patient_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Patient deleted successfully"}), 200
-            return jsonify({"error": "Patient not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Doctors API ---
-@app.route('/api/doctors', methods=['GET', 'POST'])
-@app.route('/api/doctors/<int:doctor_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_doctors(doctor_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if doctor_id:
-                cursor.execute("""
-                    SELECT d.*, dept.name as department_name 
-                    FROM doctor d 
-                    LEFT JOIN department dept ON d.department_id = dept.department_id 
-                    WHERE d.doctor_id = %s
-                """, (doctor_id,))
-                doctor = cursor.fetchone()
-                if doctor:
-                    for key, value in doctor.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            doctor[key] = str(value)
-                    return jsonify(doctor), 200
-                return jsonify({"error": "Doctor not found"}), 404
-            else:
-                cursor.execute("""
-                    SELECT d.doctor_id, d.name, d.specialization, d.department_id, 
-                           d.years_of_experience as experience, d.consultation_fee as fee, 
-                           dept.name as departmentName, d.phone, d.email, d.availability, d.bio
-                    FROM doctor d
-                    LEFT JOIN department dept ON d.department_id = dept.department_id
-                """)
-                doctors = cursor.fetchall()
-                for d in doctors:
-                    for key, value in d.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            d[key] = str(value)
-                return jsonify(doctors), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['name', 'specialization', 'consultation_fee']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = """
-            INSERT INTO doctor (name, specialization, department_id, qualification, years_of_experience,
-                                phone, email, consultation_fee, availability, bio)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (
-                data['name'], data['specialization'], data.get('department_id'), data.get('qualification'),
-                data.get('years_of_experience'), data.get('phone'), data.get('email'),
-                data['consultation_fee'], data.get('availability'), data.get('bio')
-            ))
-            conn.commit()
-            return jsonify({"message": "Doctor added successfully", "id": cursor.lastrowid}), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            updates = {k: v for k, v in data.items() if v is not None}
-            if not updates:
-                return jsonify({"error": "No data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(doctor_id)
-            
-            sql = f"UPDATE doctor SET {set_clause} WHERE doctor_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Doctor updated successfully"}), 200
-            return jsonify({"error": "Doctor not found"}), 404
-        
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM doctor WHERE doctor_id = %s", (doctor_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Doctor deleted successfully"}), 200
-            return jsonify({"error": "Doctor not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Appointments API ---
-@app.route('/api/appointments', methods=['GET', 'POST'])
-@app.route('/api/appointments/<int:appointment_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_appointments(appointment_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if appointment_id:
-                cursor.execute("""
-                    SELECT a.*, p.name as patient_name, d.name as doctor_name
-                    FROM appointment a
-                    JOIN patient p ON a.patient_id = p.patient_id
-                    JOIN doctor d ON a.doctor_id = d.doctor_id
-                    WHERE a.appointment_id = %s
-                """, (appointment_id,))
-                appointment = cursor.fetchone()
-                if appointment:
-                    for key, value in appointment.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            appointment[key] = str(value)
-                    return jsonify(appointment), 200
-                return jsonify({"error": "Appointment not found"}), 404
-            else:
-                cursor.execute("""
-                    SELECT a.appointment_id as id, a.date, a.time, a.status, a.reason,
-                           p.patient_id, p.name as patientName,
-                           d.doctor_id, d.name as doctorName, d.specialization
-                    FROM appointment a
-                    JOIN patient p ON a.patient_id = p.patient_id
-                    JOIN doctor d ON a.doctor_id = d.doctor_id
-                    ORDER BY a.date, a.time
-                """)
-                appointments = cursor.fetchall()
-                for a in appointments:
-                    for key, value in a.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            a[key] = str(value)
-                return jsonify(appointments), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['patient_id', 'doctor_id', 'date', 'time']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = """
-            INSERT INTO appointment (patient_id, doctor_id, date, time, duration, reason, notes, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (
-                data['patient_id'], data['doctor_id'], data['date'], data['time'],
-                data.get('duration', 30), data.get('reason'), data.get('notes'), data.get('status', 'Scheduled')
-            ))
-            conn.commit()
-            return jsonify({
-                "message": "Appointment scheduled successfully",
-                "id": cursor.lastrowid,
-                "invoice_number": f"APT-{cursor.lastrowid:04d}-{datetime.now().strftime('%Y%m%d')}"
-            }), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            allowed_fields = ['date', 'time', 'duration', 'reason', 'notes', 'status', 'patient_id', 'doctor_id']
-            updates = {k: v for k, v in data.items() if k in allowed_fields and v is not None}
-            
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(appointment_id)
-            
-            sql = f"UPDATE appointment SET {set_clause} WHERE appointment_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Appointment updated successfully"}), 200
-            return jsonify({"error": "Appointment not found"}), 404
-
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM appointment WHERE appointment_id = %s", (appointment_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Appointment canceled successfully"}), 200
-            return jsonify({"error": "Appointment not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Billing API ---
-@app.route('/api/bills', methods=['GET', 'POST'])
-@app.route('/api/bills/<int:bill_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_bills(bill_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if bill_id:
-                cursor.execute("""
-                    SELECT b.*, p.name as patient_name, d.name as doctor_name
-                    FROM billing b
-                    JOIN patient p ON b.patient_id = p.patient_id
-                    LEFT JOIN doctor d ON b.doctor_id = d.doctor_id
-                    WHERE b.bill_id = %s
-                """, (bill_id,))
-                bill = cursor.fetchone()
-                if bill:
-                    for key, value in bill.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            bill[key] = str(value)
-                    # Handle 'items' JSON string
-                    if 'items' in bill and bill['items']:
-                        try:
-                            bill['items'] = json.loads(bill['items'])
-                        except json.JSONDecodeError:
-                            bill['items'] = [] # Or handle as error
-                    return jsonify(bill), 200
-                return jsonify({"error": "Bill not found"}), 404
-            else:
-                cursor.execute("""
-                    SELECT b.bill_id as id, b.invoice_number as invoiceNumber, b.amount, b.status, b.date,
-                           b.payment_method as paymentMethod,
-                           p.patient_id, p.name as patientName,
-                           d.doctor_id, d.name as doctorName
-                    FROM billing b
-                    JOIN patient p ON b.patient_id = p.patient_id
-                    LEFT JOIN doctor d ON b.doctor_id = d.doctor_id
-                    ORDER BY b.date DESC
-                """)
-                bills = cursor.fetchall()
-                for b in bills:
-                    for key, value in b.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            b[key] = str(value)
-                    # Handle 'items' JSON string
-                    if 'items' in b and b['items']:
-                        try:
-                            b['items'] = json.loads(b['items'])
-                        except json.JSONDecodeError:
-                            b['items'] = [] # Or handle as error
-                return jsonify(bills), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['patient_id', 'amount']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            invoice_number = f"INV-{datetime.now().strftime('%Y%m%d')}-{data['patient_id']:04d}"
-            due_date = data.get('due_date') or (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            
-            sql = """
-            INSERT INTO billing (patient_id, doctor_id, appointment_id, invoice_number,
-                                amount, tax, discount, date, due_date, status, payment_method, items)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (
-                data['patient_id'], data.get('doctor_id'), data.get('appointment_id'), invoice_number,
-                data['amount'], data.get('tax', 0.00), data.get('discount', 0.00), 
-                data.get('date', datetime.now().strftime('%Y-%m-%d')),
-                due_date, data.get('status', 'Unpaid'), data.get('payment_method'), 
-                json.dumps(data.get('items', [])) if data.get('items') else None
-            ))
-            conn.commit()
-            return jsonify({
-                "message": "Bill generated successfully", 
-                "id": cursor.lastrowid,
-                "invoice_number": invoice_number
-            }), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            allowed_fields = ['amount', 'tax', 'discount', 'status', 'payment_method', 'items', 'patient_id', 'doctor_id', 'appointment_id']
-            updates = {k: v for k, v in data.items() if k in allowed_fields and v is not None}
-            
-            if 'items' in updates:
-                updates['items'] = json.dumps(updates['items'])
-            
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(bill_id)
-            
-            sql = f"UPDATE billing SET {set_clause} WHERE bill_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Bill updated successfully"}), 200
-            return jsonify({"error": "Bill not found"}), 404
-
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM billing WHERE bill_id = %s", (bill_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Bill deleted successfully"}), 200
-            return jsonify({"error": "Bill not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Medical Records API ---
-@app.route('/api/records', methods=['GET', 'POST'])
-@app.route('/api/records/<int:record_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_records(record_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if record_id:
-                cursor.execute("""
-                    SELECT mr.*, p.name as patient_name, d.name as doctor_name
-                    FROM medical_record mr
-                    JOIN patient p ON mr.patient_id = p.patient_id
-                    LEFT JOIN doctor d ON mr.doctor_id = d.doctor_id
-                    WHERE mr.record_id = %s
-                """, (record_id,))
-                record = cursor.fetchone()
-                if record:
-                    for key, value in record.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            record[key] = str(value)
-                    return jsonify(record), 200
-                return jsonify({"error": "Medical record not found"}), 404
-            else:
-                cursor.execute("""
-                    SELECT mr.record_id as id, mr.diagnosis, mr.date, 
-                           mr.treatment, mr.prescription, mr.notes,
-                           p.patient_id, p.name as patientName,
-                           d.doctor_id, d.name as doctorName
-                    FROM medical_record mr
-                    JOIN patient p ON mr.patient_id = p.patient_id
-                    LEFT JOIN doctor d ON mr.doctor_id = d.doctor_id
-                    ORDER BY mr.date DESC
-                """)
-                records = cursor.fetchall()
-                for r in records:
-                    for key, value in r.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            r[key] = str(value)
-                return jsonify(records), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['patient_id', 'diagnosis']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = """
-            INSERT INTO medical_record (patient_id, doctor_id, visit_type, diagnosis, symptoms,
-                                      treatment, prescription, tests_ordered, test_results,
-                                      notes, follow_up_required, follow_up_date, date)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (
-                data['patient_id'], data.get('doctor_id'), data.get('visit_type'), data['diagnosis'],
-                data.get('symptoms'), data.get('treatment'), data.get('prescription'),
-                data.get('tests_ordered'), data.get('test_results'), data.get('notes'),
-                data.get('follow_up_required', False), data.get('follow_up_date'),
-                data.get('date', datetime.now().strftime('%Y-%m-%d'))
-            ))
-            conn.commit()
-            return jsonify({"message": "Medical record added successfully", "id": cursor.lastrowid}), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            allowed_fields = ['diagnosis', 'symptoms', 'treatment', 'prescription', 
-                            'tests_ordered', 'test_results', 'notes', 'follow_up_required', 
-                            'follow_up_date', 'patient_id', 'doctor_id', 'visit_type', 'date']
-            updates = {k: v for k, v in data.items() if k in allowed_fields and v is not None}
-            
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(record_id)
-            
-            sql = f"UPDATE medical_record SET {set_clause} WHERE record_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Medical record updated successfully"}), 200
-            return jsonify({"error": "Medical record not found"}), 404
-
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM medical_record WHERE record_id = %s", (record_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Medical record deleted successfully"}), 200
-            return jsonify({"error": "Medical record not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Departments API ---
-@app.route('/api/departments', methods=['GET', 'POST'])
-@app.route('/api/departments/<int:department_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_departments(department_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if department_id:
-                cursor.execute("SELECT * FROM department WHERE department_id = %s", (department_id,))
-                department = cursor.fetchone()
-                if department:
-                    for key, value in department.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            department[key] = str(value)
-                    return jsonify(department), 200
-                return jsonify({"error": "Department not found"}), 404
-            else:
-                cursor.execute("SELECT department_id as id, name FROM department")
-                departments = cursor.fetchall()
-                for d in departments:
-                    for key, value in d.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            d[key] = str(value)
-                return jsonify(departments), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['name']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = "INSERT INTO department (name, head_of_department, phone, email, description) VALUES (%s, %s, %s, %s, %s)"
-            cursor.execute(sql, (
-                data['name'], data.get('head_of_department'), data.get('phone'), 
-                data.get('email'), data.get('description')
-            ))
-            conn.commit()
-            return jsonify({"message": "Department added successfully", "id": cursor.lastrowid}), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            allowed_fields = ['name', 'head_of_department', 'phone', 'email', 'description']
-            updates = {k: v for k, v in data.items() if k in allowed_fields and v is not None}
-            
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(department_id)
-            
-            sql = f"UPDATE department SET {set_clause} WHERE department_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Department updated successfully"}), 200
-            return jsonify({"error": "Department not found"}), 404
-
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM department WHERE department_id = %s", (department_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Department deleted successfully"}), 200
-            return jsonify({"error": "Department not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Staff API ---
-@app.route('/api/staff', methods=['GET', 'POST'])
-@app.route('/api/staff/<int:staff_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_staff(staff_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if staff_id:
-                cursor.execute("""
-                    SELECT s.*, d.name as department_name 
-                    FROM staff s 
-                    LEFT JOIN department d ON s.department_id = d.department_id 
-                    WHERE s.staff_id = %s
-                """, (staff_id,))
-                staff = cursor.fetchone()
-                if staff:
-                    for key, value in staff.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            staff[key] = str(value)
-                    return jsonify(staff), 200
-                return jsonify({"error": "Staff member not found"}), 404
-            else:
-                cursor.execute("""
-                    SELECT s.staff_id as id, s.name, s.role, s.department_id, 
-                           s.phone, s.email, d.name as departmentName
-                    FROM staff s
-                    LEFT JOIN department d ON s.department_id = d.department_id
-                """)
-                staff_members = cursor.fetchall()
-                for s in staff_members:
-                    for key, value in s.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            s[key] = str(value)
-                return jsonify(staff_members), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['name', 'role']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = "INSERT INTO staff (name, role, department_id, phone, email, address, hire_date) VALUES (%s, %s, %s, %s, %s, %s, %s)"
-            cursor.execute(sql, (
-                data['name'], data['role'], data.get('department_id'), data.get('phone'), 
-                data.get('email'), data.get('address'), data.get('hire_date', datetime.now().date())
-            ))
-            conn.commit()
-            return jsonify({"message": "Staff member added successfully", "id": cursor.lastrowid}), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            allowed_fields = ['name', 'role', 'department_id', 'phone', 'email', 'address', 'hire_date']
-            updates = {k: v for k, v in data.items() if k in allowed_fields and v is not None}
-            
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(staff_id)
-            
-            sql = f"UPDATE staff SET {set_clause} WHERE staff_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Staff member updated successfully"}), 200
-            return jsonify({"error": "Staff member not found"}), 404
-
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM staff WHERE staff_id = %s", (staff_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Staff member deleted successfully"}), 200
-            return jsonify({"error": "Staff member not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Insurance API ---
-@app.route('/api/insurance', methods=['GET', 'POST'])
-@app.route('/api/insurance/<int:provider_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_insurance(provider_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if provider_id:
-                cursor.execute("SELECT * FROM insurance_provider WHERE provider_id = %s", (provider_id,))
-                provider = cursor.fetchone()
-                if provider:
-                    for key, value in provider.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            provider[key] = str(value)
-                    return jsonify(provider), 200
-                return jsonify({"error": "Insurance provider not found"}), 404
-            else:
-                cursor.execute("SELECT provider_id as id, name, contact_person as contact, phone FROM insurance_provider")
-                providers = cursor.fetchall()
-                for p in providers:
-                    for key, value in p.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            p[key] = str(value)
-                return jsonify(providers), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['name']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = "INSERT INTO insurance_provider (name, contact_person, phone, email, address, website) VALUES (%s, %s, %s, %s, %s, %s)"
-            cursor.execute(sql, (
-                data['name'], data.get('contact_person'), data.get('phone'), 
-                data.get('email'), data.get('address'), data.get('website')
-            ))
-            conn.commit()
-            return jsonify({"message": "Insurance provider added successfully", "id": cursor.lastrowid}), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            allowed_fields = ['name', 'contact_person', 'phone', 'email', 'address', 'website']
-            updates = {k: v for k, v in data.items() if k in allowed_fields and v is not None}
-            
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(provider_id)
-            
-            sql = f"UPDATE insurance_provider SET {set_clause} WHERE provider_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Insurance provider updated successfully"}), 200
-            return jsonify({"error": "Insurance provider not found"}), 404
-
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM insurance_provider WHERE provider_id = %s", (provider_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Insurance provider deleted successfully"}), 200
-            return jsonify({"error": "Insurance provider not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Tests API ---
-@app.route('/api/tests/types', methods=['GET', 'POST'])
-@app.route('/api/tests/types/<int:test_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_test_types(test_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if test_id:
-                cursor.execute("SELECT * FROM test_type WHERE test_id = %s", (test_id,))
-                test = cursor.fetchone()
-                if test:
-                    for key, value in test.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            test[key] = str(value)
-                    return jsonify(test), 200
-                return jsonify({"error": "Test type not found"}), 404
-            else:
-                cursor.execute("SELECT test_id as id, name, cost FROM test_type")
-                tests = cursor.fetchall()
-                for t in tests:
-                    for key, value in t.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            t[key] = str(value)
-                return jsonify(tests), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['name', 'cost']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = "INSERT INTO test_type (name, cost, description, preparation_instructions, turnaround_time) VALUES (%s, %s, %s, %s, %s)"
-            cursor.execute(sql, (
-                data['name'], data['cost'], data.get('description'), 
-                data.get('preparation_instructions'), data.get('turnaround_time')
-            ))
-            conn.commit()
-            return jsonify({"message": "Test type added successfully", "id": cursor.lastrowid}), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            allowed_fields = ['name', 'cost', 'description', 'preparation_instructions', 'turnaround_time']
-            updates = {k: v for k, v in data.items() if k in allowed_fields and v is not None}
-            
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(test_id)
-            
-            sql = f"UPDATE test_type SET {set_clause} WHERE test_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Test type updated successfully"}), 200
-            return jsonify({"error": "Test type not found"}), 404
-
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM test_type WHERE test_id = %s", (test_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Test type deleted successfully"}), 200
-            return jsonify({"error": "Test type not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Patient Tests API ---
-@app.route('/api/tests/patients', methods=['GET', 'POST'])
-@app.route('/api/tests/patients/<int:patient_test_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_patient_tests(patient_test_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if patient_test_id:
-                cursor.execute("""
-                    SELECT pt.*, p.name as patient_name, d.name as doctor_name, tt.name as test_name
-                    FROM patient_test pt
-                    JOIN patient p ON pt.patient_id = p.patient_id
-                    LEFT JOIN doctor d ON pt.doctor_id = d.doctor_id
-                    JOIN test_type tt ON pt.test_id = tt.test_id
-                    WHERE pt.patient_test_id = %s
-                """, (patient_test_id,))
-                test = cursor.fetchone()
-                if test:
-                    for key, value in test.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            test[key] = str(value)
-                    return jsonify(test), 200
-                return jsonify({"error": "Patient test not found"}), 404
-            else:
-                cursor.execute("""
-                    SELECT pt.patient_test_id as id, pt.date_ordered as dateOrdered, pt.status,
-                           p.patient_id, p.name as patientName,
-                           d.doctor_id, d.name as doctorName,
-                           tt.test_id, tt.name as testName
-                    FROM patient_test pt
-                    JOIN patient p ON pt.patient_id = p.patient_id
-                    LEFT JOIN doctor d ON pt.doctor_id = d.doctor_id
-                    JOIN test_type tt ON pt.test_id = tt.test_id
-                    ORDER BY pt.date_ordered DESC
-                """)
-                tests = cursor.fetchall()
-                for t in tests:
-                    for key, value in t.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            t[key] = str(value)
-                return jsonify(tests), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['patient_id', 'test_id']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = """
-            INSERT INTO patient_test (patient_id, doctor_id, test_id, date_ordered, date_completed, results, status, notes)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (
-                data['patient_id'], data.get('doctor_id'), data['test_id'], 
-                data.get('date_ordered', datetime.now().date()), data.get('date_completed'),
-                data.get('results'), data.get('status', 'Ordered'), data.get('notes')
-            ))
-            conn.commit()
-            return jsonify({"message": "Patient test added successfully", "id": cursor.lastrowid}), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            allowed_fields = ['date_completed', 'results', 'status', 'notes', 'patient_id', 'doctor_id', 'test_id', 'date_ordered']
-            updates = {k: v for k, v in data.items() if k in allowed_fields and v is not None}
-            
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(patient_test_id)
-            
-            sql = f"UPDATE patient_test SET {set_clause} WHERE patient_test_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Patient test updated successfully"}), 200
-            return jsonify({"error": "Patient test not found"}), 404
-
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM patient_test WHERE patient_test_id = %s", (patient_test_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Patient test deleted successfully"}), 200
-            return jsonify({"error": "Patient test not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
-# --- Inventory API ---
-@app.route('/api/inventory', methods=['GET', 'POST'])
-@app.route('/api/inventory/<int:item_id>', methods=['GET', 'PUT', 'DELETE'])
-def manage_inventory(item_id=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        if request.method == 'GET':
-            if item_id:
-                cursor.execute("SELECT * FROM inventory WHERE item_id = %s", (item_id,))
-                item = cursor.fetchone()
-                if item:
-                    for key, value in item.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            item[key] = str(value)
-                    return jsonify(item), 200
-                return jsonify({"error": "Inventory item not found"}), 404
-            else:
-                cursor.execute("SELECT item_id as id, name, category, quantity, unit, price, supplier, expiry_date as expiryDate, threshold FROM inventory ORDER BY name")
-                items = cursor.fetchall()
-                for i in items:
-                    for key, value in i.items():
-                        if isinstance(value, (datetime, timedelta)):
-                            i[key] = str(value)
-                return jsonify(items), 200
-
-        elif request.method == 'POST':
-            data = request.json
-            required_fields = ['name', 'category', 'quantity', 'unit', 'price']
-            if not all(field in data for field in required_fields):
-                return jsonify({"error": "Missing required fields"}), 400
-                
-            sql = """
-            INSERT INTO inventory (name, category, quantity, unit, price, supplier, expiry_date, 
-                                  threshold, last_restocked, location, description)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (
-                data['name'], data['category'], data['quantity'], data['unit'], data['price'],
-                data.get('supplier'), data.get('expiry_date'), data.get('threshold', 10),
-                data.get('last_restocked', datetime.now().date()), data.get('location'),
-                data.get('description')
-            ))
-            conn.commit()
-            return jsonify({"message": "Inventory item added successfully", "id": cursor.lastrowid}), 201
-
-        elif request.method == 'PUT':
-            data = request.json
-            allowed_fields = ['name', 'category', 'quantity', 'unit', 'price', 'supplier', 
-                            'expiry_date', 'threshold', 'last_restocked', 'location', 'description']
-            updates = {k: v for k, v in data.items() if k in allowed_fields and v is not None}
-            
-            if not updates:
-                return jsonify({"error": "No valid data provided for update"}), 400
-            
-            set_clause = ', '.join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(item_id)
-            
-            sql = f"UPDATE inventory SET {set_clause} WHERE item_id = %s"
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Inventory item updated successfully"}), 200
-            return jsonify({"error": "Inventory item not found"}), 404
-
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM inventory WHERE item_id = %s", (item_id,))
-            conn.commit()
-            if cursor.rowcount > 0:
-                return jsonify({"message": "Inventory item deleted successfully"}), 200
-            return jsonify({"error": "Inventory item not found"}), 404
-
-    except pymysql.Error as e:
-        conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+# --- CRUD Resources ---
+# Each entity is declared once; resources.register_resource generates the
+# GET/POST /api/<entity> and GET/PUT/DELETE /api/<entity>/<id> routes under
+# the endpoint name manage_<entity>.
+
+def _today():
+    return datetime.now().strftime('%Y-%m-%d')
+
+# Invoice and appointment numbers come from per-day sequences, reserved in blocks per worker
+numbers = init_sequences(app, tenants.connect_primary)
+
+def _appointment_number(data):
+    # Taken before the INSERT: a failed reservation then fails the request with
+    # nothing written, so a retry cannot create a second appointment.
+    return {"appointment_number": numbers.next_number('APT')}
+
+def _bill_numbers(data):
+    return {
+        "invoice_number": numbers.next_number('INV'),
+        "due_date": data.get('due_date') or (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d'),
+    }
+
+RESOURCES = [
+    Resource(
+        'patients', 'patient', 'patient_id', '/api/patients', 'Patient',
+        insert_columns=['name', 'age', 'gender', 'blood_type', 'address', 'phone', 'email',
+                        'insurance_provider_id', 'insurance_policy_number', 'primary_physician',
+                        'emergency_contact', 'emergency_phone', 'medical_history',
+                        'current_medications', 'allergies', 'disease'],
+        required=['name', 'age', 'gender'],
+        list_columns="patient_id, name, age, gender, blood_type, phone, email, disease, created_at as registrationDate",
+        on_write=on_patient_write,
+    ),
+    Resource(
+        'doctors', 'doctor', 'doctor_id', '/api/doctors', 'Doctor',
+        insert_columns=['name', 'specialization', 'department_id', 'qualification', 'years_of_experience',
+                        'phone', 'email', 'consultation_fee', 'availability', 'bio'],
+        required=['name', 'specialization', 'consultation_fee'],
+        alias='d', joins=["LEFT JOIN department dept ON d.department_id = dept.department_id"],
+        detail_columns="dept.name as department_name",
+        list_columns="""d.doctor_id, d.name, d.specialization, d.department_id,
+                        d.years_of_experience as experience, d.consultation_fee as fee,
+                        dept.name as departmentName, d.phone, d.email, d.availability, d.bio""",
+        cached=True,
+    ),
+    Resource(
+        'appointments', 'appointment', 'appointment_id', '/api/appointments', 'Appointment',
+        insert_columns=['appointment_number', 'patient_id', 'doctor_id', 'date', 'time', 'duration', 'reason',
+                        'notes', 'status'],
+        required=['patient_id', 'doctor_id', 'date', 'time'],
+        defaults={'duration': 30, 'status': 'Scheduled'},
+        alias='a', joins=["JOIN patient p ON a.patient_id = p.patient_id",
+                          "JOIN doctor d ON a.doctor_id = d.doctor_id"],
+        detail_columns="p.name as patient_name, d.name as doctor_name",
+        list_columns="""a.appointment_id as id, a.appointment_number as appointmentNumber,
+                        a.date, a.time, a.status, a.reason,
+                        p.patient_id, p.name as patientName,
+                        d.doctor_id, d.name as doctorName, d.specialization""",
+        order_by="a.date, a.time",
+        updatable=['date', 'time', 'duration', 'reason', 'notes', 'status', 'patient_id', 'doctor_id'],
+        added='scheduled', deleted='canceled',
+        archive_table='appointment_archive',
+        prepare_insert=_appointment_number,
+        created_extras=lambda data, computed, new_id: {"appointment_number": computed['appointment_number']},
+    ),
+    Resource(
+        'bills', 'billing', 'bill_id', '/api/bills', 'Bill',
+        insert_columns=['patient_id', 'doctor_id', 'appointment_id', 'invoice_number', 'amount', 'tax',
+                        'discount', 'date', 'due_date', 'status', 'payment_method', 'items'],
+        required=['patient_id', 'amount'],
+        defaults={'tax': 0.00, 'discount': 0.00, 'date': _today, 'status': 'Unpaid'},
+        json_columns=['items'],
+        alias='b', joins=["JOIN patient p ON b.patient_id = p.patient_id",
+                          "LEFT JOIN doctor d ON b.doctor_id = d.doctor_id"],
+        detail_columns="p.name as patient_name, d.name as doctor_name",
+        list_columns="""b.bill_id as id, b.invoice_number as invoiceNumber, b.amount, b.status, b.date,
+                        b.payment_method as paymentMethod,
+                        p.patient_id, p.name as patientName,
+                        d.doctor_id, d.name as doctorName""",
+        order_by="b.date DESC",
+        updatable=['amount', 'tax', 'discount', 'status', 'payment_method', 'items',
+                   'patient_id', 'doctor_id', 'appointment_id'],
+        added='generated',
+        prepare_insert=_bill_numbers,
+        archive_table='billing_archive',
+        created_extras=lambda data, computed, new_id: {"invoice_number": computed['invoice_number']},
+    ),
+    Resource(
+        'records', 'medical_record', 'record_id', '/api/records', 'Medical record',
+        insert_columns=['patient_id', 'doctor_id', 'visit_type', 'diagnosis', 'symptoms',
+                        'treatment', 'prescription', 'tests_ordered', 'test_results',
+                        'notes', 'follow_up_required', 'follow_up_date', 'date'],
+        required=['patient_id', 'diagnosis'],
+        defaults={'follow_up_required': False, 'date': _today},
+        alias='mr', joins=["JOIN patient p ON mr.patient_id = p.patient_id",
+                           "LEFT JOIN doctor d ON mr.doctor_id = d.doctor_id"],
+        detail_columns="p.name as patient_name, d.name as doctor_name",
+        list_columns="""mr.record_id as id, mr.diagnosis, mr.date,
+                        mr.treatment, mr.prescription, mr.notes,
+                        p.patient_id, p.name as patientName,
+                        d.doctor_id, d.name as doctorName""",
+        order_by="mr.date DESC",
+        updatable=['diagnosis', 'symptoms', 'treatment', 'prescription',
+                   'tests_ordered', 'test_results', 'notes', 'follow_up_required',
+                   'follow_up_date', 'patient_id', 'doctor_id', 'visit_type', 'date'],
+        archive_table='medical_record_archive',
+    ),
+    Resource(
+        'departments', 'department', 'department_id', '/api/departments', 'Department',
+        insert_columns=['name', 'head_of_department', 'phone', 'email', 'description'],
+        required=['name'],
+        list_columns="department_id as id, name",
+        cached=True,
+    ),
+    Resource(
+        'staff', 'staff', 'staff_id', '/api/staff', 'Staff member',
+        insert_columns=['name', 'role', 'department_id', 'phone', 'email', 'address', 'hire_date'],
+        required=['name', 'role'],
+        defaults={'hire_date': lambda: datetime.now().date()},
+        alias='s', joins=["LEFT JOIN department d ON s.department_id = d.department_id"],
+        detail_columns="d.name as department_name",
+        list_columns="""s.staff_id as id, s.name, s.role, s.department_id,
+                        s.phone, s.email, d.name as departmentName""",
+    ),
+    Resource(
+        'insurance', 'insurance_provider', 'provider_id', '/api/insurance', 'Insurance provider',
+        insert_columns=['name', 'contact_person', 'phone', 'email', 'address', 'website'],
+        required=['name'],
+        list_columns="provider_id as id, name, contact_person as contact, phone",
+        cached=True,
+    ),
+    Resource(
+        'test_types', 'test_type', 'test_id', '/api/tests/types', 'Test type',
+        insert_columns=['name', 'cost', 'description', 'preparation_instructions', 'turnaround_time'],
+        required=['name', 'cost'],
+        list_columns="test_id as id, name, cost",
+        cached=True,
+    ),
+    Resource(
+        'patient_tests', 'patient_test', 'patient_test_id', '/api/tests/patients', 'Patient test',
+        insert_columns=['patient_id', 'doctor_id', 'test_id', 'date_ordered', 'date_completed',
+                        'results', 'status', 'notes'],
+        required=['patient_id', 'test_id'],
+        defaults={'date_ordered': lambda: datetime.now().date(), 'status': 'Ordered'},
+        alias='pt', joins=["JOIN patient p ON pt.patient_id = p.patient_id",
+                           "LEFT JOIN doctor d ON pt.doctor_id = d.doctor_id",
+                           "JOIN test_type tt ON pt.test_id = tt.test_id"],
+        detail_columns="p.name as patient_name, d.name as doctor_name, tt.name as test_name",
+        list_columns="""pt.patient_test_id as id, pt.date_ordered as dateOrdered, pt.status,
+                        p.patient_id, p.name as patientName,
+                        d.doctor_id, d.name as doctorName,
+                        tt.test_id, tt.name as testName""",
+        order_by="pt.date_ordered DESC",
+        updatable=['date_completed', 'results', 'status', 'notes', 'patient_id', 'doctor_id',
+                   'test_id', 'date_ordered'],
+    ),
+    Resource(
+        'inventory', 'inventory', 'item_id', '/api/inventory', 'Inventory item',
+        insert_columns=['name', 'category', 'quantity', 'unit', 'price', 'supplier', 'expiry_date',
+                        'threshold', 'last_restocked', 'location', 'description'],
+        required=['name', 'category', 'quantity', 'unit', 'price'],
+        defaults={'threshold': 10, 'last_restocked': lambda: datetime.now().date()},
+        list_columns="item_id as id, name, category, quantity, unit, price, supplier, expiry_date as expiryDate, threshold",
+        order_by="name",
+        # Stock changes only through /api/inventory/<id>/movements, never a read-modify-write PUT
+        updatable=['name', 'category', 'unit', 'price', 'supplier', 'expiry_date', 'threshold', 'location',
+                   'description'],
+    ),
+]
+
+# Who changed what: queued per write, group-committed in the background
+audit_log = init_audit(app, get_db_connection, tenants.connect_primary)
+
+for resource in RESOURCES:
+    register_resource(app, resource, get_db_connection, cache=query_cache, audit=audit_log)
+
+# Likely duplicates at registration and in bulk, through a blocking index of match keys
+init_patient_matching(app, get_db_connection)
+
+# Per-provider insurance claim files, written by background jobs
+init_claims(app, get_db_connection, tenants.connect_primary, on_change=lambda: query_cache.invalidate('billing'))
+
+# Overdue bills and dunning escalation, swept in small throttled batches
+init_dunning(app, get_db_connection, tenants, tenants.connect_primary,
+             on_change=lambda: query_cache.invalidate('billing'))
+
+# Waitlist batches and a doctor's cancelled day, assigned to free slots in one transaction
+init_scheduler(app, get_db_connection, numbers, on_change=lambda: query_cache.invalidate('appointment'), audit=audit_log,
+               lookup_doctor=lambda doctor_id: references[tenants.current().id].lookup('doctor', doctor_id))
+
+# Closed history moved to archive tables in throttled batches; lists read the hot tier
+init_archive(app, get_db_connection, tenants, tenants.connect_primary, on_change=query_cache.invalidate)
+
+# Consume/restock ledger with batched, atomic stock updates
+init_inventory(app, get_db_connection, tenants.connect_primary, on_change=lambda: query_cache.invalidate('inventory'))
+
+# Scans, PDFs and lab files for records and patient tests, streamed to disk
+init_attachments(app, get_db_connection, audit=audit_log)
+
+# Dashboard chart aggregates, computed in SQL
+init_stats(app, get_db_connection, query_cache)
+
+# Notebook report figures as PNG/SVG, drawn in render processes and cached on disk
+init_report_images(app, tenants, query_cache)
+
+@app.route('/api/metrics/resources', methods=['GET'])
+def resource_metrics():
+    return jsonify({"operations": resource_stats.snapshot(), "coalescing": flights.stats(),
+                    "query_cache": query_cache.stats(), "reference_snapshot": references[tenants.current().id].status()}), 200
 
 # --- Reports API ---
 @app.route('/api/reports/low-stock', methods=['GET'])
+@coalesced
 def get_low_stock():
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("""
-            SELECT item_id as id, name, quantity, threshold, unit, supplier 
-            FROM inventory 
-            WHERE quantity <= threshold
+            SELECT item_id as id, name, quantity, threshold, unit, supplier
+            FROM inventory
+            WHERE low_stock = 1
             ORDER BY quantity ASC
         """)
         low_stock_items = cursor.fetchall()
@@ -1050,6 +325,7 @@ def get_low_stock():
         conn.close()
 
 @app.route('/api/reports/today-appointments', methods=['GET'])
+@coalesced
 def get_today_appointments():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -1078,80 +354,121 @@ def get_today_appointments():
         conn.close()
 
 # --- Helper Endpoints for Dropdowns ---
-@app.route('/api/patients/list', methods=['GET'])
-def get_patients_list():
-    conn = get_db_connection()
+# Doctors, departments, test types and insurance providers are served from a
+# snapshot shared by all workers (see reference_data.py); until it has caught
+# up with a write the endpoints fall back to the query cache.
+REFERENCE_TABLES = [
+    ReferenceTable('doctor', "SELECT doctor_id as id, name, specialization FROM doctor ORDER BY name",
+                   ['id', 'name', 'specialization']),
+    ReferenceTable('department', "SELECT department_id as id, name FROM department ORDER BY name",
+                   ['id', 'name']),
+    ReferenceTable('test_type', "SELECT test_id as id, name, cost FROM test_type ORDER BY name",
+                   ['id', 'name', 'cost'], decimals=['cost']),
+    ReferenceTable('insurance_provider', "SELECT provider_id as id, name FROM insurance_provider ORDER BY name",
+                   ['id', 'name']),
+]
+
+def load_reference_rows(tables):
+    """Reads every reference table over one connection, for the snapshot refresher.
+
+    Runs in the background, where connections default to the primary; these reads may lag.
+    """
+    conn = tenants.connect_read()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT patient_id as id, name FROM patient ORDER BY name")
-        patients = cursor.fetchall()
-        return jsonify(patients), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        rows = {}
+        for table in tables:
+            cursor.execute(table.sql)
+            rows[table.name] = cursor.fetchall()
+        return rows
     finally:
         cursor.close()
         conn.close()
 
-@app.route('/api/doctors/list', methods=['GET'])
-def get_doctors_list():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def reference_snapshot(tenant_id):
+    """The snapshot of one hospital, refreshed from its own database."""
+    def load_rows(tables):
+        with use_tenant(tenant_id):
+            return load_reference_rows(tables)
+    return ReferenceSnapshot(
+        REFERENCE_TABLES, load_rows, query_cache.versions.bound(tenant_id),
+        dumps=lambda rows: app.json.response(rows).get_data(as_text=True),
+        name='reference' if tenant_id == DEFAULT_TENANT else f'reference-{tenant_id}',
+        settle_s=query_cache.settle_s,
+    )
+
+references = {tenant_id: reference_snapshot(tenant_id) for tenant_id in tenants.tenants}
+
+def reference_response(table_name, sql):
+    """Dropdown rows for ``table_name`` from the snapshot, else via the query cache."""
+    body = references[tenants.current().id].json(table_name)
+    if body is not None:
+        return app.response_class(body, mimetype='application/json')
+    db = Session(get_db_connection) # Connects only on a cache miss
     try:
-        cursor.execute("SELECT doctor_id as id, name, specialization FROM doctor ORDER BY name")
-        doctors = cursor.fetchall()
-        return jsonify(doctors), 200
+        _, rows = query_cache.fetch(sql, None, db.run)
+        return jsonify(rows), 200
+    except CircuitOpenError:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
-        cursor.close()
-        conn.close()
+        db.close()
 
-@app.route('/api/departments/list', methods=['GET'])
-def get_departments_list():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+@app.route('/api/patients/list', methods=['GET'])
+@coalesced
+def get_patients_list():
+    db = Session(get_db_connection) # Connects only on a cache miss
     try:
-        cursor.execute("SELECT department_id as id, name FROM department ORDER BY name")
-        departments = cursor.fetchall()
-        return jsonify(departments), 200
+        _, patients = query_cache.fetch("SELECT patient_id as id, name FROM patient ORDER BY name", None, db.run)
+        return jsonify(patients), 200
+    except CircuitOpenError:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
-        cursor.close()
-        conn.close()
+        db.close()
+
+@app.route('/api/doctors/list', methods=['GET'])
+@coalesced
+def get_doctors_list():
+    return reference_response('doctor', REFERENCE_TABLES[0].sql)
+
+@app.route('/api/departments/list', methods=['GET'])
+@coalesced
+def get_departments_list():
+    return reference_response('department', REFERENCE_TABLES[1].sql)
 
 @app.route('/api/appointments/list', methods=['GET'])
+@coalesced
 def get_appointments_list():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    db = Session(get_db_connection) # Connects only on a cache miss
     try:
-        cursor.execute("SELECT appointment_id as id, patient_id, doctor_id, date, time FROM appointment ORDER BY date DESC, time DESC")
-        appointments = cursor.fetchall()
+        _, appointments = query_cache.fetch("""
+            SELECT a.appointment_id as id, a.patient_id, a.doctor_id, a.date, a.time,
+                   p.name as patientName, d.name as doctorName
+            FROM appointment a
+            JOIN patient p ON a.patient_id = p.patient_id
+            JOIN doctor d ON a.doctor_id = d.doctor_id
+            ORDER BY a.date DESC, a.time DESC
+        """, None, db.run)
         for a in appointments:
             for key, value in a.items():
                 if isinstance(value, (datetime, timedelta)):
                     a[key] = str(value)
         return jsonify(appointments), 200
+    except CircuitOpenError:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
-        cursor.close()
-        conn.close()
+        db.close()
 
 
 @app.route('/api/tests/list', methods=['GET'])
+@coalesced
 def get_test_types_list():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT test_id as id, name, cost FROM test_type ORDER BY name")
-        tests = cursor.fetchall()
-        return jsonify(tests), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+    return reference_response('test_type', REFERENCE_TABLES[2].sql)
 
 # --- Data Export Endpoints ---
 @app.route('/api/patients/export/json', methods=['GET'])
@@ -1210,16 +527,26 @@ def export_patients_csv():
 # --- Health Check ---
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    tenant = tenants.current()
+    conn = cursor = None
     try:
-        conn = get_db_connection()
+        conn = db_resilience.connect(tenant.db_config)
         cursor = conn.cursor()
         cursor.execute("SELECT 1")
-        return jsonify({"status": "healthy", "database": "connected"}), 200
+        return jsonify({"status": "healthy", "database": "connected", "tenant": tenant.id,
+                        "circuit": db_resilience.breaker_for(tenant.db_config).snapshot(),
+                        "replicas": tenant.router.replicas.status()}), 200
+    except CircuitOpenError:
+        return jsonify({"status": "unhealthy", "database": "circuit open", "tenant": tenant.id,
+                        "circuit": db_resilience.breaker_for(tenant.db_config).snapshot()}), 503
     except Exception as e:
-        return jsonify({"status": "unhealthy", "error": str(e)}), 500
+        return jsonify({"status": "unhealthy", "error": str(e), "tenant": tenant.id,
+                        "circuit": db_resilience.breaker_for(tenant.db_config).snapshot()}), 500
     finally:
-        cursor.close()
-        conn.close()
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
 
 if __name__ == '__main__':
     # Make sure to set up your .env file with DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
@@ -0,0 +1,243 @@
+"""Hot/cold tiering: moves closed history into ``<table>_archive`` tables.
+
+Paid bills, finished appointments (Completed, Cancelled, No-Show) and
+medical records older than ``ARCHIVE_HORIZON_DAYS`` are moved to
+``billing_archive``, ``appointment_archive`` and ``medical_record_archive``.
+These tables have the same columns and indexes plus ``archived_at``. InnoDB
+cannot partition tables that have foreign keys, so the cold tier is separate
+tables rather than partitions. The list and item routes of these resources
+read only the hot tables. ``?include_archived=true`` reads the union of both
+tiers (``resources.Resource.archive_table``). Archived rows are read-only.
+
+Bills under an open insurance claim are never archived. Neither are
+appointments that a hot bill still references, because the bill's foreign
+key would be nulled. Records with a follow-up still due are kept as well.
+Bills go first, so an appointment follows its bill in the same sweep.
+
+Rows move in batches: keyset order on the primary key, with one transaction
+per batch (lock the rows, copy them, delete them). The batch size and the
+pauses between batches follow ``sweeps.BatchPacer``, as in ``dunning``. Sweeps
+run every ``ARCHIVE_INTERVAL_S``, in one worker per hospital at a time (a
+MySQL named lock), or with ``flask archive-history``. A tier whose archive
+table does not exist yet is skipped. ``flask init-archive`` creates the
+archive tables. Columns added to a hot table must be added to its archive
+table too, or the sweep stops with an error naming them.
+"""
+import os
+import time
+from datetime import date, timedelta
+
+import click
+import pymysql
+from flask import jsonify
+
+from sweeps import BatchPacer, TenantScheduler
+from tenancy import current_tenant_id
+
+ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', '1') == '1'
+ARCHIVE_INTERVAL_S = float(os.getenv('ARCHIVE_INTERVAL_S', '86400'))
+ARCHIVE_HORIZON_DAYS = int(os.getenv('ARCHIVE_HORIZON_DAYS', '730'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_MIN_BATCH = 50
+ARCHIVE_MAX_BATCH = int(os.getenv('ARCHIVE_MAX_BATCH', '5000'))
+ARCHIVE_BATCH_TARGET_MS = float(os.getenv('ARCHIVE_BATCH_TARGET_MS', '100'))
+ARCHIVE_TARGET_LOAD = float(os.getenv('ARCHIVE_TARGET_LOAD', '0.25'))
+
+
+class Tier:
+    """A hot table, the column its age is measured on and what makes a row closed."""
+
+    __slots__ = ('table', 'pk', 'date_column', 'closed')
+
+    def __init__(self, table, pk, date_column, closed):
+        self.table = table
+        self.pk = pk
+        self.date_column = date_column
+        self.closed = closed
+
+    @property
+    def archive(self):
+        return f"{self.table}_archive"
+
+
+TIERS = [
+    Tier('billing', 'bill_id', 'date',
+         "status = 'Paid' AND (claim_status IS NULL OR claim_status <> 'Submitted')"),
+    Tier('appointment', 'appointment_id', 'date',
+         "status IN ('Completed', 'Cancelled', 'No-Show') AND NOT EXISTS "
+         "(SELECT 1 FROM billing b WHERE b.appointment_id = appointment.appointment_id)"),
+    Tier('medical_record', 'record_id', 'date',
+         "NOT (follow_up_required AND follow_up_date >= CURDATE())"),
+]
+
+
+def archive_ddl(tier):
+    return [f"CREATE TABLE IF NOT EXISTS {tier.archive} LIKE {tier.table}",
+            f"ALTER TABLE {tier.archive} ADD COLUMN archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP"]
+
+
+def _columns(cursor, table):
+    """Stored (non-generated) columns of ``table`` in declaration order."""
+    cursor.execute("""SELECT column_name AS name, extra FROM information_schema.columns
+                      WHERE table_schema = DATABASE() AND table_name = %s ORDER BY ordinal_position""", (table,))
+    return [row['name'] for row in cursor.fetchall() if 'GENERATED' not in (row['extra'] or '').upper()]
+
+
+class ArchiveSweeper:
+    """Moves closed rows to the cold tier for every hospital, on a schedule or on demand."""
+
+    def __init__(self, tenants, connect_primary, on_change=None, tiers=None, interval=ARCHIVE_INTERVAL_S,
+                 target_load=ARCHIVE_TARGET_LOAD):
+        self.tenants = tenants
+        self.connect = connect_primary
+        self.on_change = on_change
+        self.tiers = tiers or TIERS
+        self.target_load = target_load
+        self.stats = {"sweeps": 0, "failed": 0, "skipped_locked": 0, "batches": 0,
+                      "archived": {tier.table: 0 for tier in self.tiers}, "last_sweep": None}
+        self.scheduler = TenantScheduler(tenants, self.sweep, interval, self.stats, 'archive-sweeper',
+                                         enabled=ARCHIVE_ENABLED)
+
+    def ensure_scheduler(self):
+        self.scheduler.ensure_started()
+
+    def sweep(self, horizon_days=ARCHIVE_HORIZON_DAYS, today=None, progress=None):
+        """Archives the current hospital's closed history; returns rows moved per table.
+
+        Returns ``None`` if another sweep holds the lock.
+        """
+        lock_name = f"archive:{current_tenant_id()}"
+        cutoff = (today or date.today()) - timedelta(days=horizon_days)
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0) as locked", (lock_name,))
+                if not cursor.fetchone()['locked']:
+                    self.stats["skipped_locked"] += 1
+                    return None
+                try:
+                    moved = {}
+                    for tier in self.tiers:
+                        moved[tier.table] = self._sweep_tier(conn, cursor, tier, cutoff, progress)
+                    self.stats["sweeps"] += 1
+                    self.stats["last_sweep"] = {"cutoff": cutoff.isoformat(), "moved": moved}
+                    return moved
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+        finally:
+            conn.close()
+
+    def _sweep_tier(self, conn, cursor, tier, cutoff, progress):
+        columns = _columns(cursor, tier.table)
+        archived = set(_columns(cursor, tier.archive))
+        if not archived:
+            return None  # No archive table: tier not set up
+        missing = [column for column in columns if column not in archived]
+        if missing:
+            raise RuntimeError(f"{tier.archive} lacks columns {', '.join(missing)}; add them before archiving")
+        column_list = ', '.join(columns)
+
+        moved = 0
+        last_id = 0
+        pacer = BatchPacer(ARCHIVE_BATCH_SIZE, ARCHIVE_MIN_BATCH, ARCHIVE_MAX_BATCH, ARCHIVE_BATCH_TARGET_MS,
+                           self.target_load)
+        while True:
+            batch_size = pacer.size
+            started = time.monotonic()
+            try:
+                cursor.execute(f"""
+                    SELECT {tier.pk} AS id FROM {tier.table}
+                    WHERE {tier.date_column} < %s AND {tier.closed} AND {tier.pk} > %s
+                    ORDER BY {tier.pk} LIMIT %s FOR UPDATE
+                """, (cutoff, last_id, batch_size))
+                ids = [row['id'] for row in cursor.fetchall()]
+                if ids:
+                    in_list = ', '.join(['%s'] * len(ids))
+                    cursor.execute(f"INSERT INTO {tier.archive} ({column_list}) "
+                                   f"SELECT {column_list} FROM {tier.table} WHERE {tier.pk} IN ({in_list})", ids)
+                    cursor.execute(f"DELETE FROM {tier.table} WHERE {tier.pk} IN ({in_list})", ids)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if ids:
+                last_id = ids[-1]
+                moved += len(ids)
+                self.stats["batches"] += 1
+                self.stats["archived"][tier.table] += len(ids)
+                if self.on_change is not None:
+                    self.on_change(tier.table)
+                if progress is not None:
+                    progress(tier, len(ids))
+            if len(ids) < batch_size:
+                return moved
+            pacer.pace(time.monotonic() - started)
+
+    def tier_sizes(self, get_db_connection):
+        """Approximate hot and cold row counts per table, from table statistics."""
+        names = [name for tier in self.tiers for name in (tier.table, tier.archive)]
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""SELECT table_name AS name, table_rows AS row_count FROM information_schema.tables
+                                   WHERE table_schema = DATABASE() AND table_name IN ({', '.join(['%s'] * len(names))})""",
+                               names)
+                rows = {row['name']: row['row_count'] for row in cursor.fetchall()}
+        finally:
+            conn.close()
+        return {tier.table: {"hot": rows.get(tier.table), "archived": rows.get(tier.archive)} for tier in self.tiers}
+
+
+def init_archive(app, get_db_connection, tenants, connect_primary, on_change=None):
+    """Schedules the archive sweeper and adds its metrics route and CLI commands."""
+    sweeper = ArchiveSweeper(tenants, connect_primary, on_change=on_change)
+
+    @app.before_request
+    def start_archive_scheduler():
+        sweeper.ensure_scheduler()
+
+    @app.route('/api/metrics/archive', methods=['GET'])
+    def archive_metrics():
+        try:
+            tiers = sweeper.tier_sizes(get_db_connection)
+        except pymysql.Error as e:
+            tiers = {"error": str(e)}
+        return jsonify({"worker": sweeper.stats, "horizon_days": ARCHIVE_HORIZON_DAYS, "tiers": tiers}), 200
+
+    @app.cli.command('init-archive')
+    def init_archive_tables():
+        """Create the archive tables for appointments, bills and medical records."""
+        conn = connect_primary()
+        try:
+            with conn.cursor() as cursor:
+                for tier in sweeper.tiers:
+                    create, add_column = archive_ddl(tier)
+                    cursor.execute(create)
+                    if 'archived_at' not in _columns(cursor, tier.archive):
+                        cursor.execute(add_column)
+            conn.commit()
+        finally:
+            conn.close()
+        click.echo("Archive tables ready.")
+
+    @app.cli.command('archive-history')
+    @click.option('--horizon-days', default=ARCHIVE_HORIZON_DAYS, show_default=True,
+                  help='Archive closed rows older than this many days.')
+    def archive_history(horizon_days):
+        """Move closed appointments, paid bills and old records to the archive tables."""
+        started = time.monotonic()
+
+        def progress(tier, rows):
+            click.echo(f"{tier.table}: {rows} rows archived")
+
+        moved = sweeper.sweep(horizon_days, progress=progress)
+        if moved is None:
+            click.echo("Another sweep is running.")
+            return
+        for table, count in moved.items():
+            if count is None:
+                click.echo(f"{table}: no archive table, skipped (run flask init-archive).")
+        click.echo(f"Archived {sum(count or 0 for count in moved.values())} rows in "
+                   f"{time.monotonic() - started:.1f}s.")
+
+    return sweeper
@@ -0,0 +1,312 @@
+"""Attachments (scans, PDFs, lab files) for medical records and patient tests.
+
+Uploads are streamed from the request body to disk in
+``ATTACHMENT_CHUNK_BYTES`` pieces while being hashed, so no upload is ever
+held in memory. They are either a raw body (``Content-Type`` of the file,
+name in ``X-Filename`` or ``?filename=``) or a ``multipart/form-data`` field
+named ``file``, which Werkzeug spools to disk. Content is stored once per
+SHA-256 under ``ATTACHMENT_ROOT/<tenant>/objects/``, so re-uploading the
+same file (or attaching it to several records) costs no extra space.
+
+Metadata lives in ``attachment`` rows, indexed by owner, and list endpoints
+read only those rows. Downloads use ``send_file``, which answers HTTP Range
+requests and hands the open file to the server's ``wsgi.file_wrapper``
+(``sendfile`` under gunicorn). The SHA-256 doubles as a strong ETag.
+
+Deleting an attachment removes its row only; ``flask gc-attachments`` drops
+rows whose record is gone and content no row references any more. Run
+``flask init-attachments`` once on an existing database.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+import click
+import pymysql
+from flask import g, jsonify, request, send_file
+
+from admission import db_slot
+from coalesce import coalesced
+from db_resilience import CircuitOpenError
+from tenancy import current_tenant_id
+
+ATTACHMENT_ROOT = os.path.abspath(os.getenv('ATTACHMENT_ROOT', 'attachments'))
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_BYTES', str(100 * 1024 * 1024)))
+ATTACHMENT_CHUNK_BYTES = int(os.getenv('ATTACHMENT_CHUNK_BYTES', str(1024 * 1024)))
+# Unreferenced content younger than this may belong to an upload in progress.
+ATTACHMENT_GC_GRACE_S = float(os.getenv('ATTACHMENT_GC_GRACE_S', '3600'))
+
+# owner type -> (table, primary key)
+OWNERS = {
+    'record': ('medical_record', 'record_id'),
+    'patient_test': ('patient_test', 'patient_test_id'),
+}
+
+ATTACHMENT_DDL = """
+CREATE TABLE IF NOT EXISTS attachment (
+    attachment_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    owner_type ENUM('record', 'patient_test') NOT NULL,
+    owner_id INT NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    size BIGINT NOT NULL,
+    content_type VARCHAR(100) NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    uploaded_by INT,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_attachment_owner (owner_type, owner_id, attachment_id),
+    INDEX idx_attachment_sha (sha256)
+)
+"""
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class ContentStore:
+    """Content-addressed files under ``root/<tenant>/objects/ab/cdef...``."""
+
+    def __init__(self, root=ATTACHMENT_ROOT, chunk_bytes=ATTACHMENT_CHUNK_BYTES, max_bytes=ATTACHMENT_MAX_BYTES):
+        self.root = root
+        self.chunk_bytes = chunk_bytes
+        self.max_bytes = max_bytes
+
+    def _dir(self, tenant_id, *parts):
+        path = os.path.join(self.root, tenant_id, *parts)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def path(self, tenant_id, sha256):
+        return os.path.join(self.root, tenant_id, 'objects', sha256[:2], sha256[2:])
+
+    def put(self, tenant_id, stream):
+        """Streams ``stream`` into the store; returns ``(sha256, size, deduplicated)``."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir(tenant_id, 'tmp'))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(self.chunk_bytes)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge()
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            sha256 = digest.hexdigest()
+            target = self.path(tenant_id, sha256)
+            if os.path.exists(target):
+                # Refresh the mtime so gc's grace period covers this upload.
+                os.utime(target)
+                return sha256, size, True
+            self._dir(tenant_id, 'objects', sha256[:2])
+            os.chmod(tmp_path, 0o440)
+            os.replace(tmp_path, target)
+            tmp_path = None
+            return sha256, size, False
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def objects(self, tenant_id):
+        """``(sha256, path)`` of every stored object of ``tenant_id``."""
+        base = os.path.join(self.root, tenant_id, 'objects')
+        if not os.path.isdir(base):
+            return
+        for prefix in os.listdir(base):
+            for rest in os.listdir(os.path.join(base, prefix)):
+                yield prefix + rest, os.path.join(base, prefix, rest)
+
+
+def _upload_stream():
+    """``(stream, filename, content_type)`` of the current upload."""
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return None, None, None
+        return upload.stream, upload.filename, upload.mimetype or 'application/octet-stream'
+    filename = request.headers.get('X-Filename') or request.args.get('filename')
+    return request.stream, filename, request.mimetype or 'application/octet-stream'
+
+
+def init_attachments(app, get_db_connection, audit=None):
+    """Adds the attachment routes for records and patient tests."""
+    store = ContentStore()
+
+    def owner_exists(cursor, owner_type, owner_id):
+        table, pk = OWNERS[owner_type]
+        cursor.execute(f"SELECT 1 FROM {table} WHERE {pk} = %s", (owner_id,))
+        return cursor.fetchone() is not None
+
+    def upload(owner_type, owner_id):
+        # The body streams without a DB slot; only the two queries take one.
+        with db_slot():
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            try:
+                exists = owner_exists(cursor, owner_type, owner_id)
+            finally:
+                cursor.close()
+                conn.close()
+        if not exists:
+            return jsonify({"error": f"{OWNERS[owner_type][0].replace('_', ' ').capitalize()} not found"}), 404
+
+        stream, filename, content_type = _upload_stream()
+        if stream is None or not filename:
+            return jsonify({"error": "Send the file as the 'file' form field or as the body with X-Filename"}), 400
+        filename = os.path.basename(filename.replace('\\', '/'))[:255]
+        try:
+            sha256, size, deduplicated = store.put(current_tenant_id(), stream)
+        except UploadTooLarge:
+            return jsonify({"error": f"Attachments are limited to {ATTACHMENT_MAX_BYTES} bytes"}), 413
+        if size == 0:
+            return jsonify({"error": "The uploaded file is empty"}), 400
+
+        principal = g.get('principal')
+        with db_slot():
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    INSERT INTO attachment (owner_type, owner_id, sha256, size, content_type, filename, uploaded_by)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, (owner_type, owner_id, sha256, size, content_type, filename,
+                      principal.user_id if principal else None))
+                conn.commit()
+                attachment_id = cursor.lastrowid
+            except pymysql.Error as e:
+                conn.rollback()
+                return jsonify({"error": f"Database error: {str(e)}"}), 500
+            finally:
+                cursor.close()
+                conn.close()
+        if audit is not None:
+            audit.record('create', 'attachment', attachment_id,
+                         after={"owner_type": owner_type, "owner_id": owner_id, "sha256": sha256,
+                                "size": size, "filename": filename})
+        return jsonify({"message": "Attachment uploaded successfully", "id": attachment_id,
+                        "sha256": sha256, "size": size, "deduplicated": deduplicated}), 201
+
+    def list_attachments(owner_type, owner_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT attachment_id as id, filename, content_type, size, sha256, uploaded_by, created_at
+                FROM attachment
+                WHERE owner_type = %s AND owner_id = %s
+                ORDER BY attachment_id
+            """, (owner_type, owner_id))
+            attachments = cursor.fetchall()
+            for a in attachments:
+                a['created_at'] = str(a['created_at'])
+            return jsonify(attachments), 200
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cursor.close()
+            conn.close()
+
+    def owner_view(owner_type):
+        def view(owner_id):
+            if request.method == 'POST':
+                return upload(owner_type, owner_id)
+            return list_attachments(owner_type, owner_id)
+        return view
+
+    for owner_type, url, endpoint in (('record', '/api/records/<int:owner_id>/attachments', 'record_attachments'),
+                                      ('patient_test', '/api/tests/patients/<int:owner_id>/attachments',
+                                       'patient_test_attachments')):
+        view = owner_view(owner_type)
+        view.__name__ = endpoint
+        app.add_url_rule(url, endpoint, coalesced(view), methods=['GET', 'POST'])
+
+    @app.route('/api/attachments/<int:attachment_id>', methods=['GET', 'DELETE'])
+    def manage_attachment(attachment_id):
+        # Downloads hold a DB slot for the metadata lookup only, not while the file is sent.
+        with db_slot():
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    SELECT attachment_id, owner_type, owner_id, sha256, size, content_type, filename
+                    FROM attachment WHERE attachment_id = %s
+                """, (attachment_id,))
+                attachment = cursor.fetchone()
+                if attachment is None:
+                    return jsonify({"error": "Attachment not found"}), 404
+                if request.method == 'DELETE':
+                    cursor.execute("DELETE FROM attachment WHERE attachment_id = %s", (attachment_id,))
+                    conn.commit()
+            except pymysql.Error as e:
+                conn.rollback()
+                return jsonify({"error": f"Database error: {str(e)}"}), 500
+            finally:
+                cursor.close()
+                conn.close()
+
+        if request.method == 'DELETE':
+            if audit is not None:
+                audit.record('delete', 'attachment', attachment_id, before=attachment)
+            return jsonify({"message": "Attachment deleted successfully"}), 200
+
+        path = store.path(current_tenant_id(), attachment['sha256'])
+        if not os.path.exists(path):
+            return jsonify({"error": "Attachment content is missing from storage"}), 500
+        response = send_file(path, mimetype=attachment['content_type'], as_attachment=True,
+                             download_name=attachment['filename'], conditional=True,
+                             etag=attachment['sha256'], max_age=3600)
+        response.headers['Cache-Control'] = 'private, max-age=3600, immutable'
+        return response
+
+    @app.cli.command('init-attachments')
+    def init_attachments_table():
+        """Create the attachment metadata table."""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(ATTACHMENT_DDL)
+            conn.commit()
+        finally:
+            conn.close()
+        click.echo(f"Attachments ready; content is stored under {store.root}.")
+
+    @app.cli.command('gc-attachments')
+    def gc_attachments():
+        """Drop attachments of deleted records and unreferenced content."""
+        tenant_id = current_tenant_id()
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                orphans = 0
+                for owner_type, (table, pk) in OWNERS.items():
+                    # Owners moved to the cold tier by archive.py still own their attachments.
+                    cursor.execute("""SELECT COUNT(*) as n FROM information_schema.tables
+                                      WHERE table_schema = DATABASE() AND table_name = %s""", (f"{table}_archive",))
+                    archived = (f"AND NOT EXISTS (SELECT 1 FROM {table}_archive x WHERE x.{pk} = a.owner_id)"
+                                if cursor.fetchone()['n'] else '')
+                    orphans += cursor.execute(f"""
+                        DELETE a FROM attachment a LEFT JOIN {table} o ON a.owner_id = o.{pk}
+                        WHERE a.owner_type = %s AND o.{pk} IS NULL {archived}
+                    """, (owner_type,))
+                conn.commit()
+                cursor.execute("SELECT DISTINCT sha256 FROM attachment")
+                referenced = {row['sha256'] for row in cursor.fetchall()}
+        finally:
+            conn.close()
+        removed = 0
+        cutoff = time.time() - ATTACHMENT_GC_GRACE_S
+        for sha256, path in store.objects(tenant_id):
+            if sha256 not in referenced and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        click.echo(f"Removed {orphans} orphaned attachment rows and {removed} unreferenced files.")
+
+    return store
@@ -0,0 +1,400 @@
+"""Asynchronous, batched audit log of writes made through the CRUD resources.
+
+Every successful POST/PUT/DELETE handled by ``resources.handle`` records who
+changed which row and the before/after values of the columns that changed.
+Recording only appends the entry to a bounded in-process queue; a flusher
+thread per worker group-commits queued entries into ``audit_log`` with one
+multi-row INSERT per ``AUDIT_BATCH_SIZE`` entries or ``AUDIT_FLUSH_INTERVAL_MS``,
+whichever comes first.
+
+Nothing is dropped silently:
+
+* when the queue is full, ``record`` waits up to ``AUDIT_ENQUEUE_TIMEOUT_MS``
+  and then appends the entry to the local spill file itself;
+* a batch the database rejects is appended to the spill file as well;
+* on interpreter exit (gunicorn's graceful worker shutdown) the queue is
+  drained before the worker ends.
+
+With ``AUDIT_SINK=file`` batches always go to the spill file, which then is
+the audit log. Spill files are JSON lines, one per worker pid, rotated at
+``AUDIT_SPILL_MAX_BYTES``; ``flask replay-audit-spill`` loads them into
+``audit_log``.
+
+By default entries record only the new values, so auditing adds no database
+round trip to a write. ``AUDIT_BEFORE_IMAGES=1`` also records the old values:
+that costs one locking primary-key SELECT per PUT/DELETE on the write's own
+connection and transaction, and holds the row lock that much longer.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from logging.handlers import RotatingFileHandler
+
+import click
+import pymysql
+from flask import g, jsonify, request
+
+from shared_state import runtime_path
+from tenancy import DEFAULT_TENANT, current_tenant_id, use_tenant
+
+AUDIT_ENABLED = os.getenv('AUDIT_ENABLED', '1') == '1'
+AUDIT_SINK = os.getenv('AUDIT_SINK', 'db')  # 'db' or 'file'
+AUDIT_BEFORE_IMAGES = os.getenv('AUDIT_BEFORE_IMAGES', '0') == '1'
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+AUDIT_FLUSH_INTERVAL_MS = float(os.getenv('AUDIT_FLUSH_INTERVAL_MS', '200'))
+AUDIT_ENQUEUE_TIMEOUT_MS = float(os.getenv('AUDIT_ENQUEUE_TIMEOUT_MS', '5'))
+AUDIT_SHUTDOWN_TIMEOUT_S = float(os.getenv('AUDIT_SHUTDOWN_TIMEOUT_S', '10'))
+AUDIT_SPILL_MAX_BYTES = int(os.getenv('AUDIT_SPILL_MAX_BYTES', str(16 * 1024 * 1024)))
+AUDIT_SPILL_BACKUPS = int(os.getenv('AUDIT_SPILL_BACKUPS', '10'))
+
+AUDIT_DDL = """
+CREATE TABLE IF NOT EXISTS audit_log (
+    audit_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    occurred_at DATETIME(3) NOT NULL,
+    user_id INT,
+    username VARCHAR(100),
+    remote_addr VARCHAR(45),
+    action ENUM('create', 'update', 'delete') NOT NULL,
+    table_name VARCHAR(64) NOT NULL,
+    record_id BIGINT,
+    changes JSON COMMENT '{"before": {...}, "after": {...}} of the changed columns',
+    INDEX idx_audit_record (table_name, record_id, audit_id),
+    INDEX idx_audit_user (user_id, occurred_at),
+    INDEX idx_audit_time (occurred_at)
+)
+"""
+INSERT_SQL = """
+    INSERT INTO audit_log (occurred_at, user_id, username, remote_addr, action, table_name, record_id, changes)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+_STOP = object()
+
+
+def _same(before, after):
+    # Stored values come back typed (Decimal, date); submitted ones are JSON.
+    if isinstance(before, (int, float, Decimal)) and isinstance(after, (int, float, Decimal)) \
+            and not isinstance(after, bool):
+        return Decimal(str(before)) == Decimal(str(after))
+    if before is None or after is None:
+        return before is after
+    return str(before) == str(after)
+
+
+def diff(before, after):
+    """``{"before": ..., "after": ...}`` restricted to the columns that changed."""
+    before = before or {}
+    after = after or {}
+    changed = [c for c in dict.fromkeys((*before, *after))
+               if not _same(before.get(c), after.get(c))]
+    return {"before": {c: before.get(c) for c in changed if c in before},
+            "after": {c: after.get(c) for c in changed if c in after}}
+
+
+class _Entry:
+    __slots__ = ('occurred_at', 'tenant_id', 'user_id', 'username', 'remote_addr', 'action', 'table',
+                 'record_id', 'before', 'after')
+
+    def __init__(self, action, table, record_id, before, after):
+        self.occurred_at = datetime.now()
+        self.tenant_id = current_tenant_id()
+        principal = getattr(g, 'principal', None)
+        self.user_id = principal.user_id if principal else None
+        self.username = principal.username if principal else None
+        self.remote_addr = request.remote_addr
+        self.action = action
+        self.table = table
+        self.record_id = record_id
+        self.before = before
+        self.after = after
+
+    def row(self):
+        return (self.occurred_at, self.user_id, self.username, self.remote_addr, self.action, self.table,
+                self.record_id, json.dumps(diff(self.before, self.after), default=str))
+
+    def line(self):
+        return json.dumps({"tenant": self.tenant_id, "occurred_at": self.occurred_at.isoformat(timespec='milliseconds'),
+                           "user_id": self.user_id, "username": self.username, "remote_addr": self.remote_addr,
+                           "action": self.action, "table_name": self.table, "record_id": self.record_id,
+                           "changes": diff(self.before, self.after)}, default=str)
+
+
+class AuditLog:
+    """Bounded queue of audit entries drained by a per-worker flusher thread."""
+
+    def __init__(self, connect_primary, sink=AUDIT_SINK, before_images=AUDIT_BEFORE_IMAGES,
+                 queue_size=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval_ms=AUDIT_FLUSH_INTERVAL_MS, enqueue_timeout_ms=AUDIT_ENQUEUE_TIMEOUT_MS):
+        self.connect_primary = connect_primary
+        self.sink = sink
+        self.before_images = before_images
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.interval = flush_interval_ms / 1000.0
+        self.enqueue_timeout = enqueue_timeout_ms / 1000.0
+        self._queue = queue.Queue(queue_size)
+        self._flusher = None
+        self._flusher_pid = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._spill = None
+        self.last_error = None
+        self.stats = {"recorded": 0, "written": 0, "batches": 0, "spilled": 0, "lost": 0,
+                      "queue_full": 0, "enqueue_us": 0.0}
+
+    # --- Recording (request threads) ---
+    def record(self, action, table, record_id, before=None, after=None):
+        """Queues one audit entry; takes microseconds unless the queue is full."""
+        started = time.perf_counter()
+        entry = _Entry(action, table, record_id, before, after)
+        self._ensure_flusher()
+        try:
+            if self._closed:
+                raise queue.Full
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                self.stats["queue_full"] += 1
+                self._queue.put(entry, timeout=self.enqueue_timeout)
+        except queue.Full:
+            # Backpressure: rather than stall the write, persist it locally.
+            self._write_spill([entry])
+        self.stats["recorded"] += 1
+        self.stats["enqueue_us"] += (time.perf_counter() - started) * 1e6
+
+    # --- Flushing (one thread per worker) ---
+    def _ensure_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            # Entries queued before a fork belong to the parent.
+            self._queue = queue.Queue(self.queue_size)
+            self._spill = None
+            self._closed = False
+            self._flusher_pid = os.getpid()
+            self._flusher = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            entry = self._queue.get()
+            if entry is _STOP:
+                break
+            batch = [entry]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            self._flush(batch)
+        # Drain whatever was queued behind the stop marker.
+        batch = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _STOP:
+                batch.append(entry)
+        for i in range(0, len(batch), self.batch_size):
+            self._flush(batch[i:i + self.batch_size])
+
+    def _flush(self, batch):
+        if self.sink == 'file':
+            self._write_spill(batch, spilled=False)
+            self.stats["batches"] += 1
+            return
+        by_tenant = {}
+        for entry in batch:
+            by_tenant.setdefault(entry.tenant_id, []).append(entry)
+        for tenant_id, entries in by_tenant.items():
+            try:
+                with use_tenant(tenant_id):
+                    self._insert([entry.row() for entry in entries])
+                self.stats["written"] += len(entries)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                self._write_spill(entries)
+            self.stats["batches"] += 1
+
+    def _insert(self, rows):
+        conn = self.connect_primary()
+        cursor = conn.cursor()
+        try:
+            # PyMySQL sends executemany over INSERT ... VALUES as one multi-row INSERT.
+            cursor.executemany(INSERT_SQL, rows)
+            conn.commit()
+        except pymysql.Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _spill_logger(self):
+        with self._lock:
+            if self._spill is None:
+                self._spill = self._open_spill()
+        return self._spill
+
+    def _open_spill(self):
+        logger = logging.getLogger(f'hms.audit.{os.getpid()}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = RotatingFileHandler(runtime_path(f'audit-{os.getpid()}.jsonl'), maxBytes=AUDIT_SPILL_MAX_BYTES,
+                                      backupCount=AUDIT_SPILL_BACKUPS, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.handlers = [handler]
+        return logger
+
+    def _write_spill(self, entries, spilled=True):
+        try:
+            self._spill_logger().info('\n'.join(entry.line() for entry in entries))
+            self.stats["spilled" if spilled else "written"] += len(entries)
+        except Exception as e:
+            self.last_error = str(e)
+            self.stats["lost"] += len(entries)
+
+    def close(self, timeout=AUDIT_SHUTDOWN_TIMEOUT_S):
+        """Flushes queued entries and stops the flusher (runs at exit)."""
+        if self._flusher_pid != os.getpid() or self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._flusher.join(timeout)
+
+    def status(self):
+        recorded = self.stats["recorded"]
+        return dict(self.stats, sink=self.sink, queued=self._queue.qsize(), capacity=self.queue_size,
+                    enqueue_us=round(self.stats["enqueue_us"] / recorded, 2) if recorded else 0.0,
+                    error=self.last_error)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def spill_files():
+    """Spill files safe to replay, oldest first.
+
+    The current file of a running worker may still be appended to and is
+    left alone; its rotated backups are complete.
+    """
+    files = []
+    for path in glob.glob(runtime_path('audit-*.jsonl*')):
+        name = os.path.basename(path)
+        if name.endswith('.jsonl') and _pid_alive(int(name[len('audit-'):-len('.jsonl')])):
+            continue
+        files.append(path)
+    return sorted(files, key=os.path.getmtime)
+
+
+def init_audit(app, get_db_connection, connect_primary):
+    """Creates the worker's ``AuditLog`` and the ``/api/audit`` routes.
+
+    Entries and the DDL are written through ``connect_primary``; returns
+    ``None`` when ``AUDIT_ENABLED=0``.
+    """
+    if not AUDIT_ENABLED:
+        return None
+    audit = AuditLog(connect_primary)
+
+    @app.route('/api/audit', methods=['GET'])
+    def audit_trail():
+        conditions = []
+        params = []
+        for arg, column in (('table', 'table_name'), ('record_id', 'record_id'), ('user_id', 'user_id'),
+                            ('action', 'action')):
+            value = request.args.get(arg)
+            if value:
+                conditions.append(f"{column} = %s")
+                params.append(value)
+        limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT audit_id as id, occurred_at, user_id, username, remote_addr, action,
+                       table_name, record_id, changes
+                FROM audit_log
+                {where}
+                ORDER BY audit_id DESC
+                LIMIT %s
+            """, (*params, limit))
+            entries = cursor.fetchall()
+            for e in entries:
+                e['occurred_at'] = str(e['occurred_at'])
+                e['changes'] = json.loads(e['changes']) if e['changes'] else None
+            return jsonify(entries), 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cursor.close()
+            conn.close()
+
+    @app.route('/api/metrics/audit', methods=['GET'])
+    def audit_metrics():
+        return jsonify(audit.status()), 200
+
+    @app.cli.command('init-audit-log')
+    def init_audit_log():
+        """Create the audit_log table."""
+        conn = connect_primary()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(AUDIT_DDL)
+            conn.commit()
+        finally:
+            conn.close()
+        click.echo("Audit log ready.")
+
+    @app.cli.command('replay-audit-spill')
+    def replay_audit_spill():
+        """Load spilled audit entries into audit_log and remove the files."""
+        total = 0
+        for path in spill_files():
+            by_tenant = {}
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        e = json.loads(line)
+                        by_tenant.setdefault(e.get('tenant', DEFAULT_TENANT), []).append((
+                            e['occurred_at'], e['user_id'], e['username'], e['remote_addr'], e['action'],
+                            e['table_name'], e['record_id'], json.dumps(e['changes'])))
+            count = 0
+            for tenant_id, rows in by_tenant.items():
+                with use_tenant(tenant_id):
+                    for i in range(0, len(rows), AUDIT_BATCH_SIZE):
+                        audit._insert(rows[i:i + AUDIT_BATCH_SIZE])
+                count += len(rows)
+            os.remove(path)
+            total += count
+            click.echo(f"{path}: {count} entries")
+        click.echo(f"Replayed {total} audit entries.")
+
+    return audit
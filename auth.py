@@ -0,0 +1,437 @@
+"""Token authentication and per-route role checks for the API.
+
+``POST /api/auth/login`` checks a PBKDF2 password hash from the ``users``
+table and issues a signed, expiring token (returned in the body and set as
+an HttpOnly cookie for the browser UI). Each request then verifies its
+token without touching the database: a bounded LRU cache of already-decoded
+tokens is consulted first, falling back to the HMAC signature check, and
+every hit is checked against a revocation table shared by all workers.
+``Server-Timing: auth;dur=...`` reports the time spent per request.
+
+Tokens carry the tenant they were issued for (see ``tenancy``) and are
+rejected by every other tenant.
+
+Set ``AUTH_ENABLED=0`` to run the API open, as before, during development.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import click
+import pymysql
+from flask import g, jsonify, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from shared_state import SharedRegion, key_hash as shared_key_hash, runtime_path
+from tenancy import DEFAULT_TENANT, current_tenant_id
+
+AUTH_ENABLED = os.getenv('AUTH_ENABLED', '1').lower() not in ('0', 'false', 'no')
+AUTH_TOKEN_TTL_S = int(os.getenv('AUTH_TOKEN_TTL_S', '28800'))
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '4096'))
+AUTH_PBKDF2_ITERATIONS = int(os.getenv('AUTH_PBKDF2_ITERATIONS', '310000'))
+AUTH_MAX_LOGIN_ATTEMPTS = int(os.getenv('AUTH_MAX_LOGIN_ATTEMPTS', '10'))
+
+TOKEN_COOKIE = 'hms_token'
+HASH_SCHEME = 'pbkdf2_sha256'
+
+ADMIN = ('Admin',)
+CLINICAL = ('Admin', 'Doctor')
+STAFF = ('Admin', 'Doctor', 'Staff')
+ANY_ROLE = ('Admin', 'Doctor', 'Staff', 'Patient')
+
+# Roles allowed per HTTP method for every endpoint without its own entry.
+DEFAULT_POLICY = {'GET': STAFF, 'POST': STAFF, 'PUT': STAFF, 'DELETE': ADMIN}
+_ADMIN_WRITES = {'GET': STAFF, 'POST': ADMIN, 'PUT': ADMIN, 'DELETE': ADMIN}
+ROUTE_ROLES = {
+    'manage_records': {'GET': STAFF, 'POST': CLINICAL, 'PUT': CLINICAL, 'DELETE': ADMIN},
+    'record_attachments': {'GET': STAFF, 'POST': CLINICAL},
+    'manage_doctors': _ADMIN_WRITES,
+    'manage_departments': _ADMIN_WRITES,
+    'manage_staff': _ADMIN_WRITES,
+    'manage_insurance': _ADMIN_WRITES,
+    'manage_test_types': _ADMIN_WRITES,
+    'export_patients_json': {'GET': ADMIN},
+    'export_patients_csv': {'GET': ADMIN},
+    'admission_metrics': {'GET': ADMIN},
+    'resource_metrics': {'GET': ADMIN},
+    'inventory_metrics': {'GET': ADMIN},
+    'audit_trail': {'GET': ADMIN},
+    'audit_metrics': {'GET': ADMIN},
+    'report_image': {'GET': ADMIN},
+    'report_metrics': {'GET': ADMIN},
+    'dunning_metrics': {'GET': ADMIN},
+    'archive_metrics': {'GET': ADMIN},
+    'sequence_metrics': {'GET': ADMIN},
+    'profile_list': {'GET': ADMIN},
+    'profile_flame': {'GET': ADMIN},
+    'profile_detail': {'GET': ADMIN},
+    'auth_me': {'GET': ANY_ROLE},
+    'auth_logout': {'POST': ANY_ROLE},
+    'auth_revoke': {'POST': ADMIN},
+    'auth_stats': {'GET': ADMIN},
+}
+
+# Reachable without a token.
+PUBLIC_ENDPOINTS = {'index', 'static', 'static_asset', 'auth_login', 'health_check', 'tenant_info'}
+
+
+# --- Password hashing ---
+def hash_password(password, salt=None, iterations=AUTH_PBKDF2_ITERATIONS):
+    """Returns ``(password_hash, salt)`` for the ``users`` table."""
+    salt = salt or secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), iterations)
+    return f"{HASH_SCHEME}${iterations}${digest.hex()}", salt
+
+
+def verify_password(password, password_hash, salt):
+    """Checks ``password`` against a stored hash in constant time.
+
+    Rows written before hashing was introduced hold the plain password;
+    they still verify so the login can upgrade them (see ``needs_rehash``).
+    """
+    if not password_hash.startswith(HASH_SCHEME + '$'):
+        return hmac.compare_digest(password.encode('utf-8'), password_hash.encode('utf-8'))
+    _, iterations, expected = password_hash.split('$', 2)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def needs_rehash(password_hash):
+    if not password_hash.startswith(HASH_SCHEME + '$'):
+        return True
+    return int(password_hash.split('$', 2)[1]) < AUTH_PBKDF2_ITERATIONS
+
+
+# --- Signing key ---
+def load_secret_key():
+    """``SECRET_KEY`` from the environment, else a key shared by this host's workers."""
+    key = os.getenv('SECRET_KEY')
+    if key:
+        return key
+    path = runtime_path('auth_secret')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path) as f:
+            return f.read().strip()
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    return key
+
+
+# --- Principals and revocation ---
+class Principal:
+    """The authenticated caller of a request."""
+
+    __slots__ = ('user_id', 'username', 'role', 'related_id', 'jti', 'issued_at', 'expires_at', 'tenant_id')
+
+    def __init__(self, user_id, username, role, related_id, jti, issued_at, expires_at, tenant_id=DEFAULT_TENANT):
+        self.tenant_id = tenant_id
+        self.user_id = user_id
+        self.username = username
+        self.role = role
+        self.related_id = related_id
+        self.jti = jti
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "username": self.username,
+            "role": self.role,
+            "related_id": self.related_id,
+            "tenant": self.tenant_id,
+            "expires_at": int(self.expires_at),
+        }
+
+
+_REVOCATION_SLOTS = 8192
+_REVOCATION_PROBES = 16
+_REVOCATION = struct.Struct('<Qdd')  # key hash, not-before (user keys), expires
+
+
+class RevocationList:
+    """Revoked token ids and per-user not-before times, shared across workers.
+
+    Entries only need to outlive the tokens they revoke, so expired slots are
+    reused and the table stays a fixed size.
+    """
+
+    def __init__(self, region_name='auth_revocations.bin'):
+        self.region = SharedRegion(region_name, _REVOCATION_SLOTS * _REVOCATION.size)
+
+    def _put(self, key, not_before, expires):
+        key_hash = shared_key_hash(key)
+        start = key_hash % _REVOCATION_SLOTS
+        now = time.time()
+        with self.region.locked() as buf:
+            target = None
+            for probe in range(_REVOCATION_PROBES):
+                offset = ((start + probe) % _REVOCATION_SLOTS) * _REVOCATION.size
+                slot_hash, slot_not_before, slot_expires = _REVOCATION.unpack_from(buf, offset)
+                if slot_hash == key_hash:
+                    target = offset
+                    not_before = max(not_before, slot_not_before)
+                    expires = max(expires, slot_expires)
+                    break
+                if target is None and (slot_hash == 0 or slot_expires < now):
+                    target = offset
+            if target is None:
+                # Every probed slot is live; evict the one expiring soonest.
+                target = min((((start + p) % _REVOCATION_SLOTS) * _REVOCATION.size for p in range(_REVOCATION_PROBES)),
+                             key=lambda off: _REVOCATION.unpack_from(buf, off)[2])
+            _REVOCATION.pack_into(buf, target, key_hash, not_before, expires)
+
+    def _get(self, buf, key, now):
+        key_hash = shared_key_hash(key)
+        start = key_hash % _REVOCATION_SLOTS
+        for probe in range(_REVOCATION_PROBES):
+            offset = ((start + probe) % _REVOCATION_SLOTS) * _REVOCATION.size
+            slot_hash, not_before, expires = _REVOCATION.unpack_from(buf, offset)
+            if slot_hash == key_hash and expires >= now:
+                return not_before
+            if slot_hash == 0:
+                return None
+        return None
+
+    def revoke_token(self, jti, expires_at):
+        self._put(f'jti:{jti}', 0.0, expires_at)
+
+    def revoke_user(self, user_id, tenant_id, now=None):
+        """Invalidates every token issued to ``user_id`` of ``tenant_id`` up to now."""
+        now = time.time() if now is None else now
+        self._put(f'user:{tenant_id}:{user_id}', now, now + AUTH_TOKEN_TTL_S)
+
+    def is_revoked(self, principal, now=None):
+        now = time.time() if now is None else now
+        with self.region.locked() as buf:
+            if self._get(buf, f'jti:{principal.jti}', now) is not None:
+                return True
+            not_before = self._get(buf, f'user:{principal.tenant_id}:{principal.user_id}', now)
+        return not_before is not None and principal.issued_at <= not_before
+
+
+class TokenAuthority:
+    """Issues tokens and verifies them through a bounded LRU cache."""
+
+    def __init__(self, secret_key=None, ttl=AUTH_TOKEN_TTL_S, cache_size=AUTH_CACHE_SIZE, revocations=None):
+        self.serializer = URLSafeTimedSerializer(secret_key or load_secret_key(), salt='hms-auth')
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.revocations = revocations or RevocationList()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"verified": 0, "cache_hits": 0, "rejected": 0, "total_us": 0.0}
+
+    def issue(self, user):
+        payload = {
+            "uid": user['user_id'],
+            "name": user['username'],
+            "role": user['role'],
+            "rid": user.get('related_id'),
+            "jti": secrets.token_urlsafe(12),
+            "tid": current_tenant_id(),
+        }
+        return self.serializer.dumps(payload)
+
+    def _decode(self, token):
+        payload, signed_at = self.serializer.loads(token, max_age=self.ttl, return_timestamp=True)
+        issued_at = signed_at.timestamp()
+        return Principal(payload['uid'], payload['name'], payload['role'], payload.get('rid'),
+                         payload['jti'], issued_at, issued_at + self.ttl, payload.get('tid', DEFAULT_TENANT))
+
+    def claimed_tenant(self):
+        """The tenant named by the request's token, unverified; for routing only."""
+        token = token_from_request()
+        if not token:
+            return None
+        _, payload = self.serializer.loads_unsafe(token)
+        return payload.get('tid') if isinstance(payload, dict) else None
+
+    def verify(self, token):
+        """The token's ``Principal``, or ``None`` if invalid, expired or revoked."""
+        now = time.time()
+        with self._lock:
+            principal = self._cache.get(token)
+            if principal is not None:
+                self._cache.move_to_end(token)
+                self.stats["cache_hits"] += 1
+        if principal is None:
+            try:
+                principal = self._decode(token)
+            except (BadSignature, SignatureExpired, KeyError, TypeError, ValueError):
+                return None
+            with self._lock:
+                self._cache[token] = principal
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        if principal.expires_at <= now or self.revocations.is_revoked(principal, now):
+            with self._lock:
+                self._cache.pop(token, None)
+            return None
+        return principal
+
+    def forget(self, token):
+        with self._lock:
+            self._cache.pop(token, None)
+
+
+def token_from_request():
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[7:].strip()
+    return request.cookies.get(TOKEN_COOKIE)
+
+
+def allowed_roles(endpoint, method):
+    policy = ROUTE_ROLES.get(endpoint, DEFAULT_POLICY)
+    if method == 'HEAD':
+        method = 'GET'
+    return policy.get(method, ())
+
+
+def init_auth(app, get_db_connection, authority=None):
+    """Installs token verification, role checks and the ``/api/auth`` routes."""
+    authority = authority or TokenAuthority()
+    app.extensions['auth'] = authority
+
+    @app.before_request
+    def authenticate_request():
+        g.principal = None
+        if not AUTH_ENABLED or request.method == 'OPTIONS':
+            return None
+        if not request.path.startswith('/api/') or request.endpoint in PUBLIC_ENDPOINTS:
+            return None
+        started = time.perf_counter()
+        token = token_from_request()
+        principal = authority.verify(token) if token else None
+        g.auth_us = (time.perf_counter() - started) * 1e6
+        authority.stats["total_us"] += g.auth_us
+        if principal is None or principal.tenant_id != current_tenant_id():
+            authority.stats["rejected"] += 1
+            return jsonify({"error": "Authentication required"}), 401
+        authority.stats["verified"] += 1
+        if principal.role not in allowed_roles(request.endpoint, request.method):
+            return jsonify({"error": "You do not have permission to perform this action"}), 403
+        g.principal = principal
+        return None
+
+    @app.after_request
+    def report_auth_time(response):
+        auth_us = g.get('auth_us')
+        if auth_us is not None:
+            response.headers.add('Server-Timing', f'auth;dur={auth_us / 1000:.3f}')
+        return response
+
+    @app.route('/api/auth/login', methods=['POST'])
+    def auth_login():
+        data = request.json or {}
+        username = data.get('username')
+        password = data.get('password')
+        if not username or not password:
+            return jsonify({"error": "Username and password are required"}), 400
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT user_id, username, password_hash, salt, role, related_id, account_locked
+                FROM users WHERE username = %s
+            """, (username,))
+            user = cursor.fetchone()
+            if user and user['account_locked']:
+                return jsonify({"error": "Account is locked"}), 403
+            if not user or not verify_password(password, user['password_hash'], user['salt'] or ''):
+                if user:
+                    cursor.execute("""
+                        UPDATE users SET login_attempts = login_attempts + 1,
+                               account_locked = login_attempts >= %s
+                        WHERE user_id = %s
+                    """, (AUTH_MAX_LOGIN_ATTEMPTS, user['user_id']))
+                    conn.commit()
+                return jsonify({"error": "Invalid username or password"}), 401
+
+            if needs_rehash(user['password_hash']):
+                password_hash, salt = hash_password(password)
+                cursor.execute("""
+                    UPDATE users SET password_hash = %s, salt = %s, password_changed_at = NOW()
+                    WHERE user_id = %s
+                """, (password_hash, salt, user['user_id']))
+            cursor.execute("UPDATE users SET last_login = NOW(), login_attempts = 0 WHERE user_id = %s",
+                           (user['user_id'],))
+            conn.commit()
+        except pymysql.Error as e:
+            conn.rollback()
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        finally:
+            cursor.close()
+            conn.close()
+
+        token = authority.issue(user)
+        response = jsonify({"token": token, "expires_in": authority.ttl,
+                            "role": user['role'], "username": user['username']})
+        response.set_cookie(TOKEN_COOKIE, token, max_age=authority.ttl, httponly=True,
+                            samesite='Strict', secure=request.is_secure)
+        return response, 200
+
+    @app.route('/api/auth/logout', methods=['POST'])
+    def auth_logout():
+        principal = g.get('principal')
+        token = token_from_request()
+        if principal is not None:
+            authority.revocations.revoke_token(principal.jti, principal.expires_at)
+        if token:
+            authority.forget(token)
+        response = jsonify({"message": "Logged out successfully"})
+        response.delete_cookie(TOKEN_COOKIE)
+        return response, 200
+
+    @app.route('/api/auth/me', methods=['GET'])
+    def auth_me():
+        principal = g.get('principal')
+        if principal is None:
+            return jsonify({"auth_enabled": False}), 200
+        return jsonify(principal.to_dict()), 200
+
+    @app.route('/api/auth/revoke', methods=['POST'])
+    def auth_revoke():
+        data = request.json or {}
+        if 'user_id' not in data:
+            return jsonify({"error": "Missing required fields"}), 400
+        authority.revocations.revoke_user(data['user_id'], current_tenant_id())
+        return jsonify({"message": "All tokens for the user have been revoked"}), 200
+
+    @app.route('/api/auth/stats', methods=['GET'])
+    def auth_stats():
+        stats = dict(authority.stats)
+        checked = stats["verified"] + stats["rejected"]
+        stats["avg_us"] = round(stats.pop("total_us") / checked, 2) if checked else 0.0
+        return jsonify(stats), 200
+
+    @app.cli.command('create-user')
+    @click.argument('username')
+    @click.argument('role', type=click.Choice(list(ANY_ROLE)))
+    @click.option('--related-id', type=int, default=None)
+    @click.password_option()
+    def create_user(username, role, related_id, password):
+        """Create a login with a hashed password."""
+        password_hash, salt = hash_password(password)
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO users (username, password_hash, salt, role, related_id, password_changed_at)
+                    VALUES (%s, %s, %s, %s, %s, NOW())
+                """, (username, password_hash, salt, role, related_id))
+            conn.commit()
+        finally:
+            conn.close()
+        click.echo(f"User {username} created.")
+
+    return authority
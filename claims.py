@@ -0,0 +1,384 @@
+"""Insurance claim files, generated per provider by a background job.
+
+A claim job takes every insurance provider (or one), and for each writes a
+claim file of the provider's claimable bills: not paid, not yet claimed,
+for a patient insured with it. Bills are read in keyset-paginated batches of
+``CLAIMS_BATCH_SIZE`` (``bill_id > last`` on the primary key), each batch is
+appended to the file (CSV, or JSON lines with ``format=jsonl``) and flushed,
+then marked ``claim_status = 'Submitted'`` with its ``claim_batch_id`` in one
+chunked UPDATE and commit. Memory use is one batch whatever the backlog.
+
+Every provider's file is a ``claim_batch`` row that also carries the job's
+progress (bills and amount written so far, status), so any worker can
+answer ``GET /api/claims/jobs/<job_id>``. A provider is claimed by one job
+at a time (a MySQL named lock); a job that finds it busy marks its batch
+``Skipped``. A bill is only marked if still unclaimed. A batch that fails
+half way releases the bills it had marked (in chunks) and drops its file,
+so the next job claims them again. A batch left ``Running`` by a worker
+that died is released the same way by the next job that takes the
+provider's lock: the lock dies with its connection, so while it is held no
+other batch of that provider can really be running.
+
+Files are written under ``CLAIMS_DIR/<tenant>/``. Run ``flask init-claims``
+once on an existing database; ``flask generate-claims`` runs a job in the
+foreground.
+"""
+import csv
+import json
+import os
+import threading
+import time
+import uuid
+
+import click
+import pymysql
+from flask import jsonify, request, send_file
+
+from tenancy import current_tenant_id, use_tenant
+
+CLAIMS_DIR = os.path.abspath(os.getenv('CLAIMS_DIR', 'claims'))
+CLAIMS_BATCH_SIZE = int(os.getenv('CLAIMS_BATCH_SIZE', '500'))
+CLAIMS_MAX_JOBS = int(os.getenv('CLAIMS_MAX_JOBS', '2'))
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+CLAIMABLE_STATUSES = ('Unpaid', 'Partial', 'Overdue')
+
+CLAIM_BATCH_DDL = """
+CREATE TABLE IF NOT EXISTS claim_batch (
+    claim_batch_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    job_id CHAR(32) NOT NULL,
+    provider_id INT NOT NULL,
+    format ENUM('csv', 'jsonl') NOT NULL,
+    status ENUM('Queued', 'Running', 'Done', 'Skipped', 'Failed') NOT NULL DEFAULT 'Queued',
+    bills INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    file_path VARCHAR(500),
+    error VARCHAR(500),
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at DATETIME,
+    INDEX idx_claim_batch_job (job_id),
+    INDEX idx_claim_batch_provider (provider_id, claim_batch_id),
+    FOREIGN KEY (provider_id) REFERENCES insurance_provider(provider_id) ON DELETE CASCADE
+)
+"""
+CLAIM_COLUMNS_DDL = """
+ALTER TABLE billing
+    ADD COLUMN claim_status ENUM('Submitted', 'Accepted', 'Rejected') NULL,
+    ADD COLUMN claim_batch_id BIGINT NULL,
+    ADD INDEX idx_billing_claim (claim_status, bill_id),
+    ADD INDEX idx_billing_claim_batch (claim_batch_id)
+"""
+
+CLAIM_FIELDS = ['invoice_number', 'bill_id', 'bill_date', 'due_date', 'patient_id', 'patient_name',
+                'policy_number', 'doctor_name', 'amount', 'tax', 'discount', 'total_amount', 'items']
+
+_SELECT_BATCH = f"""
+    SELECT b.invoice_number, b.bill_id, b.date as bill_date, b.due_date,
+           p.patient_id, p.name as patient_name, p.insurance_policy_number as policy_number,
+           d.name as doctor_name, b.amount, b.tax, b.discount, b.total_amount, b.items
+    FROM billing b
+    JOIN patient p ON b.patient_id = p.patient_id
+    LEFT JOIN doctor d ON b.doctor_id = d.doctor_id
+    WHERE b.claim_status IS NULL
+      AND b.status IN ({', '.join(repr(status) for status in CLAIMABLE_STATUSES)})
+      AND p.insurance_provider_id = %s
+      AND b.bill_id > %s
+    ORDER BY b.bill_id
+    LIMIT %s
+"""
+
+
+class ClaimWriter:
+    """Appends claim rows to a CSV or JSON lines file."""
+
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=CLAIM_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == 'csv':
+                self._csv.writerow(row)
+            else:
+                row = dict(row)
+                try:
+                    row['items'] = json.loads(row['items']) if row['items'] else []
+                except json.JSONDecodeError:
+                    pass
+                self._file.write(json.dumps(row, default=str) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def claim_provider(conn, batch_id, provider_id, fmt, directory, batch_size=CLAIMS_BATCH_SIZE, on_change=None):
+    """Writes one provider's claim file and marks its bills; returns ``(bills, amount)``."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, 0) as locked", (f"claims:{provider_id}",))
+        if not cursor.fetchone()['locked']:
+            cursor.execute("UPDATE claim_batch SET status = 'Skipped', error = %s, finished_at = NOW() "
+                           "WHERE claim_batch_id = %s", ("Another job is claiming this provider", batch_id))
+            conn.commit()
+            return 0, 0
+        try:
+            cursor.execute("SELECT claim_batch_id FROM claim_batch WHERE provider_id = %s AND status = 'Running'",
+                           (provider_id,))
+            for row in cursor.fetchall():
+                release_batch(conn, row['claim_batch_id'], "Abandoned: the worker running it stopped")
+            path = os.path.join(directory, f"claims-{provider_id}-{batch_id}.{fmt}")
+            cursor.execute("UPDATE claim_batch SET status = 'Running', file_path = %s WHERE claim_batch_id = %s",
+                           (path, batch_id))
+            conn.commit()
+            writer = ClaimWriter(path, fmt)
+            bills, amount, last_id = 0, 0, 0
+            try:
+                while True:
+                    cursor.execute(_SELECT_BATCH, (provider_id, last_id, batch_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    writer.write(rows)
+                    ids = [row['bill_id'] for row in rows]
+                    cursor.execute(f"""
+                        UPDATE billing SET claim_status = 'Submitted', claim_batch_id = %s
+                        WHERE bill_id IN ({', '.join(['%s'] * len(ids))}) AND claim_status IS NULL
+                    """, (batch_id, *ids))
+                    bills += len(rows)
+                    amount += sum(row['total_amount'] or 0 for row in rows)
+                    cursor.execute("UPDATE claim_batch SET bills = %s, total_amount = %s WHERE claim_batch_id = %s",
+                                   (bills, amount, batch_id))
+                    conn.commit()
+                    if on_change is not None:
+                        on_change()
+                    last_id = ids[-1]
+            finally:
+                writer.close()
+            cursor.execute("UPDATE claim_batch SET status = 'Done', finished_at = NOW() WHERE claim_batch_id = %s",
+                           (batch_id,))
+            conn.commit()
+            return bills, amount
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (f"claims:{provider_id}",))
+
+
+def release_batch(conn, batch_id, error, batch_size=CLAIMS_BATCH_SIZE):
+    """Marks a batch failed, unclaims its bills and removes its partial file."""
+    with conn.cursor() as cursor:
+        while cursor.execute("UPDATE billing SET claim_status = NULL, claim_batch_id = NULL "
+                             "WHERE claim_batch_id = %s LIMIT %s", (batch_id, batch_size)):
+            conn.commit()
+        cursor.execute("SELECT file_path FROM claim_batch WHERE claim_batch_id = %s", (batch_id,))
+        row = cursor.fetchone()
+        cursor.execute("UPDATE claim_batch SET status = 'Failed', bills = 0, total_amount = 0, file_path = NULL, "
+                       "error = %s, finished_at = NOW() WHERE claim_batch_id = %s", (error[:500], batch_id))
+        conn.commit()
+    if row and row['file_path'] and os.path.exists(row['file_path']):
+        os.remove(row['file_path'])
+
+
+class ClaimJobs:
+    """Starts claim jobs on background threads of this worker."""
+
+    def __init__(self, connect, on_change=None, max_jobs=CLAIMS_MAX_JOBS):
+        self.connect = connect
+        self.on_change = on_change
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._running = 0
+
+    def create(self, provider_id=None, fmt='csv'):
+        """Queues a batch per provider; returns ``(job_id, batch_ids)``."""
+        job_id = uuid.uuid4().hex
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                if provider_id is None:
+                    cursor.execute("SELECT provider_id FROM insurance_provider ORDER BY provider_id")
+                else:
+                    cursor.execute("SELECT provider_id FROM insurance_provider WHERE provider_id = %s", (provider_id,))
+                providers = [row['provider_id'] for row in cursor.fetchall()]
+                if providers:
+                    cursor.executemany("INSERT INTO claim_batch (job_id, provider_id, format) VALUES (%s, %s, %s)",
+                                       [(job_id, provider, fmt) for provider in providers])
+                    cursor.execute("SELECT claim_batch_id, provider_id FROM claim_batch WHERE job_id = %s "
+                                   "ORDER BY claim_batch_id", (job_id,))
+                    batches = [(row['claim_batch_id'], row['provider_id']) for row in cursor.fetchall()]
+                else:
+                    batches = []
+            conn.commit()
+        finally:
+            conn.close()
+        return job_id, batches
+
+    def run(self, job_id, batches, fmt, progress=None):
+        """Claims every batch of a job in turn; ``progress(provider_id, bills, amount)``."""
+        directory = os.path.join(CLAIMS_DIR, current_tenant_id())
+        os.makedirs(directory, exist_ok=True)
+        for batch_id, provider_id in batches:
+            conn = self.connect()
+            try:
+                bills, amount = claim_provider(conn, batch_id, provider_id, fmt, directory,
+                                               on_change=self.on_change)
+            except Exception as e:
+                conn.rollback()
+                release_batch(conn, batch_id, str(e))
+                bills, amount = 0, 0
+            finally:
+                conn.close()
+            if progress is not None:
+                progress(provider_id, bills, amount)
+
+    def start(self, provider_id=None, fmt='csv'):
+        """Creates a job and runs it on a new thread; returns ``(job_id, batches)`` or ``None`` when busy."""
+        with self._lock:
+            if self._running >= self.max_jobs:
+                return None
+            self._running += 1
+        try:
+            job_id, batches = self.create(provider_id, fmt)
+        except Exception:
+            self._finished()
+            raise
+        tenant_id = current_tenant_id()
+
+        def work():
+            try:
+                with use_tenant(tenant_id):
+                    self.run(job_id, batches, fmt)
+            finally:
+                self._finished()
+
+        threading.Thread(target=work, name=f'claims-{job_id[:8]}', daemon=True).start()
+        return job_id, batches
+
+    def _finished(self):
+        with self._lock:
+            self._running -= 1
+
+
+def _batch_row(row):
+    row = dict(row)
+    row['total_amount'] = float(row['total_amount'])
+    for column in ('created_at', 'finished_at'):
+        row[column] = str(row[column]) if row[column] is not None else None
+    row.pop('file_path', None)
+    return row
+
+
+def init_claims(app, get_db_connection, connect_primary, on_change=None):
+    """Adds the claim job routes and CLI commands."""
+    jobs = ClaimJobs(connect_primary, on_change=on_change)
+
+    @app.route('/api/claims/jobs', methods=['POST'])
+    def start_claim_job():
+        data = request.get_json(silent=True) or {}
+        fmt = data.get('format', 'csv')
+        if fmt not in FORMATS:
+            return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
+        provider_id = data.get('provider_id')
+        if provider_id is not None and (not isinstance(provider_id, int) or isinstance(provider_id, bool)):
+            return jsonify({"error": "provider_id must be an integer"}), 400
+        try:
+            started = jobs.start(provider_id, fmt)
+        except pymysql.Error as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        if started is None:
+            return jsonify({"error": "Too many claim jobs are running, try again later"}), 409
+        job_id, batches = started
+        if not batches:
+            return jsonify({"error": "Insurance provider not found"}), 404
+        return jsonify({"message": "Claim job started", "job_id": job_id,
+                        "providers": len(batches), "status_url": f"/api/claims/jobs/{job_id}"}), 202
+
+    @app.route('/api/claims/jobs/<job_id>', methods=['GET'])
+    def claim_job_status(job_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT cb.claim_batch_id as id, cb.provider_id, ip.name as provider_name, cb.format,
+                       cb.status, cb.bills, cb.total_amount, cb.error, cb.created_at, cb.finished_at, cb.file_path
+                FROM claim_batch cb JOIN insurance_provider ip ON cb.provider_id = ip.provider_id
+                WHERE cb.job_id = %s ORDER BY cb.claim_batch_id
+            """, (job_id,))
+            batches = [_batch_row(row) for row in cursor.fetchall()]
+        except pymysql.Error as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        finally:
+            cursor.close()
+            conn.close()
+        if not batches:
+            return jsonify({"error": "Claim job not found"}), 404
+        finished = [b for b in batches if b['status'] in ('Done', 'Skipped', 'Failed')]
+        return jsonify({
+            "job_id": job_id,
+            "status": "finished" if len(finished) == len(batches) else "running",
+            "providers_total": len(batches),
+            "providers_done": len(finished),
+            "bills": sum(b['bills'] for b in batches),
+            "total_amount": round(sum(b['total_amount'] for b in batches), 2),
+            "batches": batches,
+        }), 200
+
+    @app.route('/api/claims/batches/<int:batch_id>/file', methods=['GET'])
+    def claim_batch_file(batch_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT provider_id, format, status, file_path FROM claim_batch WHERE claim_batch_id = %s",
+                           (batch_id,))
+            batch = cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+        if batch is None or not batch['file_path'] or not os.path.exists(batch['file_path']):
+            return jsonify({"error": "Claim file not found"}), 404
+        if batch['status'] != 'Done':
+            return jsonify({"error": f"Claim file is not complete (status {batch['status']})"}), 409
+        return send_file(batch['file_path'], mimetype=FORMATS[batch['format']], as_attachment=True,
+                         download_name=os.path.basename(batch['file_path']), conditional=True)
+
+    @app.cli.command('init-claims')
+    def init_claims_tables():
+        """Add claim columns to billing and create the claim_batch table."""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(CLAIM_BATCH_DDL)
+                cursor.execute("""SELECT COUNT(*) as n FROM information_schema.columns
+                                  WHERE table_schema = DATABASE() AND table_name = 'billing'
+                                  AND column_name = 'claim_status'""")
+                if not cursor.fetchone()['n']:
+                    cursor.execute(CLAIM_COLUMNS_DDL)
+            conn.commit()
+        finally:
+            conn.close()
+        click.echo("Claim tables ready.")
+
+    @app.cli.command('generate-claims')
+    @click.option('--provider', 'provider_id', type=int, help='Only this insurance provider.')
+    @click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv', show_default=True)
+    def generate_claims(provider_id, fmt):
+        """Write claim files for unpaid insured bills, per provider."""
+        started = time.monotonic()
+        job_id, batches = jobs.create(provider_id, fmt)
+        if not batches:
+            click.echo("No insurance providers to claim from.")
+            return
+        done = [0]
+
+        def progress(provider, bills, amount):
+            done[0] += 1
+            click.echo(f"[{done[0]}/{len(batches)}] provider {provider}: {bills} bills, {amount:.2f}")
+
+        jobs.run(job_id, batches, fmt, progress)
+        click.echo(f"Claim job {job_id} finished in {time.monotonic() - started:.1f}s; files are in "
+                   f"{os.path.join(CLAIMS_DIR, current_tenant_id())}.")
+
+    return jobs
@@ -0,0 +1,138 @@
+"""Single-flight coalescing of identical concurrent GET requests.
+
+While one request for a given endpoint and query string is running its
+query, identical requests arriving on other threads of the same worker wait
+for it and reuse its response body instead of querying again. With
+``COALESCE_WINDOW_MS`` set, a successful body is also reused for that long
+after it was produced; any write handled by the worker clears the window.
+
+Requests that must see the primary (recent writers, ``X-Consistency:
+primary``, see ``db_routing``) always run on their own, so coalescing never
+hides a client's own write from it.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+
+from db_routing import WRITE_METHODS, wants_replica
+from tenancy import current_tenant_id
+
+COALESCE_WINDOW_MS = int(os.getenv('COALESCE_WINDOW_MS', '0'))
+COALESCE_WINDOW_ENTRIES = int(os.getenv('COALESCE_WINDOW_ENTRIES', '256'))
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share it."""
+
+    def __init__(self, window_ms=COALESCE_WINDOW_MS, max_entries=COALESCE_WINDOW_ENTRIES):
+        self.window = window_ms / 1000.0
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._recent = OrderedDict()
+        self._counters = {'leaders': 0, 'followers': 0, 'window_hits': 0}
+
+    def do(self, key, fn, remember=None):
+        """Returns ``fn()``, or the result of an identical call already running.
+
+        ``remember(result)`` decides whether a result may be reused within
+        the window; exceptions are shared with waiting callers but never kept.
+        """
+        with self._lock:
+            if self.window:
+                entry = self._recent.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._counters['window_hits'] += 1
+                    return entry[1]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters['leaders'] += 1
+            else:
+                self._counters['followers'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if (self.window and call.error is None
+                        and (remember is None or remember(call.result))):
+                    self._recent[key] = (time.monotonic() + self.window, call.result)
+                    self._recent.move_to_end(key)
+                    while len(self._recent) > self.max_entries:
+                        self._recent.popitem(last=False)
+            call.event.set()
+
+    def forget_all(self):
+        with self._lock:
+            self._recent.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, in_flight=len(self._calls), window_entries=len(self._recent))
+
+
+flights = SingleFlight()
+
+
+def request_key():
+    """Normalized identity of the current GET: tenant, endpoint, view args and sorted query args."""
+    return (current_tenant_id(), request.endpoint, tuple(sorted((request.view_args or {}).items())),
+            tuple(sorted(request.args.items(multi=True))))
+
+
+def coalesced(view):
+    """Decorator sharing one execution of ``view`` among identical concurrent GETs.
+
+    The response body is rendered once and each caller gets its own response
+    object, so per-request headers and cookies stay independent.
+    """
+
+    def render(*args, **kwargs):
+        response = current_app.make_response(view(*args, **kwargs))
+        return response.get_data(), response.status_code, response.mimetype
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or not wants_replica():
+            return view(*args, **kwargs)
+        body, status, mimetype = flights.do(request_key(), lambda: render(*args, **kwargs),
+                                            remember=lambda result: result[1] == 200)
+        return current_app.response_class(body, status=status, mimetype=mimetype)
+
+    return wrapper
+
+
+def init_coalescing(app):
+    """Clears the result window whenever this worker handles a successful write."""
+
+    @app.after_request
+    def forget_after_write(response):
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            flights.forget_all()
+        return response
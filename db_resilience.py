@@ -0,0 +1,197 @@
+"""Bounded-time database access: per-route query deadlines and a circuit breaker.
+
+Every connection handed out by ``app.get_db_connection`` carries the current
+route's deadline three ways: ``connect_timeout`` bounds the handshake,
+``MAX_EXECUTION_TIME`` makes MySQL abort long SELECTs server-side, and the
+socket ``read_timeout``/``write_timeout`` catch everything else (a stalled
+server, a lock wait on a write). Connection failures and timeouts feed a
+per-worker circuit breaker; once it opens, requests fail fast with 503
+instead of tying up sync workers until MySQL recovers. Each server (primary
+and every replica) has its own breaker.
+"""
+import os
+import threading
+import time
+
+import pymysql
+from flask import has_request_context, request
+
+DB_CONNECT_TIMEOUT_S = float(os.getenv('DB_CONNECT_TIMEOUT_S', '3'))
+DB_QUERY_TIMEOUT_MS = int(os.getenv('DB_QUERY_TIMEOUT_MS', '5000'))
+DB_SCAN_TIMEOUT_MS = int(os.getenv('DB_SCAN_TIMEOUT_MS', '10000'))
+# Extra socket time on top of the server-side deadline, so MySQL's own
+# ER_QUERY_TIMEOUT normally arrives before the client gives up.
+DB_READ_TIMEOUT_SLACK_MS = int(os.getenv('DB_READ_TIMEOUT_SLACK_MS', '1000'))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('DB_BREAKER_FAILURES', '5'))
+BREAKER_RESET_TIMEOUT_S = float(os.getenv('DB_BREAKER_RESET_S', '10'))
+
+# Deadlines for routes that differ from the point-lookup/scan defaults.
+ROUTE_TIMEOUTS_MS = {
+    'health_check': 1000,
+    'get_today_appointments': 3000,
+    'export_patients_json': 20000,
+    'export_patients_csv': 20000,
+    'auto_schedule_appointments': 15000,
+}
+
+
+def _parse_route_timeouts(value):
+    # DB_ROUTE_TIMEOUTS="export_patients_csv=30000,get_low_stock=2000"
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        endpoint, _, ms = item.partition('=')
+        timeouts[endpoint.strip()] = int(ms)
+    return timeouts
+
+
+ROUTE_TIMEOUTS_MS.update(_parse_route_timeouts(os.getenv('DB_ROUTE_TIMEOUTS', '')))
+
+# Client-side error codes: can't connect, server gone away, lost connection
+# (what a read_timeout surfaces as); server-side: MAX_EXECUTION_TIME exceeded.
+TIMEOUT_ERROR_CODES = {2003, 2006, 2013, 3024}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of connecting while the breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__("Database is temporarily unavailable")
+        self.retry_after = retry_after
+
+
+def route_timeout_ms():
+    """Query deadline for the current request's route."""
+    if not has_request_context() or request.endpoint is None:
+        return DB_QUERY_TIMEOUT_MS
+    if request.endpoint in ROUTE_TIMEOUTS_MS:
+        return ROUTE_TIMEOUTS_MS[request.endpoint]
+    if request.method == 'GET' and not request.view_args:
+        return DB_SCAN_TIMEOUT_MS
+    return DB_QUERY_TIMEOUT_MS
+
+
+def is_unavailable_error(error):
+    """True for errors that mean the database is down or too slow."""
+    return (isinstance(error, pymysql.err.OperationalError)
+            and bool(error.args) and error.args[0] in TIMEOUT_ERROR_CODES)
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open single probe.
+
+    While open every call fails fast. After ``reset_timeout`` one request is
+    let through as a probe; its first query closes the breaker on success or
+    re-opens it on failure. A probe that never reports back (e.g. a request
+    rejected before querying) is replaced after another ``reset_timeout``.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT_S):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.rejected = 0
+        self.trips = 0
+
+    def before_call(self):
+        """Raises ``CircuitOpenError`` unless a call may go ahead."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.probe_started = None
+            if self.state == self.HALF_OPEN:
+                if self.probe_started is None or now - self.probe_started >= self.reset_timeout:
+                    self.probe_started = now
+                    return
+            self.rejected += 1
+            raise CircuitOpenError(max(1, int(self.reset_timeout - (now - self.opened_at)) + 1))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self.state = self.CLOSED
+                self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(config):
+    """The circuit breaker of the server ``config`` points at."""
+    key = (config.get('host'), config.get('port'))
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker()
+        return _breakers[key]
+
+
+class GuardedCursor(pymysql.cursors.DictCursor):
+    """DictCursor that reports query outcomes to its server's circuit breaker."""
+
+    def execute(self, query, args=None):
+        breaker = self.connection.breaker
+        try:
+            result = super().execute(query, args)
+        except pymysql.err.OperationalError as e:
+            if is_unavailable_error(e):
+                breaker.record_failure()
+            raise
+        breaker.record_success()
+        return result
+
+
+def connect(config, timeout_ms=None):
+    """Opens a connection whose every statement is bounded by ``timeout_ms``."""
+    if timeout_ms is None:
+        timeout_ms = route_timeout_ms()
+    breaker = breaker_for(config)
+    breaker.before_call()
+    socket_timeout = (timeout_ms + DB_READ_TIMEOUT_SLACK_MS) / 1000.0
+    options = dict(config)
+    options.update(
+        cursorclass=GuardedCursor,
+        connect_timeout=DB_CONNECT_TIMEOUT_S,
+        read_timeout=socket_timeout,
+        write_timeout=socket_timeout,
+        init_command=f"SET SESSION MAX_EXECUTION_TIME = {int(timeout_ms)}",
+    )
+    try:
+        conn = pymysql.connect(**options)
+    except pymysql.err.OperationalError as e:
+        if is_unavailable_error(e):
+            breaker.record_failure()
+        raise
+    conn.breaker = breaker
+    return conn
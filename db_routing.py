@@ -0,0 +1,200 @@
+"""Read/write splitting: GET traffic goes to healthy replicas, writes to the primary.
+
+Replicas are listed in ``DB_REPLICAS`` as ``host:port`` pairs and share the
+primary's user, password and database. A background thread per worker polls
+each replica's replication lag every ``DB_REPLICA_CHECK_INTERVAL_S``; replicas
+that are unreachable, not replicating or lagging more than
+``DB_REPLICA_MAX_LAG_S`` are skipped, and with no usable replica reads fall
+back to the primary.
+
+Read-your-writes: a successful POST/PUT/DELETE sets the ``hms_primary_until``
+cookie, and for ``READ_YOUR_WRITES_WINDOW_S`` afterwards that client's reads
+are served by the primary. Clients that do not keep cookies can send
+``X-Consistency: primary`` to force a primary read.
+
+Outside a request (background threads, CLI commands) ``Router.connect``
+always returns the primary, since those jobs write. Background code that
+only reads and tolerates lag asks for a replica with ``connect_read`` or
+``read_config``.
+
+To try it locally, start a second MySQL on port 3307 (ideally replicating
+from the first) and set ``DB_REPLICAS=127.0.0.1:3307``. A server with no
+replication configured is treated as a zero-lag copy.
+"""
+import itertools
+import os
+import threading
+import time
+
+import pymysql
+from flask import has_request_context, request
+
+import db_resilience
+from db_resilience import CircuitOpenError
+
+DB_REPLICA_MAX_LAG_S = float(os.getenv('DB_REPLICA_MAX_LAG_S', '5'))
+DB_REPLICA_CHECK_INTERVAL_S = float(os.getenv('DB_REPLICA_CHECK_INTERVAL_S', '5'))
+READ_YOUR_WRITES_WINDOW_S = float(os.getenv('READ_YOUR_WRITES_WINDOW_S', '5'))
+
+PIN_COOKIE = 'hms_primary_until'
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+
+def parse_replicas(value, base_config):
+    """Builds one connection config per ``host:port`` entry of ``value``."""
+    replicas = []
+    for entry in filter(None, (part.strip() for part in (value or '').split(','))):
+        host, _, port = entry.partition(':')
+        config = dict(base_config)
+        config['host'] = host
+        config['port'] = int(port) if port else base_config.get('port', 3306)
+        replicas.append(config)
+    return replicas
+
+
+def replication_lag(config, timeout=1.0):
+    """Seconds the server at ``config`` is behind its source.
+
+    Returns ``0`` for a server with no replication configured and ``None``
+    when replication is stopped or broken.
+    """
+    options = dict(config)
+    options.update(cursorclass=pymysql.cursors.DictCursor, connect_timeout=timeout,
+                   read_timeout=timeout, write_timeout=timeout)
+    conn = pymysql.connect(**options)
+    try:
+        with conn.cursor() as cursor:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except pymysql.err.ProgrammingError:
+                # MySQL before 8.0.22 and MariaDB only know the old name.
+                cursor.execute("SHOW SLAVE STATUS")
+            status = cursor.fetchone()
+    finally:
+        conn.close()
+    if not status:
+        return 0
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return None if lag is None else float(lag)
+
+
+class ReplicaSet:
+    """Tracks replica health and hands out the next usable replica."""
+
+    def __init__(self, replicas, max_lag=DB_REPLICA_MAX_LAG_S, check_interval=DB_REPLICA_CHECK_INTERVAL_S):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._status = {self._key(r): {"healthy": False, "lag": None, "checked_at": None, "error": None}
+                        for r in replicas}
+        self._cursor = itertools.count()
+        self._checker_pid = None
+
+    @staticmethod
+    def _key(config):
+        return f"{config['host']}:{config['port']}"
+
+    def check(self):
+        """Refreshes the health and lag of every replica once."""
+        for replica in self.replicas:
+            try:
+                lag = replication_lag(replica)
+                error = None if lag is not None else 'replication stopped'
+            except pymysql.Error as e:
+                lag, error = None, str(e)
+            with self._lock:
+                self._status[self._key(replica)] = {
+                    "healthy": lag is not None and lag <= self.max_lag,
+                    "lag": lag,
+                    "checked_at": time.time(),
+                    "error": error,
+                }
+
+    def _run_checker(self):
+        while True:
+            self.check()
+            time.sleep(self.check_interval)
+
+    def _ensure_checker(self):
+        # Threads do not survive gunicorn's fork, so each worker starts its own.
+        if self._checker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+        self.check()
+        threading.Thread(target=self._run_checker, name='replica-health', daemon=True).start()
+
+    def pick(self):
+        """Next healthy replica config in round-robin order, or ``None``."""
+        if not self.replicas:
+            return None
+        self._ensure_checker()
+        with self._lock:
+            healthy = [r for r in self.replicas if self._status[self._key(r)]["healthy"]]
+        if not healthy:
+            return None
+        return healthy[next(self._cursor) % len(healthy)]
+
+    def mark_unhealthy(self, config, error):
+        with self._lock:
+            self._status[self._key(config)].update(healthy=False, error=str(error))
+
+    def status(self):
+        with self._lock:
+            return {key: dict(value) for key, value in self._status.items()}
+
+
+def wants_replica():
+    """True when the current request may be served from a replica; never outside a request."""
+    if not has_request_context():
+        return False
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.headers.get('X-Consistency', '').lower() == 'primary':
+        return False
+    try:
+        pinned_until = float(request.cookies.get(PIN_COOKIE, 0))
+    except ValueError:
+        pinned_until = 0
+    return pinned_until <= time.time()
+
+
+class Router:
+    """Chooses the server for each connection and pins recent writers."""
+
+    def __init__(self, primary_config, replicas=None):
+        self.primary = primary_config
+        self.replicas = ReplicaSet(replicas if replicas is not None
+                                   else parse_replicas(os.getenv('DB_REPLICAS'), primary_config))
+
+    def read_config(self):
+        """A replica config for reads outside a request, falling back to the primary."""
+        return self.replicas.pick() or self.primary
+
+    def connect(self):
+        """Connects to a replica for replica-safe reads, otherwise to the primary."""
+        return self._connect(self.replicas.pick() if wants_replica() else None)
+
+    def connect_read(self):
+        """Connects to a replica for background reads that tolerate lag, falling back to the primary."""
+        return self._connect(self.replicas.pick())
+
+    def _connect(self, replica):
+        if replica is not None:
+            try:
+                return db_resilience.connect(replica)
+            except (CircuitOpenError, pymysql.err.OperationalError) as e:
+                self.replicas.mark_unhealthy(replica, e)
+        return db_resilience.connect(self.primary)
+
+    def init_app(self, app):
+        @app.after_request
+        def pin_recent_writer(response):
+            if request.method in WRITE_METHODS and response.status_code < 400:
+                response.set_cookie(PIN_COOKIE, f"{time.time() + READ_YOUR_WRITES_WINDOW_S:.3f}",
+                                    max_age=int(READ_YOUR_WRITES_WINDOW_S) + 1,
+                                    httponly=True, samesite='Lax')
+            return response
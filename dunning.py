@@ -0,0 +1,302 @@
+"""Overdue-bill sweeper: moves unpaid bills through the dunning levels.
+
+Bills past their ``due_date`` go from ``Unpaid``/``Partial`` to ``Overdue``
+(dunning level 1, first reminder), then are escalated by how long they have
+been overdue: ``DUNNING_STAGES`` days past due (default ``0,30,60,90``) give
+levels 1 to 4 (reminder, second notice, final notice, collections).
+
+The sweep never runs one big UPDATE. Each step walks the
+``(status, due_date)`` index in keyset order on ``(due_date, bill_id)`` (the
+index's implicit primary key gives the tie-break, so batches come back in
+index order without a filesort), skips bills already at the step's level
+and updates at most a batch of bills per transaction, guarded by the status
+and level it read, so bills paid in the meantime are left alone. The batch size adapts so
+a batch takes about ``DUNNING_BATCH_TARGET_MS``, and the sweeper sleeps
+between batches so it keeps the database busy no more than
+``DUNNING_TARGET_LOAD`` of the time.
+
+Every run is a ``dunning_run`` row whose step and keyset position are saved
+in each batch's transaction. A run that died (worker restart, lost
+connection) is resumed where it stopped by the next sweep, and since every
+transition is conditional on the bill's current state, re-running a sweep
+changes nothing already done. Sweeps run every ``DUNNING_INTERVAL_S`` in
+one worker per host at a time (a MySQL named lock per hospital), or with
+``flask sweep-overdue``. Run ``flask init-dunning`` once on an existing
+database.
+"""
+import os
+import time
+from datetime import date, timedelta
+
+import click
+import pymysql
+from flask import jsonify
+
+from sweeps import BatchPacer, TenantScheduler
+from tenancy import current_tenant_id
+
+DUNNING_ENABLED = os.getenv('DUNNING_ENABLED', '1') == '1'
+DUNNING_INTERVAL_S = float(os.getenv('DUNNING_INTERVAL_S', '900'))
+DUNNING_STAGES = [int(days) for days in os.getenv('DUNNING_STAGES', '0,30,60,90').split(',')]
+DUNNING_BATCH_SIZE = int(os.getenv('DUNNING_BATCH_SIZE', '500'))
+DUNNING_MIN_BATCH = 50
+DUNNING_MAX_BATCH = int(os.getenv('DUNNING_MAX_BATCH', '5000'))
+DUNNING_BATCH_TARGET_MS = float(os.getenv('DUNNING_BATCH_TARGET_MS', '100'))
+# Fraction of wall time the sweeper may spend in the database (see sweeps.BatchPacer).
+DUNNING_TARGET_LOAD = float(os.getenv('DUNNING_TARGET_LOAD', '0.25'))
+
+LEVEL_NAMES = ['None', 'Reminder', 'Second notice', 'Final notice', 'Collections']
+
+DUNNING_COLUMNS_DDL = """
+ALTER TABLE billing
+    ADD COLUMN dunning_level TINYINT NOT NULL DEFAULT 0,
+    ADD COLUMN dunning_at DATETIME NULL,
+    ADD INDEX idx_billing_dunning (status, due_date)
+"""
+# Databases set up with dunning_level in the index: it sat between due_date and
+# the primary key, so every batch had to filesort all remaining candidates.
+DUNNING_INDEX_DDL = """
+ALTER TABLE billing
+    DROP INDEX idx_billing_dunning,
+    ADD INDEX idx_billing_dunning (status, due_date)
+"""
+DUNNING_RUN_DDL = """
+CREATE TABLE IF NOT EXISTS dunning_run (
+    run_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    status ENUM('Running', 'Done') NOT NULL DEFAULT 'Running',
+    as_of DATE NOT NULL,
+    step TINYINT NOT NULL DEFAULT 0,
+    last_due_date DATE,
+    last_bill_id INT NOT NULL DEFAULT 0,
+    overdue INT NOT NULL DEFAULT 0,
+    escalated INT NOT NULL DEFAULT 0,
+    batches INT NOT NULL DEFAULT 0,
+    db_seconds DOUBLE NOT NULL DEFAULT 0,
+    error VARCHAR(500),
+    started_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at DATETIME,
+    INDEX idx_dunning_run_status (status, run_id)
+)
+"""
+
+
+def level_name(level):
+    return LEVEL_NAMES[level] if level < len(LEVEL_NAMES) else f"Level {level}"
+
+
+class Step:
+    """One transition: bills in ``status`` below ``level`` and ``days`` past due go to ``Overdue``/``level``."""
+
+    __slots__ = ('status', 'level', 'days')
+
+    def __init__(self, status, level, days):
+        self.status = status
+        self.level = level
+        self.days = days
+
+
+def build_steps(stages=DUNNING_STAGES):
+    """Unpaid/Partial to Overdue first, then escalations from the highest level down.
+
+    Escalating highest first moves a long-forgotten bill straight to its
+    level; the last step gives bills marked Overdue by hand their reminder.
+    """
+    steps = [Step('Unpaid', 1, stages[0]), Step('Partial', 1, stages[0])]
+    for level in range(len(stages), 0, -1):
+        steps.append(Step('Overdue', level, stages[level - 1]))
+    return steps
+
+
+# Reads idx_billing_dunning in order; dunning_level is filtered on the rows it finds.
+_SELECT_BATCH = """
+    SELECT bill_id, due_date FROM billing
+    WHERE status = %s AND due_date < %s
+      AND (due_date > %s OR (due_date = %s AND bill_id > %s))
+      AND dunning_level < %s
+    ORDER BY due_date, bill_id
+    LIMIT %s
+"""
+
+
+class DunningSweeper:
+    """Runs sweeps for every hospital, on a schedule or on demand."""
+
+    def __init__(self, tenants, connect_primary, on_change=None, steps=None, interval=DUNNING_INTERVAL_S,
+                 target_load=DUNNING_TARGET_LOAD):
+        self.tenants = tenants
+        self.connect = connect_primary
+        self.on_change = on_change
+        self.steps = steps or build_steps()
+        self.target_load = target_load
+        self.stats = {"runs": 0, "resumed": 0, "failed": 0, "skipped_locked": 0,
+                      "overdue": 0, "escalated": 0, "batches": 0}
+        self.scheduler = TenantScheduler(tenants, self.sweep, interval, self.stats, 'dunning-sweeper',
+                                         enabled=DUNNING_ENABLED)
+
+    def ensure_scheduler(self):
+        self.scheduler.ensure_started()
+
+    def sweep(self, today=None, progress=None):
+        """Sweeps the current hospital; returns the run's summary, or ``None`` if another sweep holds the lock."""
+        lock_name = f"dunning:{current_tenant_id()}"
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0) as locked", (lock_name,))
+                if not cursor.fetchone()['locked']:
+                    self.stats["skipped_locked"] += 1
+                    return None
+                try:
+                    run = self._start_run(conn, cursor, today or date.today())
+                    try:
+                        self._sweep(conn, cursor, run, progress)
+                    except Exception as e:
+                        # Left Running, so the next sweep resumes from the last checkpoint.
+                        conn.rollback()
+                        cursor.execute("UPDATE dunning_run SET error = %s WHERE run_id = %s",
+                                       (str(e)[:500], run['run_id']))
+                        conn.commit()
+                        raise
+                    cursor.execute("UPDATE dunning_run SET status = 'Done', finished_at = NOW() WHERE run_id = %s",
+                                   (run['run_id'],))
+                    conn.commit()
+                    self.stats["runs"] += 1
+                    return run
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+        finally:
+            conn.close()
+
+    def _start_run(self, conn, cursor, today):
+        cursor.execute("""SELECT run_id, as_of, step, last_due_date, last_bill_id, overdue, escalated, batches,
+                                 db_seconds
+                          FROM dunning_run WHERE status = 'Running' ORDER BY run_id DESC LIMIT 1""")
+        run = cursor.fetchone()
+        if run is not None:
+            self.stats["resumed"] += 1
+            return run
+        cursor.execute("INSERT INTO dunning_run (as_of) VALUES (%s)", (today,))
+        conn.commit()
+        return {"run_id": cursor.lastrowid, "as_of": today, "step": 0, "last_due_date": None, "last_bill_id": 0,
+                "overdue": 0, "escalated": 0, "batches": 0, "db_seconds": 0.0}
+
+    def _sweep(self, conn, cursor, run, progress):
+        pacer = BatchPacer(DUNNING_BATCH_SIZE, DUNNING_MIN_BATCH, DUNNING_MAX_BATCH, DUNNING_BATCH_TARGET_MS,
+                           self.target_load)
+        while run['step'] < len(self.steps):
+            batch_size = pacer.size
+            step = self.steps[run['step']]
+            cutoff = run['as_of'] - timedelta(days=step.days)
+            last_due = run['last_due_date'] or date.min
+            started = time.monotonic()
+            cursor.execute(_SELECT_BATCH, (step.status, cutoff, last_due, last_due, run['last_bill_id'],
+                                           step.level, batch_size))
+            rows = cursor.fetchall()
+            changed = 0
+            if rows:
+                ids = [row['bill_id'] for row in rows]
+                changed = cursor.execute(f"""
+                    UPDATE billing SET status = 'Overdue', dunning_level = %s, dunning_at = NOW()
+                    WHERE bill_id IN ({', '.join(['%s'] * len(ids))}) AND status = %s AND dunning_level < %s
+                """, (step.level, *ids, step.status, step.level))
+                run['last_due_date'] = rows[-1]['due_date']
+                run['last_bill_id'] = ids[-1]
+                run['overdue' if step.status != 'Overdue' else 'escalated'] += changed
+            if len(rows) < batch_size:
+                # Step done: the next one starts from the beginning of the index range.
+                run['step'] += 1
+                run['last_due_date'] = None
+                run['last_bill_id'] = 0
+            run['batches'] += 1
+            elapsed = time.monotonic() - started
+            run['db_seconds'] += elapsed
+            cursor.execute("""
+                UPDATE dunning_run SET step = %s, last_due_date = %s, last_bill_id = %s, overdue = %s,
+                       escalated = %s, batches = %s, db_seconds = %s
+                WHERE run_id = %s
+            """, (run['step'], run['last_due_date'], run['last_bill_id'], run['overdue'], run['escalated'],
+                  run['batches'], run['db_seconds'], run['run_id']))
+            conn.commit()
+            self.stats["batches"] += 1
+            self.stats['overdue' if step.status != 'Overdue' else 'escalated'] += changed
+            if changed and self.on_change is not None:
+                self.on_change()
+            if progress is not None:
+                progress(step, len(rows), changed)
+
+            pacer.pace(time.monotonic() - started, adapt=bool(rows))
+
+    def recent_runs(self, get_db_connection, limit=10):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""SELECT run_id, status, as_of, step, overdue, escalated, batches, db_seconds, error,
+                                         started_at, finished_at
+                                  FROM dunning_run ORDER BY run_id DESC LIMIT %s""", (limit,))
+                runs = cursor.fetchall()
+        finally:
+            conn.close()
+        for run in runs:
+            for column in ('as_of', 'started_at', 'finished_at'):
+                run[column] = str(run[column]) if run[column] is not None else None
+        return runs
+
+
+def init_dunning(app, get_db_connection, tenants, connect_primary, on_change=None):
+    """Schedules the sweeper and adds its metrics route and CLI commands."""
+    sweeper = DunningSweeper(tenants, connect_primary, on_change=on_change)
+
+    @app.before_request
+    def start_dunning_scheduler():
+        sweeper.ensure_scheduler()
+
+    @app.route('/api/metrics/dunning', methods=['GET'])
+    def dunning_metrics():
+        try:
+            runs = sweeper.recent_runs(get_db_connection)
+        except pymysql.Error as e:
+            runs = {"error": str(e)}
+        return jsonify({"worker": sweeper.stats, "stages": DUNNING_STAGES, "levels": LEVEL_NAMES,
+                        "runs": runs}), 200
+
+    @app.cli.command('init-dunning')
+    def init_dunning_tables():
+        """Add dunning columns and index to billing and create dunning_run."""
+        conn = connect_primary()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(DUNNING_RUN_DDL)
+                cursor.execute("""SELECT COUNT(*) as n FROM information_schema.columns
+                                  WHERE table_schema = DATABASE() AND table_name = 'billing'
+                                  AND column_name = 'dunning_level'""")
+                if not cursor.fetchone()['n']:
+                    cursor.execute(DUNNING_COLUMNS_DDL)
+                cursor.execute("""SELECT COUNT(*) as n FROM information_schema.statistics
+                                  WHERE table_schema = DATABASE() AND table_name = 'billing'
+                                  AND index_name = 'idx_billing_dunning' AND column_name = 'dunning_level'""")
+                if cursor.fetchone()['n']:
+                    cursor.execute(DUNNING_INDEX_DDL)
+            conn.commit()
+        finally:
+            conn.close()
+        click.echo("Dunning tables ready.")
+
+    @app.cli.command('sweep-overdue')
+    @click.option('--as-of', type=click.DateTime(['%Y-%m-%d']), help='Sweep as if today were this date.')
+    def sweep_overdue(as_of):
+        """Mark overdue bills and escalate their dunning level."""
+        started = time.monotonic()
+
+        def progress(step, rows, changed):
+            if rows:
+                click.echo(f"{step.status} -> level {step.level} ({level_name(step.level)}): {changed}/{rows}")
+
+        run = sweeper.sweep(as_of.date() if as_of else None, progress)
+        if run is None:
+            click.echo("Another sweep is running.")
+            return
+        click.echo(f"Run {run['run_id']}: {run['overdue']} bills overdue, {run['escalated']} escalated "
+                   f"in {run['batches']} batches, {time.monotonic() - started:.1f}s "
+                   f"({run['db_seconds']:.1f}s in the database).")
+
+    return sweeper
@@ -0,0 +1,413 @@
+"""Inventory movement ledger: consume/restock with atomic, batched stock updates.
+
+Stock changes are recorded as rows of ``inventory_movement`` and applied to
+``inventory.quantity`` as relative updates (``quantity = quantity - n`` guarded
+by ``quantity >= n``), so concurrent dispensing from several wards can never
+lose an update or drive stock negative. Movements submitted within
+``INVENTORY_BATCH_WINDOW_MS`` of each other are applied by one flusher thread
+per worker in a single transaction on the primary: one UPDATE per item for
+the net change (items in id order, so batches cannot deadlock) and one
+ledger INSERT per movement, each returning its own id. A hot item is
+therefore locked once per batch instead of once per request. A movement
+still queued after ``INVENTORY_WAIT_TIMEOUT_S`` is answered 202: it will
+still be applied, so it must not be retried.
+
+Low stock is tracked by the stored generated column ``inventory.low_stock``
+(``quantity <= threshold``) and its index, which MySQL keeps current on every
+write; expiring items use the existing ``expiry_date`` index. Run
+``flask init-inventory-ledger`` once on an existing database.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+import pymysql
+from flask import g, jsonify, request
+
+from tenancy import current_tenant_id, use_tenant
+
+INVENTORY_BATCH_WINDOW_MS = float(os.getenv('INVENTORY_BATCH_WINDOW_MS', '5'))
+INVENTORY_BATCH_SIZE = int(os.getenv('INVENTORY_BATCH_SIZE', '500'))
+INVENTORY_WAIT_TIMEOUT_S = float(os.getenv('INVENTORY_WAIT_TIMEOUT_S', '10'))
+
+MOVEMENT_TYPES = ('consume', 'restock')
+
+LEDGER_DDL = """
+CREATE TABLE IF NOT EXISTS inventory_movement (
+    movement_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    item_id INT NOT NULL,
+    movement_type ENUM('consume', 'restock') NOT NULL,
+    quantity INT NOT NULL COMMENT 'Signed change: negative for consumption',
+    reason VARCHAR(255),
+    reference VARCHAR(100) COMMENT 'Prescription, ward order, delivery note...',
+    user_id INT,
+    created_at DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+    FOREIGN KEY (item_id) REFERENCES inventory(item_id) ON DELETE CASCADE,
+    INDEX idx_movement_item (item_id, movement_id),
+    INDEX idx_movement_type_date (movement_type, created_at)
+)
+"""
+LOW_STOCK_COLUMN_DDL = "ALTER TABLE inventory ADD COLUMN low_stock BOOLEAN AS (quantity <= threshold) STORED"
+LOW_STOCK_INDEX_DDL = "ALTER TABLE inventory ADD INDEX idx_inventory_low_stock (low_stock, quantity)"
+
+
+class InventoryError(Exception):
+    """A movement that cannot be applied; ``status`` is the HTTP code."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class _Movement:
+    __slots__ = ('item_id', 'delta', 'movement_type', 'reason', 'reference', 'user_id', 'tenant_id',
+                 'event', 'movement_id', 'balance', 'error')
+
+    def __init__(self, item_id, movement_type, quantity, reason, reference, user_id):
+        self.item_id = item_id
+        self.movement_type = movement_type
+        self.delta = quantity if movement_type == 'restock' else -quantity
+        self.reason = reason
+        self.reference = reference
+        self.user_id = user_id
+        self.tenant_id = current_tenant_id()
+        self.event = threading.Event()
+        self.movement_id = None
+        self.balance = None
+        self.error = None
+
+
+def parse_movement(item_id, data):
+    """Validates one movement body; raises ``InventoryError`` (400)."""
+    if not isinstance(data, dict):
+        raise InventoryError("Each movement must be an object", 400)
+    movement_type = data.get('type')
+    if movement_type not in MOVEMENT_TYPES:
+        raise InventoryError(f"type must be one of: {', '.join(MOVEMENT_TYPES)}", 400)
+    quantity = data.get('quantity')
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+        raise InventoryError("quantity must be a positive integer", 400)
+    if item_id is None:
+        item_id = data.get('item_id')
+        if not isinstance(item_id, int):
+            raise InventoryError("item_id is required", 400)
+    principal = getattr(g, 'principal', None)
+    return _Movement(item_id, movement_type, quantity, data.get('reason'), data.get('reference'),
+                     principal.user_id if principal else None)
+
+
+class MovementBatcher:
+    """Queues movements and applies them in per-worker group commits."""
+
+    def __init__(self, connect_primary, on_applied=None, window_ms=INVENTORY_BATCH_WINDOW_MS,
+                 batch_size=INVENTORY_BATCH_SIZE):
+        self.connect_primary = connect_primary
+        self.on_applied = on_applied
+        self.window = window_ms / 1000.0
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._pending = []
+        self._flusher_pid = None
+        self.stats = {"movements": 0, "batches": 0, "item_updates": 0, "rejected": 0}
+
+    def _ensure_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        self._pending = []
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run, name='inventory-flusher', daemon=True).start()
+
+    def submit(self, movements, timeout=INVENTORY_WAIT_TIMEOUT_S):
+        """Queues ``movements`` and waits up to ``timeout`` for their batch to commit."""
+        with self._cond:
+            self._ensure_flusher()
+            self._pending.extend(movements)
+            self._cond.notify()
+        deadline = time.monotonic() + timeout
+        for movement in movements:
+            movement.event.wait(max(0.0, deadline - time.monotonic()))
+        return movements
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Give movements arriving at the same moment a chance to join.
+            time.sleep(self.window)
+            with self._cond:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+            by_tenant = {}
+            for movement in batch:
+                by_tenant.setdefault(movement.tenant_id, []).append(movement)
+            for tenant_id, movements in by_tenant.items():
+                try:
+                    with use_tenant(tenant_id):
+                        self._apply(movements)
+                except Exception as e:
+                    for movement in movements:
+                        movement.error = movement.error or e
+                finally:
+                    for movement in movements:
+                        movement.event.set()
+
+    def _apply(self, batch):
+        by_item = {}
+        for movement in batch:
+            by_item.setdefault(movement.item_id, []).append(movement)
+
+        conn = self.connect_primary()
+        cursor = conn.cursor()
+        try:
+            applied = []
+            for item_id in sorted(by_item):
+                applied.extend(self._apply_item(cursor, item_id, by_item[item_id]))
+            # One row per statement: a multi-row INSERT only gets consecutive ids
+            # under consecutive auto-increment locking, which is not guaranteed.
+            for m in applied:
+                cursor.execute("""
+                    INSERT INTO inventory_movement (item_id, movement_type, quantity, reason, reference, user_id)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (m.item_id, m.movement_type, m.delta, m.reason, m.reference, m.user_id))
+                m.movement_id = cursor.lastrowid
+            conn.commit()
+        except pymysql.Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+        self.stats["movements"] += len(applied)
+        self.stats["batches"] += 1
+        self.stats["item_updates"] += len(by_item)
+        self.stats["rejected"] += len(batch) - len(applied)
+        if applied and self.on_applied:
+            self.on_applied()
+
+    def _update(self, cursor, item_id, delta, restocked):
+        # LAST_INSERT_ID(expr) hands the new quantity back without a SELECT.
+        cursor.execute("""
+            UPDATE inventory
+            SET quantity = LAST_INSERT_ID(quantity + %s),
+                last_restocked = IF(%s, CURDATE(), last_restocked)
+            WHERE item_id = %s AND quantity + %s >= 0
+        """, (delta, restocked, item_id, delta))
+        if cursor.rowcount:
+            return cursor.lastrowid
+        if delta == 0:
+            # Without CLIENT.FOUND_ROWS an unchanged row counts as not affected,
+            # so a net-zero batch reads the balance instead.
+            cursor.execute("SELECT quantity FROM inventory WHERE item_id = %s AND quantity >= 0", (item_id,))
+            row = cursor.fetchone()
+            return row['quantity'] if row else None
+        return None
+
+    def _apply_item(self, cursor, item_id, movements):
+        """Applies ``movements`` of one item; returns those that succeeded."""
+        restocked = any(m.delta > 0 for m in movements)
+        balance = self._update(cursor, item_id, sum(m.delta for m in movements), restocked)
+        if balance is not None:
+            for movement in movements:
+                movement.balance = balance
+            return movements
+
+        # The net change does not fit (or the item is gone): apply one by one
+        # in arrival order so only the movements that overdraw are rejected.
+        cursor.execute("SELECT 1 FROM inventory WHERE item_id = %s", (item_id,))
+        if cursor.fetchone() is None:
+            for movement in movements:
+                movement.error = InventoryError("Inventory item not found", 404)
+            return []
+        applied = []
+        final_balance = None
+        for movement in movements:
+            balance = self._update(cursor, item_id, movement.delta, movement.delta > 0)
+            if balance is None:
+                movement.error = InventoryError("Insufficient stock", 409)
+            else:
+                applied.append(movement)
+                final_balance = balance
+        for movement in applied:
+            movement.balance = final_balance
+        return applied
+
+
+def forecast_depletion(rows, stock, days, now=None, half_life_days=7.0):
+    """Projects when each item runs out from its daily consumption.
+
+    ``rows`` are ``(item_id, day, consumed)`` for the last ``days`` days and
+    ``stock`` maps item ids to current quantities. Usage is averaged both
+    flat and exponentially weighted (recent days count more); the forecast
+    uses the higher of the two.
+    """
+    today = (now or datetime.now()).date()
+    if not rows:
+        return []
+    item_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    ages = np.fromiter(((today - r[1]).days for r in rows), dtype=np.int64, count=len(rows))
+    consumed = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+    keep = (ages >= 0) & (ages < days)
+    items, index = np.unique(item_ids[keep], return_inverse=True)
+
+    usage = np.zeros((len(items), days))
+    np.add.at(usage, (index, days - 1 - ages[keep]), consumed[keep])
+    weights = 0.5 ** (np.arange(days)[::-1] / half_life_days)
+    weighted_rate = usage @ (weights / weights.sum())
+    flat_rate = usage.mean(axis=1)
+    rate = np.maximum(weighted_rate, flat_rate)
+
+    quantity = np.array([stock.get(int(i), 0) for i in items], dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        days_left = np.where(rate > 0, quantity / rate, np.inf)
+    order = np.argsort(days_left, kind='stable')
+    return [{
+        "item_id": int(items[i]),
+        "quantity": int(quantity[i]),
+        "avg_daily_use": round(float(flat_rate[i]), 3),
+        "recent_daily_use": round(float(weighted_rate[i]), 3),
+        "days_until_empty": round(float(days_left[i]), 1) if np.isfinite(days_left[i]) else None,
+        "stockout_date": ((today + timedelta(days=int(days_left[i]))).strftime('%Y-%m-%d')
+                          if np.isfinite(days_left[i]) else None),
+    } for i in order]
+
+
+def _movement_result(movement):
+    if not movement.event.is_set():
+        # Still queued behind a slow batch and will be applied: reporting an
+        # error here would make the client retry and move the stock twice.
+        return {"item_id": movement.item_id, "status": "queued"}, 202
+    if movement.error is not None:
+        status = movement.error.status if isinstance(movement.error, InventoryError) else 500
+        return {"item_id": movement.item_id, "error": str(movement.error)}, status
+    return {"id": movement.movement_id, "item_id": movement.item_id, "quantity": movement.balance}, 201
+
+
+def init_inventory(app, get_db_connection, connect_primary, on_change=None):
+    """Installs the movement, expiry and forecast endpoints and the ledger CLI.
+
+    Stock writes and the ledger DDL go through ``connect_primary``.
+    """
+    batcher = MovementBatcher(connect_primary, on_applied=on_change)
+
+    @app.route('/api/inventory/<int:item_id>/movements', methods=['GET', 'POST'])
+    def inventory_movements(item_id):
+        if request.method == 'POST':
+            try:
+                movement = parse_movement(item_id, request.json)
+            except InventoryError as e:
+                return jsonify({"error": str(e)}), e.status
+            body, status = _movement_result(batcher.submit([movement])[0])
+            if status == 201:
+                body["message"] = "Inventory movement recorded"
+            elif status == 202:
+                body["message"] = "Inventory movement accepted; it appears in the ledger once applied"
+            return jsonify(body), status
+
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT movement_id as id, movement_type as type, quantity, reason, reference, user_id, created_at
+                FROM inventory_movement
+                WHERE item_id = %s
+                ORDER BY movement_id DESC
+                LIMIT %s
+            """, (item_id, limit))
+            movements = cursor.fetchall()
+            for m in movements:
+                m['created_at'] = str(m['created_at'])
+            return jsonify(movements), 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cursor.close()
+            conn.close()
+
+    @app.route('/api/inventory/movements', methods=['POST'])
+    def inventory_movements_batch():
+        data = request.json
+        entries = data.get('movements') if isinstance(data, dict) else None
+        if not isinstance(entries, list) or not entries:
+            return jsonify({"error": "movements must be a non-empty list"}), 400
+        try:
+            movements = [parse_movement(None, entry) for entry in entries]
+        except InventoryError as e:
+            return jsonify({"error": str(e)}), e.status
+        results = [_movement_result(m) for m in batcher.submit(movements)]
+        status = 201 if all(code == 201 for _, code in results) else 207
+        return jsonify({"results": [body for body, _ in results]}), status
+
+    @app.route('/api/reports/expiring', methods=['GET'])
+    def get_expiring_stock():
+        days = request.args.get('days', 30, type=int)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT item_id as id, name, quantity, unit, expiry_date as expiryDate, supplier
+                FROM inventory
+                WHERE expiry_date IS NOT NULL AND expiry_date <= CURDATE() + INTERVAL %s DAY
+                ORDER BY expiry_date
+            """, (days,))
+            return jsonify(cursor.fetchall()), 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cursor.close()
+            conn.close()
+
+    @app.route('/api/inventory/forecast', methods=['GET'])
+    def inventory_forecast():
+        days = max(1, min(request.args.get('days', 30, type=int), 365))
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT item_id, DATE(created_at) as day, -SUM(quantity) as consumed
+                FROM inventory_movement
+                WHERE movement_type = 'consume' AND created_at >= CURDATE() - INTERVAL %s DAY
+                GROUP BY item_id, DATE(created_at)
+            """, (days - 1,))
+            usage = [(r['item_id'], r['day'], r['consumed']) for r in cursor.fetchall()]
+            cursor.execute("SELECT item_id, name, quantity FROM inventory")
+            items = {r['item_id']: r for r in cursor.fetchall()}
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            cursor.close()
+            conn.close()
+        forecast = forecast_depletion(usage, {i: r['quantity'] for i, r in items.items()}, days)
+        for entry in forecast:
+            entry["name"] = items.get(entry["item_id"], {}).get("name")
+        return jsonify(forecast), 200
+
+    @app.route('/api/metrics/inventory', methods=['GET'])
+    def inventory_metrics():
+        return jsonify(batcher.stats), 200
+
+    @app.cli.command('init-inventory-ledger')
+    def init_inventory_ledger():
+        """Create the movement ledger and the indexed low-stock column."""
+        conn = connect_primary()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(LEDGER_DDL)
+                cursor.execute("""
+                    SELECT COUNT(*) as n FROM information_schema.columns
+                    WHERE table_schema = DATABASE() AND table_name = 'inventory' AND column_name = 'low_stock'
+                """)
+                if not cursor.fetchone()['n']:
+                    cursor.execute(LOW_STOCK_COLUMN_DDL)
+                    cursor.execute(LOW_STOCK_INDEX_DDL)
+            conn.commit()
+        finally:
+            conn.close()
+        click.echo("Inventory ledger ready.")
+
+    return batcher
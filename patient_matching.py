@@ -0,0 +1,417 @@
+"""Duplicate-patient detection with a blocking index.
+
+Every patient gets a handful of match keys, stored in ``patient_match_key``
+in the same transaction as the patient row:
+
+- ``p:<phone>``: the last 10 digits of the phone number;
+- ``e:<email>``: the lowercased address, without ``+tags`` (and dots, for Gmail);
+- ``s:<codes>``: the sorted Soundex codes of the name's words, so spelling
+  variants and swapped first/last names share a key;
+- ``m<band>:<hash>``: MinHash bands over the name's character trigrams
+  (locality-sensitive hashing), so names that share most trigrams share a
+  band with high probability.
+
+Only patients sharing at least one key (a "block") are ever compared, and
+they are scored on trigram similarity of the name, phone, email, sound,
+age and gender. Registering a patient returns the best-scoring existing
+patients as ``possible_duplicates``; ``GET /api/patients/matches`` answers
+the same question before registering. ``flask find-duplicate-patients``
+walks the whole index block by block and reports duplicate clusters in
+roughly linear time; blocks larger than ``MATCH_MAX_BLOCK`` (a phone number
+shared by a whole ward) are skipped as uninformative.
+
+Run ``flask rebuild-match-index`` once on an existing database, and again
+after bulk loads that bypass the API.
+"""
+import hashlib
+import json
+import os
+import re
+import struct
+import time
+import unicodedata
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+import click
+import pymysql
+from flask import jsonify, request
+
+MATCH_MIN_SCORE = float(os.getenv('MATCH_MIN_SCORE', '0.6'))
+MATCH_MAX_CANDIDATES = int(os.getenv('MATCH_MAX_CANDIDATES', '5'))
+# Patients sharing the most keys that are scored per lookup.
+MATCH_MAX_SCANNED = int(os.getenv('MATCH_MAX_SCANNED', '200'))
+MATCH_MAX_BLOCK = int(os.getenv('MATCH_MAX_BLOCK', '200'))
+MATCH_BATCH_SIZE = int(os.getenv('MATCH_BATCH_SIZE', '5000'))
+
+MINHASH_BANDS = 4
+MINHASH_ROWS = 2
+_PRIME = (1 << 61) - 1
+_SEEDS = [(int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), 'little') % _PRIME or 1,
+           int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), 'little') % _PRIME)
+          for i in range(MINHASH_BANDS * MINHASH_ROWS)]
+
+_TITLES = {'mr', 'mrs', 'ms', 'miss', 'dr', 'shri', 'sri', 'smt', 'kumari', 'prof', 'jr', 'sr'}
+_NON_ALPHA = re.compile(r'[^a-z ]+')
+_SOUNDEX = str.maketrans('bfpvcgjkqsxzdtlmnr', '111122222222334556')
+
+MATCH_KEY_DDL = """
+CREATE TABLE IF NOT EXISTS patient_match_key (
+    match_key VARCHAR(128) NOT NULL,
+    patient_id INT NOT NULL,
+    PRIMARY KEY (match_key, patient_id),
+    INDEX idx_match_key_patient (patient_id),
+    CONSTRAINT fk_match_key_patient FOREIGN KEY (patient_id)
+        REFERENCES patient(patient_id) ON DELETE CASCADE
+)
+"""
+
+# MySQL's "table doesn't exist": the index has not been created yet.
+_NO_SUCH_TABLE = 1146
+
+_MATCH_FIELDS = "patient_id, name, age, gender, phone, email"
+
+
+# --- Normalization and keys ---
+def normalize_phone(phone):
+    digits = ''.join(ch for ch in str(phone or '') if ch.isdigit())
+    if len(digits) < 7:
+        return None
+    return digits[-10:]
+
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    local, _, domain = email.partition('@')
+    if not local or not domain:
+        return None
+    local = local.split('+', 1)[0]
+    if domain in ('gmail.com', 'googlemail.com'):
+        local = local.replace('.', '')
+        domain = 'gmail.com'
+    return f"{local}@{domain}"
+
+
+def name_tokens(name):
+    """Lowercase ASCII words of ``name`` without titles (Mr, Dr, Smt, ...)."""
+    text = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode('ascii').lower()
+    return [token for token in _NON_ALPHA.sub(' ', text.replace('.', ' ')).split() if token not in _TITLES]
+
+
+def soundex(token, length=6):
+    """Soundex code of ``token``, kept to ``length`` characters (6, not 4, for narrower blocks)."""
+    codes = token.translate(_SOUNDEX)
+    result = token[0]
+    previous = codes[0]
+    for letter, code in zip(token[1:], codes[1:]):
+        if code.isdigit() and code != previous:
+            result += code
+        if letter not in 'hw':
+            previous = code
+    return (result + '0' * length)[:length]
+
+
+def trigrams(tokens):
+    """Character trigrams of the sorted words, padded so short names still have some."""
+    text = f"  {' '.join(sorted(tokens))} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _hash64(gram):
+    return struct.unpack('<Q', hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest())[0]
+
+
+def minhash_keys(grams):
+    hashes = [_hash64(gram) for gram in grams]
+    signature = [min((a * h + b) % _PRIME for h in hashes) for a, b in _SEEDS]
+    keys = []
+    for band in range(MINHASH_BANDS):
+        rows = signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+        digest = hashlib.blake2b(repr(rows).encode('ascii'), digest_size=6).hexdigest()
+        keys.append(f"m{band}:{digest}")
+    return keys
+
+
+def parse_age(value):
+    """Age as an int the way MySQL would store it; ``None`` when missing or not a number."""
+    try:
+        return int(Decimal(str(value).strip()).to_integral_value(ROUND_HALF_UP))
+    except (InvalidOperation, ValueError, OverflowError):
+        return None
+
+
+class Features:
+    """What matching needs to know about one patient."""
+
+    __slots__ = ('patient_id', 'tokens', 'grams', 'sound', 'phone', 'email', 'age', 'gender')
+
+    def __init__(self, row):
+        self.patient_id = row.get('patient_id')
+        self.tokens = name_tokens(row.get('name'))
+        self.grams = trigrams(self.tokens) if self.tokens else set()
+        self.sound = '-'.join(sorted(soundex(token) for token in self.tokens)) or None
+        self.phone = normalize_phone(row.get('phone'))
+        self.email = normalize_email(row.get('email'))
+        self.age = parse_age(row.get('age'))
+        self.gender = row.get('gender') or None
+
+    def keys(self):
+        keys = []
+        if self.phone:
+            keys.append(f"p:{self.phone}")
+        if self.email:
+            keys.append(f"e:{self.email}"[:128])
+        if self.sound:
+            keys.append(f"s:{self.sound}"[:128])
+        if self.grams:
+            keys.extend(minhash_keys(self.grams))
+        return keys
+
+
+def score(a, b):
+    """``(score, reasons)`` of ``a`` and ``b`` being the same person, score in [0, 1]."""
+    reasons = []
+    total = 0.0
+    if a.grams and b.grams:
+        similarity = len(a.grams & b.grams) / len(a.grams | b.grams)
+        total += 0.5 * similarity
+        if similarity >= 0.5:
+            reasons.append('name')
+    if a.sound and a.sound == b.sound:
+        total += 0.1
+        reasons.append('sounds_alike')
+    if a.phone and a.phone == b.phone:
+        total += 0.3
+        reasons.append('phone')
+    if a.email and a.email == b.email:
+        total += 0.3
+        reasons.append('email')
+    if a.age is not None and b.age is not None and abs(a.age - b.age) <= 1:
+        total += 0.1
+        reasons.append('age')
+    if a.gender and b.gender and a.gender != b.gender:
+        total -= 0.2
+    return round(max(0.0, min(1.0, total)), 3), reasons
+
+
+# --- Index maintenance and lookups ---
+def _missing_index(error):
+    return error.args and error.args[0] == _NO_SUCH_TABLE
+
+
+def index_patient(cursor, patient_id, features):
+    cursor.execute("DELETE FROM patient_match_key WHERE patient_id = %s", (patient_id,))
+    keys = features.keys()
+    if keys:
+        cursor.executemany("INSERT IGNORE INTO patient_match_key (match_key, patient_id) VALUES (%s, %s)",
+                           [(key, patient_id) for key in keys])
+
+
+def find_matches(cursor, features, exclude=None, limit=MATCH_MAX_CANDIDATES, min_score=MATCH_MIN_SCORE):
+    """Existing patients most likely to be ``features``, best first."""
+    keys = features.keys()
+    if not keys:
+        return []
+    cursor.execute(f"""
+        SELECT patient_id, COUNT(*) as shared FROM patient_match_key
+        WHERE match_key IN ({', '.join(['%s'] * len(keys))}) AND patient_id <> %s
+        GROUP BY patient_id ORDER BY shared DESC, patient_id LIMIT %s
+    """, (*keys, exclude or 0, MATCH_MAX_SCANNED))
+    ids = [row['patient_id'] for row in cursor.fetchall()]
+    if not ids:
+        return []
+    cursor.execute(f"SELECT {_MATCH_FIELDS} FROM patient WHERE patient_id IN ({', '.join(['%s'] * len(ids))})",
+                   ids)
+    matches = []
+    for row in cursor.fetchall():
+        value, reasons = score(features, Features(row))
+        if value >= min_score:
+            matches.append({"id": row['patient_id'], "name": row['name'], "age": row['age'],
+                            "gender": row['gender'], "phone": row['phone'], "email": row['email'],
+                            "score": value, "reasons": reasons})
+    matches.sort(key=lambda match: (-match['score'], match['id']))
+    return matches[:limit]
+
+
+def on_patient_write(cursor, action, patient_id, values):
+    """``Resource.on_write`` hook of the patients resource.
+
+    Keeps the patient's match keys in step with the row and, on create,
+    returns the likely duplicates already registered.
+    """
+    try:
+        if action == 'update':
+            if not {'name', 'phone', 'email'} & set(values):
+                return None
+            cursor.execute(f"SELECT {_MATCH_FIELDS} FROM patient WHERE patient_id = %s", (patient_id,))
+            row = cursor.fetchone()
+            if row is not None:
+                index_patient(cursor, patient_id, Features(row))
+            return None
+        features = Features(values)
+        matches = find_matches(cursor, features, exclude=patient_id)
+        index_patient(cursor, patient_id, features)
+        return {"possible_duplicates": matches}
+    except pymysql.err.ProgrammingError as e:
+        if _missing_index(e):
+            return None  # Not created yet: flask rebuild-match-index
+        raise
+
+
+# --- Batch clustering ---
+class _DisjointSet:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        parent = self.parent.setdefault(item, item)
+        while parent != item:
+            grandparent = self.parent[parent]
+            self.parent[item] = grandparent
+            item, parent = parent, grandparent
+        return item
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def candidate_pairs(stream_cursor, max_block=MATCH_MAX_BLOCK):
+    """Distinct ``(a, b)`` patient pairs sharing a key; ``stream_cursor`` is unbuffered.
+
+    Keys arrive in index order, so one block is in memory at a time.
+    """
+    stream_cursor.execute("SELECT match_key, patient_id FROM patient_match_key ORDER BY match_key, patient_id")
+    pairs = set()
+    skipped = 0
+    current, block = None, []
+
+    def close_block():
+        nonlocal skipped
+        if len(block) > max_block:
+            skipped += 1
+            return
+        for i, a in enumerate(block):
+            for b in block[i + 1:]:
+                pairs.add((a, b))
+
+    for key, patient_id in stream_cursor:
+        if key != current:
+            close_block()
+            current, block = key, []
+        block.append(patient_id)
+    close_block()
+    return pairs, skipped
+
+
+def cluster(pairs, features, min_score=MATCH_MIN_SCORE):
+    """Groups patients linked by a pair scoring at least ``min_score``."""
+    links = _DisjointSet()
+    scores = {}
+    for a, b in pairs:
+        if a not in features or b not in features:
+            continue
+        value, _ = score(features[a], features[b])
+        if value >= min_score:
+            links.union(a, b)
+            scores[(a, b)] = value
+    clusters = {}
+    for (a, b), value in scores.items():
+        root = links.find(a)
+        entry = clusters.setdefault(root, {"patients": set(), "best_score": 0.0})
+        entry["patients"].update((a, b))
+        entry["best_score"] = max(entry["best_score"], value)
+    return sorted(({"patients": sorted(entry["patients"]), "best_score": entry["best_score"]}
+                   for entry in clusters.values()), key=lambda c: (-len(c["patients"]), c["patients"][0]))
+
+
+def init_patient_matching(app, get_db_connection):
+    """Adds the duplicate lookup route and the index/cluster CLI commands."""
+
+    @app.route('/api/patients/matches', methods=['GET'])
+    def patient_matches():
+        features = Features({"name": request.args.get('name'), "phone": request.args.get('phone'),
+                             "email": request.args.get('email'), "age": request.args.get('age'),
+                             "gender": request.args.get('gender')})
+        if not features.keys():
+            return jsonify({"error": "Give at least one of name, phone or email"}), 400
+        try:
+            limit = min(int(request.args.get('limit', MATCH_MAX_CANDIDATES)), 50)
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            return jsonify(find_matches(cursor, features, limit=limit)), 200
+        except pymysql.err.ProgrammingError as e:
+            if _missing_index(e):
+                return jsonify({"error": "The match index has not been built (flask rebuild-match-index)"}), 503
+            return jsonify({"error": str(e)}), 500
+        except pymysql.Error as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        finally:
+            cursor.close()
+            conn.close()
+
+    @app.cli.command('rebuild-match-index')
+    @click.option('--batch-size', default=MATCH_BATCH_SIZE, show_default=True)
+    def rebuild_match_index(batch_size):
+        """Create and (re)fill the duplicate-detection index."""
+        conn = get_db_connection()
+        started = time.monotonic()
+        indexed = 0
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(MATCH_KEY_DDL)
+                last_id = 0
+                while True:
+                    cursor.execute(f"""SELECT {_MATCH_FIELDS} FROM patient WHERE patient_id > %s
+                                       ORDER BY patient_id LIMIT %s""", (last_id, batch_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    ids = [row['patient_id'] for row in rows]
+                    cursor.execute(f"DELETE FROM patient_match_key WHERE patient_id IN "
+                                   f"({', '.join(['%s'] * len(ids))})", ids)
+                    cursor.executemany(
+                        "INSERT IGNORE INTO patient_match_key (match_key, patient_id) VALUES (%s, %s)",
+                        [(key, row['patient_id']) for row in rows for key in Features(row).keys()])
+                    conn.commit()
+                    indexed += len(rows)
+                    last_id = ids[-1]
+        finally:
+            conn.close()
+        click.echo(f"Indexed {indexed} patients in {time.monotonic() - started:.1f}s.")
+
+    @app.cli.command('find-duplicate-patients')
+    @click.option('--min-score', default=MATCH_MIN_SCORE, show_default=True)
+    @click.option('--max-block', default=MATCH_MAX_BLOCK, show_default=True)
+    @click.option('--output', type=click.Path(dir_okay=False), help='Write the clusters as JSON lines.')
+    def find_duplicate_patients(min_score, max_block, output):
+        """Report clusters of patients that are probably the same person."""
+        started = time.monotonic()
+        conn = get_db_connection()
+        try:
+            with conn.cursor(pymysql.cursors.SSCursor) as stream:
+                pairs, skipped = candidate_pairs(stream, max_block)
+            wanted = {patient_id for pair in pairs for patient_id in pair}
+            features = {}
+            with conn.cursor(pymysql.cursors.SSDictCursor) as stream:
+                stream.execute(f"SELECT {_MATCH_FIELDS} FROM patient ORDER BY patient_id")
+                for row in stream:
+                    if row['patient_id'] in wanted:
+                        features[row['patient_id']] = Features(row)
+        finally:
+            conn.close()
+        clusters = cluster(pairs, features, min_score)
+
+        if output:
+            with open(output, 'w', encoding='utf-8') as f:
+                for entry in clusters:
+                    f.write(json.dumps(entry) + '\n')
+        else:
+            for entry in clusters:
+                click.echo(f"{entry['best_score']:.2f}  " + ', '.join(map(str, entry['patients'])))
+        click.echo(f"{len(clusters)} duplicate clusters ({sum(len(c['patients']) for c in clusters)} patients) "
+                   f"from {len(pairs)} candidate pairs in {time.monotonic() - started:.1f}s; "
+                   f"{skipped} oversized blocks skipped.")
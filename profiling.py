@@ -0,0 +1,247 @@
+"""On-demand request profiling: cProfile plus a stack sampler around one request.
+
+A request is profiled when it carries ``X-Profile: 1`` from an Admin (or
+from anyone while ``AUTH_ENABLED=0``), or at random with probability
+``PROFILE_SAMPLE_RATE``, optionally only for the endpoints listed in
+``PROFILE_ENDPOINTS``. ``PROFILE_ENABLED=0`` installs no hooks at all. With
+the defaults, an unprofiled request costs one header lookup.
+
+A worker profiles one request at a time; others run unprofiled. cProfile
+records the request thread's calls for ``pstats``. A sampler thread reads
+the same thread's stack every ``PROFILE_SAMPLE_INTERVAL_MS`` (no faster than
+the GIL switch interval, 5 ms by default, while the request runs Python) and
+folds the samples into collapsed stacks (``root;caller;callee count``), which
+flamegraph.pl and speedscope read. Each profile is written under
+``HMS_RUNTIME_DIR/profiles/<tenant>/<endpoint>/`` as ``<id>.prof``,
+``<id>.folded`` and ``<id>.json`` (method, path, status, duration, trigger).
+At most ``PROFILE_MAX_PER_ENDPOINT`` profiles are kept per endpoint, oldest
+dropped first. The response carries the id in ``X-Profile-Id``.
+
+``GET /api/profiles`` lists the stored profiles (``?endpoint=`` filters).
+``GET /api/profiles/<id>`` returns one as ``?format=text`` (top functions by
+cumulative time, the default), ``pstats`` or ``folded``.
+``GET /api/profiles/flame?endpoint=`` merges the collapsed stacks of an
+endpoint's profiles.
+"""
+import cProfile
+import glob
+import io
+import itertools
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, g, jsonify, request, send_file
+
+from auth import AUTH_ENABLED
+from shared_state import runtime_path
+from tenancy import current_tenant_id
+
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', '1') == '1'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_ENDPOINTS = {name.strip() for name in os.getenv('PROFILE_ENDPOINTS', '').split(',') if name.strip()}
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '1'))
+PROFILE_MAX_PER_ENDPOINT = int(os.getenv('PROFILE_MAX_PER_ENDPOINT', '20'))
+PROFILE_TEXT_LINES = 60
+
+_PROFILE_ID = re.compile(r'^\d+-\d+-\d+$')
+
+
+class StackSampler:
+    """Samples one thread's Python stack from a background thread."""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """Profiles on disk, a bounded number per tenant and endpoint."""
+
+    def __init__(self, max_per_endpoint=PROFILE_MAX_PER_ENDPOINT):
+        self.max_per_endpoint = max_per_endpoint
+        self._seq = itertools.count(1)
+
+    def _root(self, tenant_id):
+        return runtime_path(os.path.join('profiles', tenant_id))
+
+    def save(self, tenant_id, endpoint, profile, folded, meta):
+        profile_id = f"{int(time.time() * 1000)}-{os.getpid()}-{next(self._seq)}"
+        directory = os.path.join(self._root(tenant_id), endpoint)
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, profile_id)
+        pstats.Stats(profile).dump_stats(base + '.prof')
+        with open(base + '.folded', 'w', encoding='utf-8') as f:
+            f.write(folded)
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(dict(meta, id=profile_id, endpoint=endpoint), f)
+        self._prune(directory)
+        return profile_id
+
+    def _prune(self, directory):
+        metas = sorted(glob.glob(os.path.join(directory, '*.json')), key=os.path.getmtime)
+        for path in metas[:max(0, len(metas) - self.max_per_endpoint)]:
+            base = path[:-len('.json')]
+            for suffix in ('.json', '.prof', '.folded'):
+                try:
+                    os.remove(base + suffix)
+                except FileNotFoundError:
+                    pass  # Pruned by another worker
+
+    def list(self, tenant_id, endpoint=None):
+        pattern = os.path.join(self._root(tenant_id), endpoint or '*', '*.json')
+        profiles = []
+        for path in glob.glob(pattern):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Pruned or still being written
+        return sorted(profiles, key=lambda meta: meta['started_at'], reverse=True)
+
+    def path(self, tenant_id, profile_id, suffix):
+        """Path of a stored profile's file, or ``None``."""
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        matches = glob.glob(os.path.join(self._root(tenant_id), '*', profile_id + suffix))
+        return matches[0] if matches else None
+
+
+def _wanted():
+    if request.headers.get(PROFILE_HEADER) == '1':
+        principal = g.get('principal')
+        if not AUTH_ENABLED or (principal is not None and principal.role == 'Admin'):
+            return 'header'
+    if PROFILE_SAMPLE_RATE > 0 and (not PROFILE_ENDPOINTS or request.endpoint in PROFILE_ENDPOINTS):
+        if random.random() < PROFILE_SAMPLE_RATE:
+            return 'sampled'
+    return None
+
+
+def init_profiling(app, store=None):
+    """Installs the profiling hooks (unless ``PROFILE_ENABLED=0``) and the ``/api/profiles`` routes.
+
+    Call after ``init_auth`` so the header check sees the request's principal.
+    """
+    store = store or ProfileStore()
+    active = threading.Lock()  # One profiled request per worker at a time
+    stats = {"profiled": 0, "skipped_busy": 0}
+
+    def stop(save, response=None):
+        session = g.pop('profile', None)
+        if session is None:
+            return None
+        profile, sampler, trigger, started_at, started = session
+        profile.disable()
+        sampler.stop()
+        active.release()
+        if not save:
+            return None
+        meta = {"method": request.method, "path": request.full_path.rstrip('?'), "trigger": trigger,
+                "status": response.status_code, "started_at": started_at,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "samples": sum(sampler.stacks.values())}
+        stats["profiled"] += 1
+        return store.save(current_tenant_id(), request.endpoint or 'unknown', profile, sampler.folded(), meta)
+
+    if PROFILE_ENABLED:
+        @app.before_request
+        def start_profile():
+            trigger = _wanted()
+            if trigger is None:
+                return None
+            if not active.acquire(blocking=False):
+                stats["skipped_busy"] += 1
+                return None
+            sampler = StackSampler(threading.get_ident())
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                active.release()  # Another profiler is active in this process
+                return None
+            sampler.start()
+            g.profile = (profile, sampler, trigger, time.time(), time.perf_counter())
+            return None
+
+        @app.after_request
+        def finish_profile(response):
+            profile_id = stop(True, response)
+            if profile_id is not None:
+                response.headers['X-Profile-Id'] = profile_id
+            return response
+
+        @app.teardown_request
+        def abandon_profile(exc):
+            stop(False)  # The request failed before after_request
+
+    @app.route('/api/profiles', methods=['GET'])
+    def profile_list():
+        return jsonify({"worker": dict(stats, sample_rate=PROFILE_SAMPLE_RATE),
+                        "profiles": store.list(current_tenant_id(), request.args.get('endpoint'))}), 200
+
+    @app.route('/api/profiles/flame', methods=['GET'])
+    def profile_flame():
+        endpoint = request.args.get('endpoint')
+        if not endpoint:
+            return jsonify({"error": "endpoint is required"}), 400
+        merged = Counter()
+        for meta in store.list(current_tenant_id(), endpoint):
+            path = store.path(current_tenant_id(), meta['id'], '.folded')
+            if path is None:
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    merged[stack] += int(count)
+        return Response(''.join(f"{stack} {count}\n" for stack, count in merged.most_common()),
+                        mimetype='text/plain')
+
+    @app.route('/api/profiles/<profile_id>', methods=['GET'])
+    def profile_detail(profile_id):
+        fmt = request.args.get('format', 'text')
+        if fmt not in ('text', 'pstats', 'folded'):
+            return jsonify({"error": "format must be text, pstats or folded"}), 400
+        path = store.path(current_tenant_id(), profile_id, '.folded' if fmt == 'folded' else '.prof')
+        if path is None:
+            return jsonify({"error": "Profile not found"}), 404
+        if fmt == 'pstats':
+            return send_file(path, mimetype='application/octet-stream', download_name=f"{profile_id}.prof")
+        if fmt == 'folded':
+            return send_file(path, mimetype='text/plain', download_name=f"{profile_id}.folded")
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(PROFILE_TEXT_LINES)
+        return Response(out.getvalue(), mimetype='text/plain')
+
+    return store
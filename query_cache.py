@@ -0,0 +1,167 @@
+"""Per-worker query-result cache invalidated by shared per-table versions.
+
+Results are keyed by whitespace-normalized SQL plus parameters and remember
+the version of every table the query reads (taken from its FROM/JOIN
+clauses). Versions live in a small shared-memory table, so a write through
+any gunicorn worker (``TableVersions.bump``) invalidates the matching entries
+in every worker; unrelated entries stay warm. Entries are evicted LRU once
+``QUERY_CACHE_MAX_ENTRIES`` or ``QUERY_CACHE_MAX_ROWS`` is exceeded.
+
+Versions and entries are kept per ``namespace()`` (the tenant, see
+``tenancy``), so a write in one hospital never invalidates another's.
+
+Writes made outside the API (the notebook CLI, manual SQL) do not bump
+versions, so every entry also expires after ``QUERY_CACHE_TTL_S``.
+"""
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from shared_state import SharedRegion, key_hash as shared_key_hash
+
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv('QUERY_CACHE_MAX_ENTRIES', '512'))
+QUERY_CACHE_MAX_ROWS = int(os.getenv('QUERY_CACHE_MAX_ROWS', '200000'))
+QUERY_CACHE_TTL_S = float(os.getenv('QUERY_CACHE_TTL_S', '300'))
+
+_VERSION_SLOTS = 1024
+_VERSION = struct.Struct('<Qqd')  # table hash, version, last bump (epoch seconds)
+
+_TABLES_RE = re.compile(r'\b(?:FROM|JOIN)\s+`?(\w+)`?', re.IGNORECASE)
+
+
+def tables_in(sql):
+    """Tables named in the FROM/JOIN clauses of ``sql``."""
+    return tuple(sorted({name.lower() for name in _TABLES_RE.findall(sql)}))
+
+
+class TableVersions:
+    """Monotonic per-table write counters shared by all workers.
+
+    ``namespace()`` names the current tenant; each has its own counters.
+    """
+
+    def __init__(self, region_name='table_versions.bin', namespace=None, region=None):
+        self.region = region or SharedRegion(region_name, _VERSION_SLOTS * _VERSION.size)
+        self.namespace = namespace or (lambda: '')
+        self._hashes = {}
+
+    def bound(self, namespace):
+        """A view of the same counters fixed to ``namespace``, for background threads."""
+        return TableVersions(namespace=lambda: namespace, region=self.region)
+
+    def _hash(self, table):
+        key = (self.namespace(), table)
+        value = self._hashes.get(key)
+        if value is None:
+            value = self._hashes[key] = shared_key_hash(f"{key[0]}/{table}" if key[0] else table)
+        return value
+
+    def _find(self, buf, table_hash):
+        start = table_hash % _VERSION_SLOTS
+        for probe in range(_VERSION_SLOTS):
+            offset = ((start + probe) % _VERSION_SLOTS) * _VERSION.size
+            slot_hash, version, bumped_at = _VERSION.unpack_from(buf, offset)
+            if slot_hash == table_hash or slot_hash == 0:
+                return offset, slot_hash, version, bumped_at
+        raise RuntimeError("table version region is full")
+
+    def bump(self, *tables):
+        now = time.time()
+        with self.region.locked() as buf:
+            for table in tables:
+                table_hash = self._hash(table)
+                offset, _, version, _ = self._find(buf, table_hash)
+                _VERSION.pack_into(buf, offset, table_hash, version + 1, now)
+
+    def read(self, tables):
+        """``(versions, last_bump)`` for ``tables``; lock-free."""
+        buf = self.region.buf
+        versions = []
+        last_bump = 0.0
+        for table in tables:
+            _, slot_hash, version, bumped_at = self._find(buf, self._hash(table))
+            versions.append(version if slot_hash else 0)
+            last_bump = max(last_bump, bumped_at)
+        return tuple(versions), last_bump
+
+
+class QueryCache:
+    """LRU of ``(description, rows)`` results, validated against table versions.
+
+    ``settle_s`` skips storing results read within that many seconds of a
+    write to one of their tables, so a lagging replica cannot plant a stale
+    result under the new version.
+    """
+
+    def __init__(self, versions=None, max_entries=QUERY_CACHE_MAX_ENTRIES, max_rows=QUERY_CACHE_MAX_ROWS,
+                 ttl=QUERY_CACHE_TTL_S, settle_s=0.0):
+        self.versions = versions or TableVersions()
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.settle_s = settle_s
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._tables = {}
+        self._counters = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+
+    def _tables_for(self, sql):
+        tables = self._tables.get(sql)
+        if tables is None:
+            tables = self._tables[sql] = tables_in(sql)
+        return tables
+
+    def fetch(self, sql, params, run):
+        """Cached result of ``sql``, calling ``run(sql, params)`` on a miss.
+
+        ``run`` returns ``(description, rows)``, as does this method. Rows are
+        fresh dicts on every call, so callers may modify them.
+        """
+        sql = ' '.join(sql.split())
+        key = (self.versions.namespace(), sql, tuple(params) if params is not None else None)
+        tables = self._tables_for(sql)
+        versions, last_bump = self.versions.read(tables)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_versions, expires, description, rows = entry
+                if entry_versions == versions and expires > now:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return description, [dict(row) for row in rows]
+                self._drop(key)
+                self._counters['stale'] += 1
+            self._counters['misses'] += 1
+
+        description, rows = run(sql, params)
+        if time.time() - last_bump >= self.settle_s and len(rows) <= self.max_rows:
+            self._store(key, (versions, now + self.ttl, description, [dict(row) for row in rows]))
+        return description, rows
+
+    def _store(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._rows += len(entry[3])
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._drop(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def _drop(self, key):
+        self._rows -= len(self._entries.pop(key)[3])
+
+    def invalidate(self, *tables):
+        """Marks ``tables`` as written, in this and every other worker."""
+        self.versions.bump(*tables)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return dict(self._counters, entries=len(self._entries), rows=self._rows,
+                        hit_ratio=round(self._counters['hits'] / lookups, 3) if lookups else 0.0)
@@ -0,0 +1,313 @@
+"""Reference-data snapshot shared zero-copy by every gunicorn worker.
+
+Doctors, departments, test types and insurance providers change a few times
+a day but back every dropdown. One worker at a time (whichever holds the
+refresher lock) rebuilds a compact binary snapshot of them whenever their
+table versions (see ``query_cache.TableVersions``) change, writes it into
+the inactive half of a memory-mapped file and then flips the active half.
+Readers in every worker look rows up by id (a binary search over the
+table's sorted ids, then one row's fields) and serve the pre-rendered
+dropdown JSON straight from the mapping, with no DB hit and no per-worker
+copy. List endpoints keep resolving names in their own SQL joins, which
+always agree with the rows they return.
+
+Each half is guarded by a sequence counter (odd while being written), so a
+reader that overlaps a rewrite retries instead of seeing torn data. A table
+whose version moved past the snapshot's is reported as missing, and callers
+fall back to the database until the refresher catches up.
+
+Snapshot layout, per half::
+
+    seq:Q  length:Q  table_count:I  pad:I
+    per table: name:32s  columns:96s  version:q  rows:Q  ids:Q  offsets:Q  blob:Q  json:Q  json_len:Q
+    ids (int64, sorted) | row offsets into blob (uint64, rows + 1) | blob | json
+"""
+import bisect
+import fcntl
+import os
+import struct
+import threading
+import time
+from decimal import Decimal
+
+from shared_state import SharedRegion, runtime_path
+
+REFERENCE_SNAPSHOT_MAX_BYTES = int(os.getenv('REFERENCE_SNAPSHOT_MAX_BYTES', str(8 * 1024 * 1024)))
+REFERENCE_CHECK_INTERVAL_S = float(os.getenv('REFERENCE_CHECK_INTERVAL_S', '1'))
+# Rebuild at least this often to pick up writes made outside the API.
+REFERENCE_MAX_AGE_S = float(os.getenv('REFERENCE_MAX_AGE_S', '300'))
+
+_HEADER = struct.Struct('<8sQQd')  # magic, active half, generation, built at
+_MAGIC = b'HMSREF3\0'
+_AREA = struct.Struct('<QQII')  # seq, payload length, table count, pad
+_TABLE = struct.Struct('<32s96sqQQQQQQ')
+_FIELD_SEP = '\x1f'
+
+
+class ReferenceTable:
+    """One snapshotted table: the dropdown query and its decoded column types.
+
+    ``sql`` must select the row id as ``id`` first and be ordered the way the
+    dropdown is served.
+    """
+
+    __slots__ = ('name', 'sql', 'columns', 'decimals')
+
+    def __init__(self, name, sql, columns, decimals=()):
+        self.name = name
+        self.sql = sql
+        self.columns = tuple(columns)
+        self.decimals = frozenset(decimals)
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def encode_snapshot(tables, rows_by_table, versions, dumps):
+    """Serializes ``rows_by_table`` into one snapshot payload.
+
+    ``dumps(rows)`` renders a table's dropdown response body.
+    """
+    directory = []
+    chunks = []
+    offset = _AREA.size + _TABLE.size * len(tables)
+    offset = _align(offset)
+    for table in tables:
+        rows = sorted(rows_by_table[table.name], key=lambda row: row['id'])
+        ids = struct.pack(f'<{len(rows)}q', *(row['id'] for row in rows))
+        blob = bytearray()
+        row_offsets = [0]
+        for row in rows:
+            blob += _FIELD_SEP.join('' if row[c] is None else str(row[c]) for c in table.columns[1:]).encode('utf-8')
+            row_offsets.append(len(blob))
+        offsets = struct.pack(f'<{len(row_offsets)}Q', *row_offsets)
+        body = dumps(rows_by_table[table.name]).encode('utf-8')
+
+        ids_at = offset
+        offsets_at = _align(ids_at + len(ids))
+        blob_at = _align(offsets_at + len(offsets))
+        json_at = _align(blob_at + len(blob))
+        offset = _align(json_at + len(body))
+        directory.append(_TABLE.pack(table.name.encode(), ','.join(table.columns).encode(), versions[table.name],
+                                     len(rows), ids_at, offsets_at, blob_at, json_at, len(body)))
+        chunks.extend(((ids_at, ids), (offsets_at, offsets), (blob_at, bytes(blob)), (json_at, body)))
+
+    payload = bytearray(offset)
+    struct.pack_into('<I', payload, 16, len(tables))
+    pos = _AREA.size
+    for entry in directory:
+        payload[pos:pos + _TABLE.size] = entry
+        pos += _TABLE.size
+    for at, data in chunks:
+        payload[at:at + len(data)] = data
+    return payload
+
+
+class _TornRead(Exception):
+    pass
+
+
+class _TableView:
+    """Offsets of one table inside a snapshot half; holds no row data."""
+
+    __slots__ = ('columns', 'version', 'rows', 'ids', 'offsets', 'blob', 'json', 'json_len')
+
+    def __init__(self, columns, version, rows, ids, offsets, blob, json_at, json_len):
+        self.columns = columns
+        self.version = version
+        self.rows = rows
+        self.ids = ids
+        self.offsets = offsets
+        self.blob = blob
+        self.json = json_at
+        self.json_len = json_len
+
+
+class ReferenceSnapshot:
+    """Reader and (when holding the refresher lock) writer of the snapshot."""
+
+    def __init__(self, tables, load_rows, versions, dumps, name='reference',
+                 capacity=REFERENCE_SNAPSHOT_MAX_BYTES, settle_s=0.0,
+                 check_interval=REFERENCE_CHECK_INTERVAL_S, max_age=REFERENCE_MAX_AGE_S):
+        self.tables = {table.name: table for table in tables}
+        self.load_rows = load_rows
+        self.versions = versions
+        self.dumps = dumps
+        self.capacity = capacity
+        self.settle_s = settle_s
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.region = SharedRegion(f'{name}.bin', _HEADER.size + 2 * capacity)
+        self._lock_path = runtime_path(f'{name}.refresher.lock')
+        self._directories = {}
+        self._refresher_pid = None
+        self._lock = threading.Lock()
+        self.last_error = None
+        self.stats = {"published": 0, "failed": 0}
+
+    # --- Reading ---
+    def _area(self, half):
+        return _HEADER.size + half * self.capacity
+
+    def _directory(self, buf, area, seq):
+        key = (area, seq)
+        directory = self._directories.get(key)
+        if directory is None:
+            count, = struct.unpack_from('<I', buf, area + 16)
+            directory = {}
+            for i in range(count):
+                (name, columns, version, rows, ids, offsets, blob,
+                 json_at, json_len) = _TABLE.unpack_from(buf, area + _AREA.size + i * _TABLE.size)
+                directory[name.rstrip(b'\0').decode()] = _TableView(
+                    tuple(columns.rstrip(b'\0').decode().split(',')), version, rows,
+                    area + ids, area + offsets, area + blob, area + json_at, json_len)
+            if struct.unpack_from('<Q', buf, area)[0] != seq:
+                raise _TornRead()
+            # Only the two halves' latest layouts are ever current.
+            if len(self._directories) > 4:
+                self._directories.clear()
+            self._directories[key] = directory
+        return directory
+
+    def _read(self, table_name, reader):
+        """Runs ``reader(buf, view)`` against a consistent, current snapshot."""
+        self._ensure_refresher()
+        buf = self.region.buf
+        magic, half, generation, _ = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC or not generation:
+            return None
+        current, _ = self.versions.read((table_name,))
+        area = self._area(half)
+        for _ in range(3):
+            seq, = struct.unpack_from('<Q', buf, area)
+            if seq % 2:
+                continue
+            try:
+                view = self._directory(buf, area, seq).get(table_name)
+                if view is None or view.version != current[0]:
+                    return None
+                result = reader(buf, view)
+            except (_TornRead, struct.error, ValueError, IndexError):
+                # The half was rewritten under us; re-check its sequence.
+                continue
+            if struct.unpack_from('<Q', buf, area)[0] == seq:
+                return result
+        return None
+
+    def json(self, table_name):
+        """The pre-rendered dropdown response body, or ``None`` when stale."""
+        return self._read(table_name, lambda buf, view: bytes(buf[view.json:view.json + view.json_len]))
+
+    def lookup(self, table_name, row_id):
+        """``{column: value}`` for ``row_id``; ``None`` if absent or stale."""
+        table = self.tables[table_name]
+
+        def find(buf, view):
+            ids = memoryview(buf)[view.ids:view.ids + 8 * view.rows].cast('q')
+            try:
+                i = bisect.bisect_left(ids, row_id)
+                if i == view.rows or ids[i] != row_id:
+                    return False
+                start, end = struct.unpack_from('<QQ', buf, view.offsets + 8 * i)
+                fields = bytes(buf[view.blob + start:view.blob + end]).decode('utf-8').split(_FIELD_SEP)
+            finally:
+                ids.release()
+            row = {'id': row_id}
+            for column, value in zip(table.columns[1:], fields):
+                row[column] = Decimal(value) if column in table.decimals and value else (value or None)
+            return row
+
+        row = self._read(table_name, find)
+        return row or None
+
+    def name_of(self, table_name, row_id):
+        row = self.lookup(table_name, row_id)
+        return row['name'] if row else None
+
+    # --- Refreshing ---
+    def _ensure_refresher(self):
+        # Every worker runs a refresher thread; the flock lets only one build.
+        if self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+        threading.Thread(target=self._run_refresher, name='reference-refresher', daemon=True).start()
+
+    def _run_refresher(self):
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                time.sleep(self.check_interval)
+                continue
+            try:
+                while True:
+                    try:
+                        self.refresh_if_changed()
+                    except Exception as e:
+                        # A torn header read or a failing version lookup; try again next interval
+                        self.stats["failed"] += 1
+                        self.last_error = str(e)
+                    time.sleep(self.check_interval)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _published_versions(self, buf):
+        magic, half, generation, built_at = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC or not generation:
+            return None, 0.0
+        area = self._area(half)
+        seq, = struct.unpack_from('<Q', buf, area)
+        return {name: view.version for name, view in self._directory(buf, area, seq).items()}, built_at
+
+    def refresh_if_changed(self):
+        """Rebuilds the snapshot if a table changed; returns True if it published."""
+        names = tuple(self.tables)
+        versions, last_bump = self.versions.read(names)
+        current = dict(zip(names, versions))
+        published, built_at = self._published_versions(self.region.buf)
+        if published == current and time.time() - built_at < self.max_age:
+            return False
+        if time.time() - last_bump < self.settle_s:
+            return False
+        try:
+            self.publish(current)
+        except Exception as e:
+            self.stats["failed"] += 1
+            self.last_error = str(e)
+            return False
+        self.stats["published"] += 1
+        self.last_error = None
+        return True
+
+    def publish(self, versions):
+        """Loads every table and swaps the new snapshot in."""
+        rows_by_table = self.load_rows(list(self.tables.values()))
+        payload = encode_snapshot(list(self.tables.values()), rows_by_table, versions, self.dumps)
+        if len(payload) > self.capacity:
+            raise ValueError(f"reference snapshot needs {len(payload)} bytes, "
+                             f"REFERENCE_SNAPSHOT_MAX_BYTES is {self.capacity}")
+        with self.region.locked() as buf:
+            magic, half, generation, _ = _HEADER.unpack_from(buf, 0)
+            target = 0 if magic != _MAGIC or not generation else 1 - half
+            area = self._area(target)
+            seq, = struct.unpack_from('<Q', buf, area)
+            struct.pack_into('<Q', buf, area, seq + 1 if seq % 2 == 0 else seq)
+            buf[area + 8:area + len(payload)] = payload[8:]
+            struct.pack_into('<Q', buf, area + 8, len(payload))
+            struct.pack_into('<Q', buf, area, (seq | 1) + 1)
+            _HEADER.pack_into(buf, 0, _MAGIC, target, (generation if magic == _MAGIC else 0) + 1, time.time())
+
+    def status(self):
+        buf = self.region.buf
+        magic, half, generation, built_at = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC:
+            return {"generation": 0, "error": self.last_error, "worker": self.stats}
+        published, _ = self._published_versions(buf)
+        return {"generation": generation, "active_half": half, "built_at": built_at,
+                "bytes": struct.unpack_from('<Q', buf, self._area(half) + 8)[0],
+                "tables": published, "error": self.last_error, "worker": self.stats}
@@ -0,0 +1,294 @@
+"""The notebook's report figures, drawn headless for ``report_images``.
+
+Each report is the query and the plotting code of the matching 1.1.ipynb
+function (``view_inventory``, ``view_patients``,
+``generate_doctor_performance_report``, ``analyze_appointment_patterns``),
+with ``plt.show()`` replaced by saving the figure. ``render`` runs in the
+render processes only: it loads the data with ``analytics_loader`` over its
+own connection and writes the image to a file, so neither the DataFrame nor
+the image passes through an API worker. matplotlib is imported there, with
+the Agg backend, and never in the API workers.
+"""
+import os
+import tempfile
+
+import pandas as pd
+import pymysql
+
+from analytics_loader import build_query, load_frame
+from db_resilience import DB_CONNECT_TIMEOUT_S, DB_READ_TIMEOUT_SLACK_MS, DB_SCAN_TIMEOUT_MS, ROUTE_TIMEOUTS_MS
+
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+class Report:
+    """A report's query, the tables it reads and its figure."""
+
+    __slots__ = ('name', 'sql', 'tables', 'date_column', 'figsize', 'draw')
+
+    def __init__(self, name, sql, tables, draw, figsize, date_column=None):
+        self.name = name
+        self.sql = sql
+        self.tables = tables
+        self.draw = draw
+        self.figsize = figsize
+        self.date_column = date_column
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    return plt, sns
+
+
+def init_renderer():
+    """Imports pyplot (Agg backend) and seaborn up front; the render pool's initializer."""
+    try:
+        _pyplot()
+    except ImportError:
+        pass  # render() reports it for each request instead of breaking the pool
+
+
+def draw_inventory(plt, sns, df):
+    category_counts = df['category'].value_counts()
+    category_counts.plot(kind='pie', autopct='%1.1f%%', startangle=90, colors=sns.color_palette('pastel'))
+    plt.title('Inventory Distribution by Category')
+    plt.ylabel('')
+
+
+def draw_patients(plt, sns, df):
+    # Age distribution
+    plt.subplot(3, 2, 1)
+    sns.histplot(df['age'], bins=20, kde=True, color='skyblue')
+    plt.title('Age Distribution of Patients')
+    plt.xlabel('Age')
+    plt.ylabel('Count')
+
+    # Gender distribution
+    plt.subplot(3, 2, 2)
+    gender_counts = df['gender'].value_counts()
+    gender_counts.plot(kind='pie', autopct='%1.1f%%', colors=['lightblue', 'pink', 'lightgray'], startangle=90)
+    plt.title('Patient Gender Distribution')
+    plt.ylabel('')
+
+    # Blood type distribution
+    plt.subplot(3, 2, 3)
+    blood_counts = df['blood_type'].value_counts()
+    if not blood_counts.empty:
+        blood_counts.plot(kind='bar', color='lightcoral')
+        plt.title('Patient Blood Type Distribution')
+        plt.xlabel('Blood Type')
+        plt.ylabel('Count')
+        plt.xticks(rotation=45)
+    else:
+        plt.text(0.5, 0.5, 'No blood type data available', ha='center', va='center')
+        plt.axis('off')
+
+    # Disease distribution (top 10)
+    plt.subplot(3, 2, 4)
+    disease_counts = df['disease'].value_counts().head(10)
+    if not disease_counts.empty:
+        disease_counts.plot(kind='barh', color='lightgreen')
+        plt.title('Top 10 Patient Conditions')
+        plt.xlabel('Count')
+        plt.ylabel('Condition')
+    else:
+        plt.text(0.5, 0.5, 'No disease data available', ha='center', va='center')
+        plt.axis('off')
+
+    # Insurance providers (a separate figure in the notebook)
+    plt.subplot(3, 2, 5)
+    insurance_counts = df['insurance_provider'].value_counts().head(10)
+    if not insurance_counts.empty:
+        insurance_counts.plot(kind='bar', color='mediumpurple')
+        plt.title('Top 10 Insurance Providers')
+        plt.xlabel('Provider')
+        plt.ylabel('Number of Patients')
+        plt.xticks(rotation=45)
+    else:
+        plt.text(0.5, 0.5, 'No insurance data available', ha='center', va='center')
+        plt.axis('off')
+
+    plt.subplot(3, 2, 6)
+    plt.axis('off')
+
+
+def draw_doctor_performance(plt, sns, df):
+    df['completion_rate'] = (df['completed_appointments'] / df['total_appointments']) * 100
+    df['revenue_per_appointment'] = df['total_revenue'] / df['total_appointments']
+
+    # Revenue by doctor
+    ax = plt.subplot(2, 2, 1)
+    df.sort_values('total_revenue', ascending=False).head(10).plot(
+        x='doctor_name', y='total_revenue', kind='bar', color='green', ax=ax)
+    plt.title('Top 10 Doctors by Revenue')
+    plt.ylabel('Total Revenue (₹)')
+    plt.xticks(rotation=45)
+
+    # Completion rate vs. experience
+    plt.subplot(2, 2, 2)
+    sns.regplot(x='years_of_experience', y='completion_rate', data=df,
+                scatter_kws={'alpha': 0.5}, line_kws={'color': 'red'})
+    plt.title('Experience vs. Appointment Completion Rate')
+    plt.xlabel('Years of Experience')
+    plt.ylabel('Completion Rate (%)')
+
+    # Specialization analysis
+    plt.subplot(2, 2, 3)
+    spec_stats = df.groupby('specialization', observed=True).agg({
+        'total_revenue': 'sum',
+        'total_appointments': 'sum'
+    }).sort_values('total_revenue', ascending=False).head(10)
+    spec_stats['total_revenue'].plot(kind='bar', color='blue')
+    plt.title('Top 10 Specializations by Revenue')
+    plt.ylabel('Total Revenue (₹)')
+    plt.xticks(rotation=45)
+
+    # Performance matrix
+    plt.subplot(2, 2, 4)
+    sns.scatterplot(x='total_appointments', y='revenue_per_appointment',
+                    size='years_of_experience', hue='specialization',
+                    data=df, sizes=(20, 200), alpha=0.6)
+    plt.title('Doctor Performance Matrix')
+    plt.xlabel('Total Appointments')
+    plt.ylabel('Revenue per Appointment (₹)')
+    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+
+
+def draw_appointment_patterns(plt, sns, df):
+    df['date'] = pd.to_datetime(df['date'])
+    # TIME columns arrive as timedelta64 from the loader; a NULL time stays <NA>
+    df['hour'] = (df['time'].dt.total_seconds() // 3600).astype('Int8')
+    df['day_of_week'] = df['date'].dt.day_name()
+
+    # Day of week pattern
+    plt.subplot(3, 2, 1)
+    df['day_of_week'].value_counts().reindex(DAY_ORDER).plot(kind='bar', color='lightblue')
+    plt.title('Appointments by Day of Week')
+    plt.xlabel('Day')
+    plt.ylabel('Number of Appointments')
+
+    # Hour of day pattern
+    plt.subplot(3, 2, 2)
+    df['hour'].value_counts().reindex(range(24), fill_value=0).plot(kind='bar', color='lightgreen')
+    plt.title('Appointments by Hour of Day')
+    plt.xlabel('Hour')
+    plt.ylabel('Number of Appointments')
+    plt.xticks(range(24), [f"{h}:00" for h in range(24)], rotation=45)
+
+    # Status distribution
+    plt.subplot(3, 2, 3)
+    df['status'].value_counts().plot(kind='pie', autopct='%1.1f%%', colors=sns.color_palette('pastel'),
+                                     startangle=90)
+    plt.title('Appointment Status Distribution')
+    plt.ylabel('')
+
+    # Specialization distribution
+    plt.subplot(3, 2, 4)
+    df['specialization'].value_counts().head(10).plot(kind='barh', color='salmon')
+    plt.title('Top 10 Specializations')
+    plt.xlabel('Number of Appointments')
+
+    # Age by gender
+    plt.subplot(3, 2, 5)
+    df.groupby('patient_gender', observed=True)['patient_age'].mean().plot(
+        kind='bar', color=['lightblue', 'pink', 'lightgray'])
+    plt.title('Average Patient Age by Gender')
+    plt.xlabel('Gender')
+    plt.ylabel('Average Age')
+
+    # Time series of appointments
+    plt.subplot(3, 2, 6)
+    df.groupby(df['date'].dt.to_period('M')).size().plot(kind='line', marker='o', color='purple')
+    plt.title('Monthly Appointment Trend')
+    plt.xlabel('Month')
+    plt.ylabel('Number of Appointments')
+
+
+REPORTS = {report.name: report for report in [
+    Report('inventory', """
+        SELECT item_id, name, category, quantity, unit, price, supplier, expiry_date, threshold
+        FROM inventory ORDER BY name
+    """, ('inventory',), draw_inventory, (10, 6)),
+    Report('patients', """
+        SELECT p.patient_id, p.name, p.age, p.gender, p.blood_type, p.phone, p.email,
+               p.disease, ip.name AS insurance_provider, p.created_at
+        FROM patient p
+        LEFT JOIN insurance_provider ip ON p.insurance_provider_id = ip.provider_id
+        ORDER BY p.name
+    """, ('patient', 'insurance_provider'), draw_patients, (15, 15)),
+    Report('doctor-performance', """
+        SELECT
+            d.doctor_id,
+            d.name AS doctor_name,
+            d.specialization,
+            d.years_of_experience,
+            d.consultation_fee,
+            COUNT(DISTINCT a.appointment_id) AS total_appointments,
+            COUNT(DISTINCT CASE WHEN a.status = 'Completed' THEN a.appointment_id END) AS completed_appointments,
+            COUNT(DISTINCT mr.record_id) AS medical_records,
+            COUNT(DISTINCT b.bill_id) AS bills_generated,
+            IFNULL(SUM(b.total_amount), 0) AS total_revenue
+        FROM doctor d
+        LEFT JOIN appointment a ON d.doctor_id = a.doctor_id
+        LEFT JOIN medical_record mr ON d.doctor_id = mr.doctor_id
+        LEFT JOIN billing b ON d.doctor_id = b.doctor_id
+        GROUP BY d.doctor_id, d.name, d.specialization, d.years_of_experience, d.consultation_fee
+        ORDER BY total_revenue DESC
+    """, ('doctor', 'appointment', 'medical_record', 'billing'), draw_doctor_performance, (15, 10)),
+    Report('appointment-patterns', """
+        SELECT
+            a.date,
+            a.time,
+            a.status,
+            d.specialization,
+            p.gender as patient_gender,
+            p.age as patient_age
+        FROM appointment a
+        JOIN doctor d ON a.doctor_id = d.doctor_id
+        JOIN patient p ON a.patient_id = p.patient_id
+    """, ('appointment', 'doctor', 'patient'), draw_appointment_patterns, (15, 12), date_column='a.date'),
+]}
+
+
+def render(name, fmt, db_config, start, end, path):
+    """Draws report ``name`` from ``db_config``'s database into ``path``.
+
+    Runs in a render process. The file appears atomically, so a concurrent
+    reader sees either nothing or the whole image. Returns its size.
+    """
+    plt, sns = _pyplot()
+    report = REPORTS[name]
+    sql, params = build_query(report.sql, date_column=report.date_column, start=start, end=end)
+    # The report_image route's deadline, applied the way db_resilience.connect does
+    timeout_ms = ROUTE_TIMEOUTS_MS.get('report_image', DB_SCAN_TIMEOUT_MS)
+    socket_timeout = (timeout_ms + DB_READ_TIMEOUT_SLACK_MS) / 1000.0
+    connection = pymysql.connect(**dict(db_config, connect_timeout=DB_CONNECT_TIMEOUT_S, read_timeout=socket_timeout,
+                                        write_timeout=socket_timeout,
+                                        init_command=f"SET SESSION MAX_EXECUTION_TIME = {int(timeout_ms)}"))
+    try:
+        df = load_frame(sql, params, connection=connection)
+    finally:
+        connection.close()
+
+    fig = plt.figure(figsize=report.figsize)
+    try:
+        if df.empty:
+            plt.text(0.5, 0.5, 'No data available for this report.', ha='center', va='center')
+            plt.axis('off')
+        else:
+            report.draw(plt, sns, df)
+        plt.tight_layout()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.' + fmt)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                fig.savefig(f, format=fmt, dpi=100)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    finally:
+        plt.close(fig)
+    return os.path.getsize(path)
@@ -0,0 +1,191 @@
+"""Printable report charts: ``GET /api/reports/<name>.png`` or ``.svg``.
+
+The figures of the notebook reports (see ``report_figures``) are drawn by a
+small pool of render processes per worker, ``REPORT_RENDER_PROCESSES``
+strong, started from a fork server that has matplotlib (Agg backend) and
+seaborn preloaded. Request threads only wait for the result, at most
+``REPORT_RENDER_TIMEOUT_S``; the render keeps going after a timeout and the
+retry finds its image. At most ``REPORT_MAX_PENDING`` renders are queued
+per worker, beyond that requests get a 503.
+
+Images are files under ``HMS_RUNTIME_DIR/reports/<tenant>/`` shared by every
+worker on the host, named by a hash of the report, format, parameters, the
+versions of the tables it reads (see ``query_cache``) and the current
+``REPORT_CACHE_TTL_S`` period, so a write through the API or the end of the
+period is what makes a report render again. The same hash is the ETag.
+Identical concurrent requests in a worker share one render.
+
+``appointment-patterns`` takes ``start``/``end`` (YYYY-MM-DD, inclusive).
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from flask import jsonify, request, send_file
+
+from coalesce import SingleFlight
+from report_figures import REPORTS, init_renderer, render
+from shared_state import runtime_path
+
+REPORT_RENDER_PROCESSES = int(os.getenv('REPORT_RENDER_PROCESSES', '1'))
+REPORT_RENDER_TIMEOUT_S = float(os.getenv('REPORT_RENDER_TIMEOUT_S', '30'))
+REPORT_MAX_PENDING = int(os.getenv('REPORT_MAX_PENDING', '8'))
+REPORT_CACHE_TTL_S = float(os.getenv('REPORT_CACHE_TTL_S', '300'))
+REPORT_CACHE_MAX_FILES = int(os.getenv('REPORT_CACHE_MAX_FILES', '256'))
+
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+
+class RenderBusy(Exception):
+    pass
+
+
+class RenderPool:
+    """The render processes of this worker, started on first use."""
+
+    def __init__(self, processes=REPORT_RENDER_PROCESSES, max_pending=REPORT_MAX_PENDING):
+        self.processes = processes
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._counters = {'renders': 0, 'failures': 0, 'timeouts': 0, 'rejected': 0}
+
+    def _ensure_executor(self):
+        # A forked worker must not share its parent's processes.
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['matplotlib.pyplot', 'seaborn', 'report_figures'])
+        else:
+            context = multiprocessing.get_context('spawn')
+        self._executor = ProcessPoolExecutor(self.processes, mp_context=context, initializer=init_renderer)
+        self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, *args):
+        """Queues ``render(*args)``; raises ``RenderBusy`` when too many are queued."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counters['rejected'] += 1
+                raise RenderBusy()
+            try:
+                future = self._ensure_executor().submit(render, *args)
+            except BrokenProcessPool:
+                self._executor = None
+                future = self._ensure_executor().submit(render, *args)
+            self._pending += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._counters['failures' if future.exception() else 'renders'] += 1
+
+    def timed_out(self):
+        with self._lock:
+            self._counters['timeouts'] += 1
+
+    def status(self):
+        with self._lock:
+            return {"processes": self.processes, "pending": self._pending,
+                    "started": self._executor is not None and self._pid == os.getpid(), **self._counters}
+
+
+def cache_key(tenant_id, name, fmt, start, end, versions):
+    """Hash naming one rendering of a report; changes with the data."""
+    period = int(time.time() // REPORT_CACHE_TTL_S) if REPORT_CACHE_TTL_S > 0 else 0
+    parts = [tenant_id, name, fmt, str(start or ''), str(end or ''), list(versions), period]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def _prune(directory, keep):
+    """Removes the least recently written images beyond ``keep``."""
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.startswith('tmp'):
+            entries.append((entry.stat().st_mtime, entry.path))
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - keep)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def init_report_images(app, tenants, query_cache):
+    """Installs ``GET /api/reports/<name>.<png|svg>``; returns the render pool."""
+    pool = RenderPool()
+    flights = SingleFlight(window_ms=0)
+
+    def render_once(report, fmt, db_config, start, end, path):
+        """Renders into ``path`` unless another worker already has; waits boundedly."""
+        if os.path.exists(path):
+            return
+        future = pool.submit(report.name, fmt, db_config, start, end, path)
+        try:
+            future.result(timeout=REPORT_RENDER_TIMEOUT_S)
+        except FutureTimeout:
+            pool.timed_out()
+            raise
+        _prune(os.path.dirname(path), REPORT_CACHE_MAX_FILES)
+
+    @app.route('/api/reports/<name>.<any(png, svg):fmt>', methods=['GET'])
+    def report_image(name, fmt):
+        report = REPORTS.get(name)
+        if report is None:
+            return jsonify({"error": f"No report named '{name}'", "available": sorted(REPORTS)}), 404
+        try:
+            start = request.args.get('start')
+            end = request.args.get('end')
+            start = datetime.strptime(start, '%Y-%m-%d').date() if start and report.date_column else None
+            end = datetime.strptime(end, '%Y-%m-%d').date() if end and report.date_column else None
+        except ValueError:
+            return jsonify({"error": "start and end must be dates in YYYY-MM-DD format"}), 400
+
+        tenant = tenants.current()
+        versions, last_bump = query_cache.versions.read(report.tables)
+        key = cache_key(tenant.id, name, fmt, start, end, versions)
+        directory = runtime_path(os.path.join('reports', tenant.id))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{key}.{fmt}")
+        if not os.path.exists(path):
+            # Right after a write a replica may not have it yet.
+            recent = time.time() - last_bump < query_cache.settle_s
+            db_config = tenant.router.primary if recent else tenant.router.read_config()
+            try:
+                flights.do(key, lambda: render_once(report, fmt, db_config, start, end, path))
+            except RenderBusy:
+                response = jsonify({"error": "Too many reports are being rendered, try again shortly"})
+                response.headers['Retry-After'] = '5'
+                return response, 503
+            except FutureTimeout:
+                response = jsonify({"error": "The report is still being rendered, try again shortly"})
+                response.headers['Retry-After'] = str(int(REPORT_RENDER_TIMEOUT_S) or 1)
+                return response, 503
+            except ImportError as e:
+                return jsonify({"error": f"Report rendering is unavailable: {e}"}), 503
+            except Exception as e:
+                return jsonify({"error": f"Could not render report: {e}"}), 500
+
+        response = send_file(path, mimetype=FORMATS[fmt], download_name=f"{name}.{fmt}",
+                             conditional=True, etag=key, max_age=0)
+        # Revalidate every time: the ETag changes with the data.
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @app.route('/api/metrics/reports', methods=['GET'])
+    def report_metrics():
+        return jsonify(pool.status()), 200
+
+    return pool
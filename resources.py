@@ -0,0 +1,384 @@
+"""Declarative CRUD resources for the ``/api/<entity>`` endpoints.
+
+Each entity is described once (table, columns, required fields, joins, list
+projection, defaults) and ``register_resource`` generates its
+``GET/POST`` collection and ``GET/PUT/DELETE`` item routes. All SQL is built
+when the resource is declared, except UPDATE statements, which depend on the
+submitted columns and are generated once per distinct column set and cached.
+PUT bodies are filtered against the resource's updatable columns, so client
+keys never reach SQL text.
+
+PyMySQL has no binary-protocol prepared statements, so statements are sent
+as text; caching them still removes all per-request SQL assembly.
+
+Collection GETs with ``?limit=`` (at most ``LIST_PAGE_MAX``) and optional
+``?offset=`` return one page as ``{"rows", "total", "limit", "offset"}``
+instead of the full array. ``total`` is counted for the first page
+(``offset=0``) only and is ``null`` on later ones, so a client scrolling
+through a table pays for one joined ``COUNT(*)`` per load. Hot-tier pages are ordered by the list order with
+the primary key as tie-break, so consecutive pages neither overlap nor skip
+rows.
+"""
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import pymysql
+from flask import jsonify, request
+from pymysql.constants import FIELD_TYPE
+
+from coalesce import coalesced
+from db_resilience import CircuitOpenError
+
+# Column types PyMySQL returns as datetime/timedelta, which the API has always
+# sent as str(value). DATE columns are left to Flask's JSON provider.
+_STRINGIFIED_TYPES = {FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP, FIELD_TYPE.TIME}
+
+LIST_PAGE_MAX = 1000
+
+
+class Resource:
+    """Declaration of one CRUD entity."""
+
+    def __init__(self, name, table, pk, url, label, insert_columns, required,
+                 alias=None, joins=(), detail_columns='', list_columns=None, order_by=None,
+                 updatable=None, defaults=None, json_columns=(), added='added', deleted='deleted',
+                 prepare_insert=None, created_extras=None, on_write=None, cached=False, archive_table=None):
+        self.name = name
+        self.endpoint = f'manage_{name}'
+        self.table = table
+        self.pk = pk
+        self.url = url
+        self.label = label
+        self.insert_columns = tuple(insert_columns)
+        self.required = tuple(required)
+        self.updatable = tuple(updatable if updatable is not None else insert_columns)
+        self.defaults = defaults or {}
+        self.json_columns = set(json_columns)
+        self.added = added
+        self.deleted = deleted
+        self.prepare_insert = prepare_insert
+        self.created_extras = created_extras
+        self.on_write = on_write
+        self.cached = cached
+        self.archive_table = archive_table
+
+        alias = alias or table
+        source = f"{table} {alias}" if alias != table else table
+        joined = ' '.join((source,) + tuple(joins))
+        extra = f", {detail_columns}" if detail_columns else ''
+        self.detail_sql = f"SELECT {alias}.*{extra} FROM {joined} WHERE {alias}.{pk} = %s"
+        self.list_sql = f"SELECT {list_columns or '*'} FROM {joined}"
+        self.count_sql = f"SELECT COUNT(*) AS total FROM {joined}"
+        self.page_sql = (f"{self.list_sql} ORDER BY {order_by + ', ' if order_by else ''}{alias}.{pk} "
+                         f"LIMIT %s OFFSET %s")
+        if order_by:
+            self.list_sql += f" ORDER BY {order_by}"
+        self.insert_sql = (f"INSERT INTO {table} ({', '.join(self.insert_columns)}) "
+                           f"VALUES ({', '.join(['%s'] * len(self.insert_columns))})")
+        self.delete_sql = f"DELETE FROM {table} WHERE {pk} = %s"
+
+        if archive_table:
+            # Same projection over the cold tier; the union is ordered by output column names.
+            cold = ' '.join((f"{archive_table} {alias}",) + tuple(joins))
+            self.archive_detail_sql = f"SELECT {alias}.*{extra} FROM {cold} WHERE {alias}.{pk} = %s"
+            union = (f"SELECT * FROM (SELECT {list_columns or '*'} FROM {joined} UNION ALL "
+                     f"SELECT {list_columns or '*'} FROM {cold}) tiers")
+            order = re.sub(r'\b\w+\.', '', order_by) if order_by else ''
+            self.archive_list_sql = f"{union} ORDER BY {order}" if order else union
+            self.archive_count_sql = (f"SELECT COUNT(*) AS total FROM (SELECT 1 FROM {joined} UNION ALL "
+                                      f"SELECT 1 FROM {cold}) tiers")
+            # Pages break ties on the primary key's output name, as page_sql does,
+            # so no row repeats or goes missing at page boundaries.
+            key = re.search(rf'\b(?:{alias}\.)?{pk}(?:\s+as\s+(\w+))?\s*(?:,|$)', list_columns or '', re.I)
+            key = key.group(1) or pk if key else pk
+            self.archive_page_sql = f"{union} ORDER BY {order + ', ' if order else ''}{key} LIMIT %s OFFSET %s"
+
+    def update_sql(self, columns):
+        return _update_sql(self.table, self.pk, columns)
+
+    def before_sql(self, columns=None):
+        """Locking read of the row's current ``columns`` (all if ``None``) for the audit log."""
+        return _before_sql(self.table, self.pk, columns)
+
+    def insert_values(self, data, computed):
+        values = []
+        for column in self.insert_columns:
+            if column in computed:
+                value = computed[column]
+            elif column in self.required:
+                value = data[column]
+            elif column in data:
+                value = data[column]
+            else:
+                default = self.defaults.get(column)
+                value = default() if callable(default) else default
+            if column in self.json_columns:
+                value = json.dumps(value) if value else None
+            values.append(value)
+        return values
+
+    def update_values(self, data):
+        """Whitelisted ``{column: value}`` updates in declaration order."""
+        updates = {}
+        for column in self.updatable:
+            value = data.get(column)
+            if value is None:
+                continue
+            updates[column] = json.dumps(value) if column in self.json_columns else value
+        return updates
+
+
+@lru_cache(maxsize=1024)
+def _update_sql(table, pk, columns):
+    set_clause = ', '.join(f"{column} = %s" for column in columns)
+    return f"UPDATE {table} SET {set_clause} WHERE {pk} = %s"
+
+
+@lru_cache(maxsize=1024)
+def _before_sql(table, pk, columns):
+    return f"SELECT {', '.join(columns) if columns else '*'} FROM {table} WHERE {pk} = %s FOR UPDATE"
+
+
+class ResourceStats:
+    """Call counts, errors and cumulative latency per resource operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, operation, elapsed_ms, failed):
+        with self._lock:
+            entry = self._stats.setdefault((name, operation), [0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += failed
+            entry[2] += elapsed_ms
+
+    def snapshot(self):
+        with self._lock:
+            return {f"{name}.{op}": {"calls": calls, "errors": errors,
+                                     "avg_ms": round(total / calls, 3) if calls else 0.0}
+                    for (name, op), (calls, errors, total) in sorted(self._stats.items())}
+
+
+stats = ResourceStats()
+
+
+def serialize_rows(description, rows, json_columns=()):
+    """Stringifies datetime/time values and decodes JSON columns in place."""
+    columns = [col[0] for col in description if col[1] in _STRINGIFIED_TYPES]
+    decode = [col[0] for col in description if col[0] in json_columns]
+    for row in rows:
+        for column in columns:
+            value = row[column]
+            if isinstance(value, (datetime, timedelta)):
+                row[column] = str(value)
+        for column in decode:
+            if row[column]:
+                try:
+                    row[column] = json.loads(row[column])
+                except json.JSONDecodeError:
+                    row[column] = []
+    return rows
+
+
+class Session:
+    """A request's connection and cursor, opened on first use.
+
+    Reads answered from the query cache therefore never connect.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self.conn = None
+        self._cursor = None
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self.conn = self._connect()
+            self._cursor = self.conn.cursor()
+        return self._cursor
+
+    def run(self, sql, params=None):
+        """Executes ``sql``; returns ``(description, rows)``."""
+        cursor = self.cursor
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        return cursor.description, rows
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        if self.conn is not None:
+            self.conn.rollback()
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+        if self.conn is not None:
+            self.conn.close()
+
+
+def _select(resource, db, cache, sql, params=None):
+    if cache is not None and resource.cached:
+        return cache.fetch(sql, params, db.run)
+    return db.run(sql, params)
+
+
+def _before_image(resource, cursor, audit, item_id, columns=None):
+    if audit is None or not audit.before_images:
+        return None
+    cursor.execute(resource.before_sql(columns), (item_id,))
+    return cursor.fetchone()
+
+
+def _on_write(resource, cursor, action, item_id, values):
+    if resource.on_write is None:
+        return {}
+    return resource.on_write(cursor, action, item_id, values) or {}
+
+
+def _page_args():
+    """``(limit, offset)`` from the query string, ``None`` for the full list; raises ``ValueError``."""
+    if 'limit' not in request.args:
+        return None
+    limit = int(request.args['limit'])
+    offset = int(request.args.get('offset', 0))
+    if limit < 1 or offset < 0:
+        raise ValueError
+    return min(limit, LIST_PAGE_MAX), offset
+
+
+def handle(resource, db, item_id, cache=None, audit=None):
+    """Runs one request against ``resource``; returns a Flask response tuple.
+
+    Successful writes invalidate cached results that read ``resource.table``
+    and are queued on ``audit`` (an ``audit.AuditLog``), if given.
+    ``resource.on_write(cursor, action, item_id, values)`` runs inside the
+    create/update transaction, before commit; a dict it returns for a create
+    is added to the response body. GETs with ``?include_archived=true`` also
+    read ``resource.archive_table``, if the resource has one. List GETs with
+    ``?limit=`` return one page, and the total row count with the first page.
+    """
+    if request.method == 'GET':
+        archived = resource.archive_table and request.args.get('include_archived') == 'true'
+        if item_id:
+            description, rows = _select(resource, db, cache, resource.detail_sql, (item_id,))
+            if not rows and archived:
+                description, rows = _select(resource, db, cache, resource.archive_detail_sql, (item_id,))
+            if rows:
+                return jsonify(serialize_rows(description, rows[:1], resource.json_columns)[0]), 200
+            return jsonify({"error": f"{resource.label} not found"}), 404
+        try:
+            page = _page_args()
+        except ValueError:
+            return jsonify({"error": "limit must be a positive and offset a non-negative integer"}), 400
+        if page is None:
+            description, rows = _select(resource, db, cache,
+                                        resource.archive_list_sql if archived else resource.list_sql)
+            return jsonify(serialize_rows(description, rows, resource.json_columns)), 200
+        description, rows = _select(resource, db, cache,
+                                    resource.archive_page_sql if archived else resource.page_sql, page)
+        total = None
+        if page[1] == 0:
+            _, counted = _select(resource, db, cache, resource.archive_count_sql if archived else resource.count_sql)
+            total = counted[0]['total']
+        return jsonify({"rows": serialize_rows(description, rows, resource.json_columns),
+                        "total": total, "limit": page[0], "offset": page[1]}), 200
+
+    if request.method == 'POST':
+        data = request.json
+        if not all(field in data for field in resource.required):
+            return jsonify({"error": "Missing required fields"}), 400
+        computed = resource.prepare_insert(data) if resource.prepare_insert else {}
+        values = resource.insert_values(data, computed)
+        cursor = db.cursor
+        cursor.execute(resource.insert_sql, values)
+        item_id = cursor.lastrowid
+        extras = _on_write(resource, cursor, 'create', item_id, dict(zip(resource.insert_columns, values)))
+        db.commit()
+        if cache is not None:
+            cache.invalidate(resource.table)
+        if audit is not None:
+            audit.record('create', resource.table, item_id, after=dict(zip(resource.insert_columns, values)))
+        body = {"message": f"{resource.label} {resource.added} successfully", "id": item_id}
+        if resource.created_extras:
+            body.update(resource.created_extras(data, computed, item_id))
+        body.update(extras)
+        return jsonify(body), 201
+
+    if request.method == 'PUT':
+        data = request.json
+        if not data:
+            return jsonify({"error": "No data provided for update"}), 400
+        updates = resource.update_values(data)
+        if not updates:
+            return jsonify({"error": "No valid data provided for update"}), 400
+        cursor = db.cursor
+        before = _before_image(resource, cursor, audit, item_id, tuple(updates))
+        cursor.execute(resource.update_sql(tuple(updates)), (*updates.values(), item_id))
+        found = cursor.rowcount > 0
+        if found:
+            _on_write(resource, cursor, 'update', item_id, updates)
+        db.commit()
+        if found:
+            if cache is not None:
+                cache.invalidate(resource.table)
+            if audit is not None:
+                audit.record('update', resource.table, item_id, before, updates)
+            return jsonify({"message": f"{resource.label} updated successfully"}), 200
+        return jsonify({"error": f"{resource.label} not found"}), 404
+
+    cursor = db.cursor
+    before = _before_image(resource, cursor, audit, item_id)
+    cursor.execute(resource.delete_sql, (item_id,))
+    db.commit()
+    if cursor.rowcount > 0:
+        if cache is not None:
+            cache.invalidate(resource.table)
+        if audit is not None:
+            audit.record('delete', resource.table, item_id, before)
+        return jsonify({"message": f"{resource.label} {resource.deleted} successfully"}), 200
+    return jsonify({"error": f"{resource.label} not found"}), 404
+
+
+def register_resource(app, resource, get_db_connection, cache=None, audit=None):
+    """Adds the collection and item routes for ``resource`` to ``app``.
+
+    ``cache`` is the ``query_cache.QueryCache`` used for resources declared
+    with ``cached=True``; writes through any resource invalidate it and are
+    recorded on ``audit``.
+    """
+
+    def view(**kwargs):
+        item_id = kwargs.get(resource.pk)
+        operation = request.method.lower() if request.method != 'GET' else ('get' if item_id else 'list')
+        started = time.perf_counter()
+        failed = True
+        db = Session(get_db_connection)
+        try:
+            response = handle(resource, db, item_id, cache, audit)
+            failed = response[1] >= 500
+            return response
+        except CircuitOpenError:
+            raise
+        except pymysql.Error as e:
+            db.rollback()
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            db.close()
+            stats.record(resource.name, operation, (time.perf_counter() - started) * 1000, failed)
+
+    view.__name__ = resource.endpoint
+    view = coalesced(view)
+    app.add_url_rule(resource.url, resource.endpoint, view, methods=['GET', 'POST'])
+    app.add_url_rule(f"{resource.url}/<int:{resource.pk}>", resource.endpoint, view,
+                     methods=['GET', 'PUT', 'DELETE'])
+    return view
@@ -0,0 +1,552 @@
+"""Waitlist auto-scheduler: assigns a batch of appointment requests at once.
+
+``POST /api/appointments/auto-schedule`` takes up to
+``SCHEDULER_MAX_BATCH`` requests, each for a patient and a doctor, a
+specialization or a department, with a preferred window, duration and
+priority. ``POST /api/doctors/<id>/reschedule`` moves a doctor's booked day
+to colleagues of the same specialization the same way.
+
+Assignment is greedy. Requests leave a priority queue by priority, then
+deadline (earliest ``latest`` first), then ``earliest``. Each gets the
+least-loaded eligible doctor (a heap of doctors per specialization,
+department or doctor, keyed by booked minutes in the window) that has a free
+slot, at that doctor's earliest slot. Free slots come from the doctor's
+``availability`` minus their booked appointments and the patient's own, on
+``SCHEDULER_SLOT_MINUTES`` boundaries, looked up with bisection in merged
+interval lists. Nobody is ever double-booked, and a batch of n requests over
+d doctors costs about O(n log d) plus the slot searches.
+
+The batch runs in one transaction: eligible doctors are locked
+(``SELECT ... FOR UPDATE`` in id order, so concurrent batches queue instead
+of double-booking), their appointments in the window are read, and every
+assignment is inserted (or, when rescheduling, updated) before one commit.
+``dry_run`` returns the plan without writing. ``flask benchmark-scheduler``
+times the assignment on synthetic data.
+
+``availability`` is free text; JSON such as ``{"Mon": "09:00-13:00,
+14:00-17:00"}`` or lines such as ``Mon-Fri 09:00-17:00`` are understood, and
+anything else means ``SCHEDULER_DEFAULT_HOURS``.
+"""
+import bisect
+import heapq
+import json
+import os
+import random
+import re
+import time
+from datetime import date, datetime, timedelta
+
+import click
+import pymysql
+from flask import jsonify, request
+
+SCHEDULER_SLOT_MINUTES = int(os.getenv('SCHEDULER_SLOT_MINUTES', '15'))
+SCHEDULER_MAX_BATCH = int(os.getenv('SCHEDULER_MAX_BATCH', '5000'))
+SCHEDULER_DEFAULT_WINDOW_DAYS = int(os.getenv('SCHEDULER_DEFAULT_WINDOW_DAYS', '7'))
+SCHEDULER_DEFAULT_HOURS = os.getenv('SCHEDULER_DEFAULT_HOURS', 'Mon-Fri 09:00-17:00')
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+_DAY_RANGE = re.compile(r'\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*(?:\s*-\s*(mon|tue|wed|thu|fri|sat|sun)[a-z]*)?',
+                        re.IGNORECASE)
+_HOURS = re.compile(r'(\d{1,2})(?::(\d{2}))?\s*-\s*(\d{1,2})(?::(\d{2}))?')
+
+
+class ScheduleError(Exception):
+    pass
+
+
+# --- Availability ---
+def _day_set(text):
+    days = set()
+    for first, last in _DAY_RANGE.findall(text):
+        start = DAYS.index(first[:3].lower())
+        end = DAYS.index(last[:3].lower()) if last else start
+        days.update(range(start, end + 1) if start <= end else list(range(start, 7)) + list(range(end + 1)))
+    return days
+
+
+def _hour_ranges(text):
+    ranges = []
+    for h1, m1, h2, m2 in _HOURS.findall(text):
+        start, end = int(h1) * 60 + int(m1 or 0), int(h2) * 60 + int(m2 or 0)
+        if start < end <= 24 * 60:
+            ranges.append((start, end))
+    return sorted(ranges)
+
+
+def parse_availability(text):
+    """``{weekday: [(start_minute, end_minute), ...]}`` from a doctor's ``availability``."""
+    hours = {}
+    text = (text or '').strip()
+    try:
+        spec = json.loads(text) if text.startswith('{') else None
+    except json.JSONDecodeError:
+        spec = None
+    if isinstance(spec, dict):
+        for days, ranges in spec.items():
+            ranges = ', '.join(ranges) if isinstance(ranges, list) else str(ranges)
+            for day in _day_set(days):
+                hours.setdefault(day, []).extend(_hour_ranges(ranges))
+    else:
+        for line in re.split(r'[;\n]', text):
+            for day in _day_set(line):
+                hours.setdefault(day, []).extend(_hour_ranges(line))
+    hours = {day: sorted(ranges) for day, ranges in hours.items() if ranges}
+    if not hours and text != SCHEDULER_DEFAULT_HOURS:
+        return parse_availability(SCHEDULER_DEFAULT_HOURS)
+    return hours
+
+
+# --- Calendars ---
+class Timeline:
+    """Booked intervals per day, merged and sorted for bisection."""
+
+    __slots__ = ('days',)
+
+    def __init__(self):
+        self.days = {}
+
+    def conflict(self, day, start, end):
+        """End of a booking overlapping ``[start, end)`` on ``day``, or ``None``."""
+        entry = self.days.get(day)
+        if not entry:
+            return None
+        starts, ends = entry
+        i = bisect.bisect_right(starts, start) - 1
+        if i >= 0 and ends[i] > start:
+            return ends[i]
+        if i + 1 < len(starts) and starts[i + 1] < end:
+            return ends[i + 1]
+        return None
+
+    def add(self, day, start, end):
+        starts, ends = self.days.setdefault(day, ([], []))
+        i = bisect.bisect_left(starts, start)
+        # Merge with overlapping or touching neighbours.
+        while i > 0 and ends[i - 1] >= start:
+            i -= 1
+            start = min(start, starts[i])
+            end = max(end, ends[i])
+            del starts[i], ends[i]
+        while i < len(starts) and starts[i] <= end:
+            end = max(end, ends[i])
+            del starts[i], ends[i]
+        starts.insert(i, start)
+        ends.insert(i, end)
+
+
+class Doctor:
+    __slots__ = ('doctor_id', 'specialization', 'department_id', 'hours', 'booked', 'load')
+
+    def __init__(self, doctor_id, specialization, department_id, hours):
+        self.doctor_id = doctor_id
+        self.specialization = specialization
+        self.department_id = department_id
+        self.hours = hours
+        self.booked = Timeline()
+        self.load = 0
+
+
+class Request:
+    """One appointment to place; ``appointment_id`` is set when moving an existing one."""
+
+    __slots__ = ('index', 'patient_id', 'doctor_id', 'specialization', 'department_id', 'earliest', 'latest',
+                 'duration', 'priority', 'reason', 'appointment_id', 'exclude_doctor_id')
+
+    def __init__(self, index, patient_id, earliest, latest, duration=30, priority=0, doctor_id=None,
+                 specialization=None, department_id=None, reason=None, appointment_id=None, exclude_doctor_id=None):
+        self.index = index
+        self.patient_id = patient_id
+        self.doctor_id = doctor_id
+        self.specialization = specialization
+        self.department_id = department_id
+        self.earliest = earliest
+        self.latest = latest
+        self.duration = duration
+        self.priority = priority
+        self.reason = reason
+        self.appointment_id = appointment_id
+        self.exclude_doctor_id = exclude_doctor_id
+
+    def group(self):
+        if self.doctor_id is not None:
+            return ('doctor', self.doctor_id)
+        if self.specialization is not None:
+            return ('specialization', self.specialization.lower())
+        return ('department', self.department_id)
+
+
+def _minutes(moment):
+    return moment.hour * 60 + moment.minute
+
+
+def earliest_slot(doctor, patient, request, slot=SCHEDULER_SLOT_MINUTES):
+    """``(day, start_minute)`` of the doctor's first slot free for both, or ``None``."""
+    day = request.earliest.date()
+    last_day = request.latest.date()
+    duration = request.duration
+    while day <= last_day:
+        for open_at, close_at in doctor.hours.get(day.weekday(), ()):
+            lo = max(open_at, _minutes(request.earliest)) if day == request.earliest.date() else open_at
+            hi = min(close_at, _minutes(request.latest)) if day == last_day else close_at
+            t = -(-lo // slot) * slot
+            while t + duration <= hi:
+                busy_until = doctor.booked.conflict(day, t, t + duration)
+                if busy_until is None:
+                    busy_until = patient.conflict(day, t, t + duration)
+                if busy_until is None:
+                    return day, t
+                t = -(-busy_until // slot) * slot
+        day += timedelta(days=1)
+    return None
+
+
+def assign(requests, doctors, patients, slot=SCHEDULER_SLOT_MINUTES):
+    """Places ``requests``; returns ``(assignments, unscheduled)``.
+
+    ``doctors`` maps ids to ``Doctor`` (booked and loaded with existing
+    appointments), ``patients`` maps ids to their ``Timeline``; both are
+    updated with the new bookings. ``assignments`` holds
+    ``(request, doctor_id, day, start_minute)``.
+    """
+    groups = {}
+    for doctor in doctors.values():
+        for key in (('doctor', doctor.doctor_id), ('specialization', (doctor.specialization or '').lower()),
+                    ('department', doctor.department_id)):
+            groups.setdefault(key, []).append(doctor)
+    heaps = {key: [(doctor.load, doctor.doctor_id) for doctor in members] for key, members in groups.items()}
+    for heap in heaps.values():
+        heapq.heapify(heap)
+
+    queue = [(-r.priority, r.latest, r.earliest, r.index, r) for r in requests]
+    heapq.heapify(queue)
+    assignments = []
+    unscheduled = []
+    while queue:
+        request = heapq.heappop(queue)[-1]
+        heap = heaps.get(request.group())
+        if not heap:
+            unscheduled.append((request, "No doctor matches the request"))
+            continue
+        patient = patients.setdefault(request.patient_id, Timeline())
+        tried = []
+        placed = None
+        while heap:
+            load, doctor_id = heapq.heappop(heap)
+            doctor = doctors[doctor_id]
+            if load != doctor.load:
+                heapq.heappush(heap, (doctor.load, doctor_id))  # Stale entry
+                continue
+            tried.append((load, doctor_id))
+            if doctor_id == request.exclude_doctor_id:
+                continue
+            found = earliest_slot(doctor, patient, request, slot)
+            if found is not None:
+                placed = doctor, found
+                break
+        for entry in tried:
+            if placed is None or entry[1] != placed[0].doctor_id:
+                heapq.heappush(heap, entry)
+        if placed is None:
+            unscheduled.append((request, "No free slot in the requested window"))
+            continue
+        doctor, (day, start) = placed
+        doctor.booked.add(day, start, start + request.duration)
+        patient.add(day, start, start + request.duration)
+        doctor.load += request.duration
+        heapq.heappush(heap, (doctor.load, doctor.doctor_id))
+        assignments.append((request, doctor.doctor_id, day, start))
+    return assignments, unscheduled
+
+
+# --- Requests and persistence ---
+def _parse_moment(value, end_of_day=False):
+    if not isinstance(value, str):
+        raise TypeError(f"expected a date string, got {type(value).__name__}")
+    if len(value) == 10:
+        moment = datetime.strptime(value, '%Y-%m-%d')
+        return moment.replace(hour=23, minute=59) if end_of_day else moment
+    return datetime.strptime(value.replace('T', ' ')[:16], '%Y-%m-%d %H:%M')
+
+
+def _int_field(data, key, default, low=None, high=None):
+    value = data.get(key, default)
+    try:
+        if isinstance(value, bool):
+            raise TypeError(key)
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ScheduleError(f"{key} must be an integer")
+    if low is not None and not low <= value <= high:
+        raise ScheduleError(f"{key} must be {low} to {high}")
+    return value
+
+
+def parse_request(index, data, now=None):
+    """A ``Request`` from one JSON item; raises ``ScheduleError``."""
+    if not isinstance(data, dict) or not isinstance(data.get('patient_id'), int):
+        raise ScheduleError("patient_id is required")
+    targets = [key for key in ('doctor_id', 'specialization', 'department_id') if data.get(key) is not None]
+    if len(targets) != 1:
+        raise ScheduleError("give exactly one of doctor_id, specialization or department_id")
+    try:
+        earliest = _parse_moment(data['earliest']) if data.get('earliest') else (now or datetime.now())
+        latest = (_parse_moment(data['latest'], end_of_day=True) if data.get('latest')
+                  else earliest + timedelta(days=SCHEDULER_DEFAULT_WINDOW_DAYS))
+    except (TypeError, ValueError):
+        raise ScheduleError("earliest and latest must be 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM'")
+    duration = data.get('duration', 30)
+    if not isinstance(duration, int) or not 5 <= duration <= 480:
+        raise ScheduleError("duration must be 5 to 480 minutes")
+    if latest <= earliest:
+        raise ScheduleError("latest must be after earliest")
+    priority = _int_field(data, 'priority', 0)
+    return Request(index, data['patient_id'], earliest, latest, duration, priority,
+                   doctor_id=data.get('doctor_id'), specialization=data.get('specialization'),
+                   department_id=data.get('department_id'), reason=data.get('reason'))
+
+
+def _in_list(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def load_calendars(cursor, requests, lock=True):
+    """Eligible doctors (locked unless ``lock`` is false) and their and the patients' bookings."""
+    specializations = sorted({r.specialization for r in requests if r.specialization is not None})
+    departments = sorted({r.department_id for r in requests if r.department_id is not None})
+    doctor_ids = sorted({r.doctor_id for r in requests if r.doctor_id is not None})
+    conditions, params = [], []
+    for column, values in (('specialization', specializations), ('department_id', departments),
+                           ('doctor_id', doctor_ids)):
+        if values:
+            conditions.append(f"{column} IN ({_in_list(values)})")
+            params.extend(values)
+    cursor.execute(f"""
+        SELECT doctor_id, specialization, department_id, availability FROM doctor
+        WHERE {' OR '.join(conditions)} ORDER BY doctor_id {'FOR UPDATE' if lock else ''}
+    """, params)
+    doctors = {row['doctor_id']: Doctor(row['doctor_id'], row['specialization'], row['department_id'],
+                                        parse_availability(row['availability']))
+               for row in cursor.fetchall()}
+    patients = {}
+    if not doctors:
+        return doctors, patients
+
+    first = min(r.earliest for r in requests).date()
+    last = max(r.latest for r in requests).date()
+    patient_ids = sorted({r.patient_id for r in requests})
+    moving = {r.appointment_id for r in requests if r.appointment_id is not None}
+    cursor.execute(f"""
+        SELECT appointment_id, patient_id, doctor_id, date, time, duration FROM appointment
+        WHERE status = 'Scheduled' AND date BETWEEN %s AND %s
+          AND (doctor_id IN ({_in_list(doctors)}) OR patient_id IN ({_in_list(patient_ids)}))
+    """, (first, last, *doctors, *patient_ids))
+    for row in cursor.fetchall():
+        if row['appointment_id'] in moving:
+            continue
+        start = int(row['time'].total_seconds() // 60)
+        end = start + (row['duration'] or 30)
+        doctor = doctors.get(row['doctor_id'])
+        if doctor is not None:
+            doctor.booked.add(row['date'], start, end)
+            doctor.load += end - start
+        if row['patient_id'] in patient_ids:
+            patients.setdefault(row['patient_id'], Timeline()).add(row['date'], start, end)
+    return doctors, patients
+
+
+def _result(request, doctor_id, day, start, appointment_id, appointment_number=None):
+    result = {"index": request.index, "appointment_id": appointment_id, "patient_id": request.patient_id,
+              "doctor_id": doctor_id, "date": day.isoformat(), "time": f"{start // 60:02d}:{start % 60:02d}",
+              "duration": request.duration}
+    if appointment_number is not None:
+        result["appointment_number"] = appointment_number
+    return result
+
+
+def schedule_batch(conn, requests, dry_run=False, numbers=None):
+    """Assigns and books ``requests`` in one transaction; returns ``(scheduled, unscheduled)``.
+
+    New appointments get their number from ``numbers`` (a ``SequenceAllocator``) when given.
+    """
+    with conn.cursor() as cursor:
+        try:
+            doctors, patients = load_calendars(cursor, requests, lock=not dry_run)
+            assignments, unscheduled = assign(requests, doctors, patients)
+            scheduled = []
+            for request, doctor_id, day, start in sorted(assignments, key=lambda a: a[0].index):
+                time_of_day = f"{start // 60:02d}:{start % 60:02d}:00"
+                appointment_id, appointment_number = request.appointment_id, None
+                if dry_run:
+                    pass
+                elif appointment_id is not None:
+                    # Read before this transaction: skip it if it was cancelled or moved since.
+                    if not cursor.execute("UPDATE appointment SET doctor_id = %s, date = %s, time = %s "
+                                          "WHERE appointment_id = %s AND doctor_id = %s AND status = 'Scheduled'",
+                                          (doctor_id, day, time_of_day, appointment_id, request.exclude_doctor_id)):
+                        unscheduled.append((request, "Appointment was changed while rescheduling"))
+                        continue
+                else:
+                    if numbers is not None:
+                        appointment_number = numbers.next_number('APT')
+                    cursor.execute("""
+                        INSERT INTO appointment (appointment_number, patient_id, doctor_id, date, time, duration,
+                                                 reason, status)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, 'Scheduled')
+                    """, (appointment_number, request.patient_id, doctor_id, day, time_of_day, request.duration,
+                          request.reason))
+                    appointment_id = cursor.lastrowid
+                scheduled.append(_result(request, doctor_id, day, start, appointment_id, appointment_number))
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return scheduled, [{"index": request.index, "patient_id": request.patient_id, "reason": reason}
+                       for request, reason in sorted(unscheduled, key=lambda u: u[0].index)]
+
+
+def init_scheduler(app, get_db_connection, numbers=None, on_change=None, audit=None, lookup_doctor=None):
+    """Adds the batch scheduling routes and ``flask benchmark-scheduler``.
+
+    ``lookup_doctor(doctor_id)`` may answer the doctor's row from a snapshot;
+    when it returns ``None`` the doctor is read from the database.
+    """
+
+    def run(requests, dry_run):
+        conn = get_db_connection()
+        try:
+            scheduled, unscheduled = schedule_batch(conn, requests, dry_run, numbers)
+        finally:
+            conn.close()
+        if not dry_run and scheduled:
+            if on_change is not None:
+                on_change()
+            if audit is not None:
+                moved = {r.appointment_id for r in requests if r.appointment_id is not None}
+                for item in scheduled:
+                    action = 'update' if item['appointment_id'] in moved else 'create'
+                    audit.record(action, 'appointment', item['appointment_id'], after=item)
+        return scheduled, unscheduled
+
+    @app.route('/api/appointments/auto-schedule', methods=['POST'])
+    def auto_schedule_appointments():
+        data = request.get_json(silent=True) or {}
+        items = data.get('requests') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "requests must be a non-empty list"}), 400
+        if len(items) > SCHEDULER_MAX_BATCH:
+            return jsonify({"error": f"At most {SCHEDULER_MAX_BATCH} requests per batch"}), 400
+        requests, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                requests.append(parse_request(index, item))
+            except ScheduleError as e:
+                errors.append({"index": index, "error": str(e)})
+        if errors:
+            return jsonify({"error": "Invalid requests", "details": errors}), 400
+        dry_run = bool(data.get('dry_run'))
+        try:
+            scheduled, unscheduled = run(requests, dry_run)
+        except pymysql.Error as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        return jsonify({"dry_run": dry_run, "scheduled": scheduled, "unscheduled": unscheduled}), \
+            200 if dry_run else 201
+
+    @app.route('/api/doctors/<int:doctor_id>/reschedule', methods=['POST'])
+    def reschedule_doctor_day(doctor_id):
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request body must be an object"}), 400
+        try:
+            day = datetime.strptime(data.get('date', ''), '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return jsonify({"error": "date must be in YYYY-MM-DD format"}), 400
+        try:
+            days = _int_field(data, 'days', SCHEDULER_DEFAULT_WINDOW_DAYS, 0, 365)
+        except ScheduleError as e:
+            return jsonify({"error": str(e)}), 400
+        doctor = lookup_doctor(doctor_id) if lookup_doctor is not None else None
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            if doctor is None:
+                cursor.execute("SELECT specialization FROM doctor WHERE doctor_id = %s", (doctor_id,))
+                doctor = cursor.fetchone()
+            if doctor is None:
+                return jsonify({"error": "Doctor not found"}), 404
+            cursor.execute("""
+                SELECT appointment_id, patient_id, time, duration, reason FROM appointment
+                WHERE doctor_id = %s AND date = %s AND status = 'Scheduled' ORDER BY time
+            """, (doctor_id, day))
+            booked = cursor.fetchall()
+        except pymysql.Error as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        finally:
+            cursor.close()
+            conn.close()
+        requests = []
+        for index, row in enumerate(booked):
+            start = datetime.combine(day, datetime.min.time()) + row['time']
+            # Same time or later, earliest-booked patients first.
+            requests.append(Request(index, row['patient_id'], start,
+                                    datetime.combine(day + timedelta(days=days), datetime.max.time()),
+                                    row['duration'] or 30, priority=len(booked) - index,
+                                    specialization=doctor['specialization'], reason=row['reason'],
+                                    appointment_id=row['appointment_id'], exclude_doctor_id=doctor_id))
+        if not requests:
+            return jsonify({"scheduled": [], "unscheduled": []}), 200
+        try:
+            scheduled, unscheduled = run(requests, bool(data.get('dry_run')))
+        except pymysql.Error as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        for item in unscheduled:
+            item['appointment_id'] = requests[item['index']].appointment_id
+        return jsonify({"scheduled": scheduled, "unscheduled": unscheduled}), 200
+
+    @app.cli.command('benchmark-scheduler')
+    @click.option('--requests', 'count', default=5000, show_default=True)
+    @click.option('--doctors', default=100, show_default=True)
+    @click.option('--specializations', default=10, show_default=True)
+    @click.option('--days', default=14, show_default=True)
+    @click.option('--seed', default=1, show_default=True)
+    def benchmark_scheduler(count, doctors, specializations, days, seed):
+        """Time the assignment of synthetic requests (no database)."""
+        rng = random.Random(seed)
+        start_day = date.today() + timedelta(days=1)
+        calendar = {}
+        for doctor_id in range(1, doctors + 1):
+            doctor = Doctor(doctor_id, f"spec-{doctor_id % specializations}", None,
+                            parse_availability(rng.choice(['Mon-Fri 09:00-17:00', 'Mon-Sat 08:00-12:00, 13:00-16:00',
+                                                           'Tue-Sat 10:00-18:00'])))
+            for _ in range(rng.randint(0, 20)):
+                day = start_day + timedelta(days=rng.randrange(days))
+                start = rng.randrange(9 * 60, 16 * 60, SCHEDULER_SLOT_MINUTES)
+                doctor.booked.add(day, start, start + 30)
+                doctor.load += 30
+            calendar[doctor_id] = doctor
+        requests = []
+        for index in range(count):
+            earliest = datetime.combine(start_day + timedelta(days=rng.randrange(days)), datetime.min.time())
+            requests.append(Request(index, rng.randint(1, count // 2 or 1), earliest,
+                                    earliest + timedelta(days=rng.randint(1, 5)), rng.choice([15, 30, 45, 60]),
+                                    priority=rng.randint(0, 3),
+                                    specialization=f"spec-{rng.randrange(specializations)}"))
+
+        started = time.perf_counter()
+        assignments, unscheduled = assign(requests, calendar, {})
+        elapsed = time.perf_counter() - started
+
+        overlaps = 0
+        by_doctor = {}
+        for request, doctor_id, day, start in assignments:
+            by_doctor.setdefault((doctor_id, day), []).append((start, start + request.duration))
+        for slots in by_doctor.values():
+            slots.sort()
+            overlaps += sum(1 for a, b in zip(slots, slots[1:]) if b[0] < a[1])
+        loads = sorted(doctor.load for doctor in calendar.values())
+        click.echo(f"{len(assignments)} scheduled, {len(unscheduled)} unscheduled in {elapsed * 1000:.0f} ms "
+                   f"({elapsed / max(1, count) * 1e6:.0f} µs per request); {overlaps} overlaps; "
+                   f"booked minutes per doctor min/median/max {loads[0]}/{loads[len(loads) // 2]}/{loads[-1]}.")
@@ -0,0 +1,211 @@
+"""Invoice and appointment numbers from per-prefix, per-day sequences.
+
+Numbers look like ``INV-20250131-00042``: a prefix, the day and a counter
+that restarts every day. The counters are rows of ``number_sequence``, one
+per prefix and day. A worker reserves ``SEQUENCE_BLOCK_SIZE`` numbers at a
+time with one atomic upsert, committed at once on its own primary
+connection, and hands them out from memory. Most allocations therefore need
+no database round trip, and concurrent inserts never wait on each other's
+transactions the way ``SELECT MAX() + 1`` would make them.
+
+Blocks never overlap, so numbers are unique across threads, workers and
+hosts; ``billing.invoice_number`` and ``appointment.appointment_number`` are
+UNIQUE as well. A worker's numbers
+increase, but across workers they are only ordered by block. Numbers are
+lost, leaving gaps, when a worker exits or the day ends with part of a
+block unused, or when the insert that took one fails. A forked worker drops
+the blocks its parent had reserved.
+
+Run ``flask init-sequences`` once on an existing database.
+``flask bench-sequences`` inserts numbered rows from many threads and
+allocators into a scratch table and reports the rate and any duplicates.
+"""
+import os
+import threading
+import time
+from datetime import date
+
+import click
+import pymysql
+from flask import jsonify
+
+from tenancy import current_tenant_id, use_tenant
+
+SEQUENCE_BLOCK_SIZE = int(os.getenv('SEQUENCE_BLOCK_SIZE', '50'))
+
+NUMBER_SEQUENCE_DDL = """
+CREATE TABLE IF NOT EXISTS number_sequence (
+    prefix VARCHAR(8) NOT NULL,
+    day DATE NOT NULL,
+    next_value INT UNSIGNED NOT NULL,
+    PRIMARY KEY (prefix, day)
+)
+"""
+APPOINTMENT_NUMBER_DDL = "ALTER TABLE {table} ADD COLUMN appointment_number VARCHAR(20) UNIQUE AFTER appointment_id"
+
+# Creates the day's counter or advances it by a block. LAST_INSERT_ID(expr) hands
+# the new next_value back to this connection, so the reservation is one statement.
+_RESERVE = """
+    INSERT INTO number_sequence (prefix, day, next_value) VALUES (%s, %s, LAST_INSERT_ID(1 + %s))
+    ON DUPLICATE KEY UPDATE next_value = LAST_INSERT_ID(next_value + %s)
+"""
+
+
+def format_number(prefix, day, value):
+    return f"{prefix}-{day:%Y%m%d}-{value:05d}"
+
+
+class SequenceAllocator:
+    """Hands out numbers from blocks reserved per hospital, prefix and day."""
+
+    def __init__(self, connect_primary, block_size=SEQUENCE_BLOCK_SIZE):
+        self.connect = connect_primary
+        self.block_size = block_size
+        self._lock = threading.Lock()  # Guards the dicts and stats, never held across a round trip
+        self._key_locks = {}  # (tenant, prefix) -> lock held while that block is read or refilled
+        self._blocks = {}  # (tenant, prefix) -> [day, next value, end of block]
+        self._pid = os.getpid()
+        self.stats = {"allocated": 0, "blocks": 0}
+
+    def _reserve(self, prefix, day):
+        """Reserves the next block; returns ``(first, end)``, end exclusive."""
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(_RESERVE, (prefix, day, self.block_size, self.block_size))
+                cursor.execute("SELECT LAST_INSERT_ID() as end")
+                end = cursor.fetchone()['end']
+            conn.commit()
+        finally:
+            conn.close()
+        return end - self.block_size, end
+
+    def next_value(self, prefix, day=None):
+        day = day or date.today()
+        key = (current_tenant_id(), prefix)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._blocks.clear()  # Reserved before fork: the parent may hand them out too
+                self._key_locks.clear()
+                self._pid = os.getpid()
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            block = self._blocks.get(key)
+            reserved = block is None or block[0] != day or block[1] >= block[2]
+            if reserved:
+                # Only this hospital's threads for this prefix wait for the round trip
+                block = [day, *self._reserve(prefix, day)]
+            value = block[1]
+            block[1] += 1
+            with self._lock:
+                if reserved:
+                    self._blocks[key] = block
+                    self.stats["blocks"] += 1
+                self.stats["allocated"] += 1
+            return value
+
+    def next_number(self, prefix, day=None):
+        """The next ``PREFIX-YYYYMMDD-NNNNN`` number of the current hospital."""
+        day = day or date.today()
+        return format_number(prefix, day, self.next_value(prefix, day))
+
+
+def _bench_thread(allocator, connect_primary, tenant_id, count, results):
+    inserted = duplicates = 0
+    with use_tenant(tenant_id):
+        conn = connect_primary()
+        try:
+            with conn.cursor() as cursor:
+                for _ in range(count):
+                    try:
+                        cursor.execute("INSERT INTO number_sequence_bench (number) VALUES (%s)",
+                                       (allocator.next_number('BNC'),))
+                        conn.commit()
+                        inserted += 1
+                    except pymysql.IntegrityError:
+                        conn.rollback()
+                        duplicates += 1
+        finally:
+            conn.close()
+    results.append((inserted, duplicates))
+
+
+def init_sequences(app, connect_primary):
+    """Creates the worker's allocator and adds its metrics route and CLI commands."""
+    allocator = SequenceAllocator(connect_primary)
+
+    @app.route('/api/metrics/sequences', methods=['GET'])
+    def sequence_metrics():
+        return jsonify({"worker": allocator.stats, "block_size": allocator.block_size}), 200
+
+    @app.cli.command('init-sequences')
+    def init_sequence_table():
+        """Create number_sequence and add appointment_number to the appointment tables."""
+        conn = connect_primary()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(NUMBER_SEQUENCE_DDL)
+                for table in ('appointment', 'appointment_archive'):
+                    cursor.execute("""SELECT COUNT(*) as n, SUM(column_name = 'appointment_number') as numbered
+                                      FROM information_schema.columns
+                                      WHERE table_schema = DATABASE() AND table_name = %s""", (table,))
+                    row = cursor.fetchone()
+                    if row['n'] and not row['numbered']:
+                        cursor.execute(APPOINTMENT_NUMBER_DDL.format(table=table))
+            conn.commit()
+        finally:
+            conn.close()
+        click.echo("Sequence table ready.")
+
+    @app.cli.command('bench-sequences')
+    @click.option('--workers', default=4, show_default=True, help='Allocators, each standing in for a worker.')
+    @click.option('--threads', default=32, show_default=True, help='Inserting threads, spread over the allocators.')
+    @click.option('--inserts', default=20000, show_default=True, help='Rows to insert in total.')
+    @click.option('--block-size', default=SEQUENCE_BLOCK_SIZE, show_default=True)
+    def bench_sequences(workers, threads, inserts, block_size):
+        """Insert numbered rows concurrently and check that every number is unique."""
+        conn = connect_primary()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(NUMBER_SEQUENCE_DDL)
+                cursor.execute("DROP TABLE IF EXISTS number_sequence_bench")
+                cursor.execute("CREATE TABLE number_sequence_bench (number VARCHAR(20) PRIMARY KEY)")
+                cursor.execute("DELETE FROM number_sequence WHERE prefix = 'BNC'")
+            conn.commit()
+
+            allocators = [SequenceAllocator(connect_primary, block_size) for _ in range(workers)]
+            results = []
+            per_thread, extra = divmod(inserts, threads)
+            pool = [threading.Thread(target=_bench_thread,
+                                     args=(allocators[i % workers], connect_primary, current_tenant_id(),
+                                           per_thread + (i < extra), results))
+                    for i in range(threads)]
+            started = time.monotonic()
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+            elapsed = time.monotonic() - started
+
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) as n, COUNT(DISTINCT number) as distinct_n FROM number_sequence_bench")
+                counted = cursor.fetchone()
+                cursor.execute("DROP TABLE number_sequence_bench")
+                cursor.execute("DELETE FROM number_sequence WHERE prefix = 'BNC'")
+            conn.commit()
+        finally:
+            conn.close()
+
+        inserted = sum(ok for ok, _ in results)
+        duplicates = sum(dup for _, dup in results)
+        blocks = sum(allocator.stats["blocks"] for allocator in allocators)
+        click.echo(f"{inserted} rows in {elapsed:.2f}s ({inserted / elapsed:.0f}/s) from {threads} threads "
+                   f"over {workers} allocators; {blocks} block reservations for {inserts} numbers.")
+        click.echo(f"Rows stored: {counted['n']}, distinct numbers: {counted['distinct_n']}, "
+                   f"duplicate-key failures: {duplicates}.")
+        if len(results) < threads:
+            raise click.ClickException(f"{threads - len(results)} threads failed; see the errors above.")
+        if duplicates or counted['n'] != counted['distinct_n']:
+            raise click.ClickException("Sequence numbers were not unique.")
+
+    return allocator
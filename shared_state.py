@@ -0,0 +1,133 @@
+"""File-backed shared memory shared by every gunicorn worker on a host.
+
+Each region is a fixed-size file under ``HMS_RUNTIME_DIR`` mapped into every
+worker with ``mmap``. Writers serialize with ``flock`` on the file (between
+processes) plus a ``threading.Lock`` (between threads of one worker, since
+``flock`` does not exclude threads sharing a file description).
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+
+RUNTIME_DIR = os.getenv('HMS_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), 'hms-runtime')
+
+
+def runtime_path(name):
+    """Returns the path of a runtime file, creating the runtime directory."""
+    os.makedirs(RUNTIME_DIR, exist_ok=True)
+    return os.path.join(RUNTIME_DIR, name)
+
+
+def key_hash(key):
+    """Stable non-zero 64-bit hash of ``key`` for indexing shared tables.
+
+    Python's ``hash()`` is salted per process, so it cannot be used here.
+    """
+    return struct.unpack('<Q', hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest())[0] or 1
+
+
+class SharedRegion:
+    """A zero-initialized, cross-process memory region of ``size`` bytes."""
+
+    def __init__(self, name, size):
+        self.path = runtime_path(name)
+        self.size = size
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._open()
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._buf = mmap.mmap(fd, self.size)
+        self._pid = os.getpid()
+
+    def _ensure_open(self):
+        # A region created before gunicorn forks keeps working in the children,
+        # but each process needs its own file description for flock to exclude.
+        if self._pid != os.getpid():
+            self._open()
+
+    @property
+    def buf(self):
+        """The mapped bytes, for lock-free reads of word-sized values."""
+        if self._pid != os.getpid():
+            with self._thread_lock:
+                self._ensure_open()
+        return self._buf
+
+    @contextmanager
+    def locked(self):
+        """Holds the region exclusively across threads and processes."""
+        with self._thread_lock:
+            self._ensure_open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._buf
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class SlotSemaphore:
+    """A counting semaphore across processes built from ``flock``-ed slot files.
+
+    The kernel drops a dead worker's locks, so a crashed or killed worker can
+    never leak capacity the way a shared counter would.
+    """
+
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_open(self):
+        if self._pid == os.getpid():
+            return
+        self._fds = [os.open(runtime_path(f'{self.name}.{i}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+                     for i in range(self.slots)]
+        self._held = set()
+        self._pid = os.getpid()
+
+    def try_acquire(self):
+        """Takes a free slot without blocking; returns its number or ``None``."""
+        with self._lock:
+            self._ensure_open()
+            start = random.randrange(self.slots)
+            for offset in range(self.slots):
+                slot = (start + offset) % self.slots
+                # flock is per file description, so threads of this process
+                # must skip the slots their siblings already hold.
+                if slot in self._held:
+                    continue
+                try:
+                    fcntl.flock(self._fds[slot], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self._held.add(slot)
+                return slot
+        return None
+
+    def release(self, slot):
+        with self._lock:
+            if self._pid != os.getpid() or slot not in self._held:
+                return
+            self._held.discard(slot)
+            fcntl.flock(self._fds[slot], fcntl.LOCK_UN)
+
+    def held_locally(self):
+        """Number of slots held by this process."""
+        with self._lock:
+            return len(self._held) if self._pid == os.getpid() else 0
@@ -0,0 +1,164 @@
+// Search filtering and chart aggregation over the cached tables, off the main thread.
+//
+// Messages from script.js:
+//   { op: 'load', name, rows, fields }  - replaces a dataset; `fields` are the searchable columns
+//   { id, op: 'search', name, query }   - replies { id, result: Int32Array of matching row indices }
+//   { id, op: 'aggregate', name }       - replies { id, result: { chartName: { labels, values } } },
+//                                         the same shape as /api/stats/<name>
+// Messages are handled in order, so a search sent after a load sees the new rows.
+
+const datasets = {};
+
+/**
+ * Lower-cased searchable text of every row, built once per load so each
+ * keystroke is a single indexOf per row.
+ * @param {Array<Object>} rows - The dataset.
+ * @param {Array<string>} fields - The searchable columns.
+ * @returns {Array<string>} - One haystack per row.
+ */
+function buildHaystacks(rows, fields) {
+    return rows.map(row => fields
+        .map(field => (row[field] === null || row[field] === undefined ? '' : String(row[field]).toLowerCase()))
+        .join('\u0001'));
+}
+
+function search(name, query) {
+    const dataset = datasets[name];
+    if (!dataset) {
+        return new Int32Array(0);
+    }
+    const needle = query.toLowerCase();
+    const matches = new Int32Array(dataset.haystacks.length);
+    let count = 0;
+    dataset.haystacks.forEach((haystack, index) => {
+        if (haystack.includes(needle)) {
+            matches[count++] = index;
+        }
+    });
+    return matches.slice(0, count);
+}
+
+function countBy(rows, key) {
+    return rows.reduce((acc, row) => {
+        const value = key(row);
+        if (value !== undefined) {
+            acc[value] = (acc[value] || 0) + 1;
+        }
+        return acc;
+    }, {});
+}
+
+function chart(counts) {
+    return { labels: Object.keys(counts), values: Object.values(counts) };
+}
+
+function topChart(counts, limit = 5) {
+    const sorted = Object.entries(counts).sort(([, a], [, b]) => b - a).slice(0, limit);
+    return { labels: sorted.map(entry => entry[0]), values: sorted.map(entry => entry[1]) };
+}
+
+function trendChart(totals) {
+    const dates = Object.keys(totals).sort();
+    return { labels: dates, values: dates.map(date => totals[date]) };
+}
+
+function bucketChart(values, buckets) {
+    return { labels: buckets.map(bucket => bucket[0]), values: buckets.map(([, test]) => values.filter(test).length) };
+}
+
+const firstTerm = text => (text ? text.split(',')[0].trim() : 'Unknown');
+
+const aggregators = {
+    patients(patients) {
+        const ageGroups = { '0-18': 0, '19-35': 0, '36-50': 0, '51+': 0 };
+        patients.forEach(p => {
+            if (p.age <= 18) ageGroups['0-18']++; else if (p.age <= 35) ageGroups['19-35']++; else if (p.age <= 50) ageGroups['36-50']++; else ageGroups['51+']++;
+        });
+        return {
+            gender: chart(countBy(patients, p => p.gender)),
+            age: chart(ageGroups),
+            blood_type: chart(countBy(patients, p => p.blood_type || undefined)),
+            registration_trend: trendChart(countBy(patients, p => (p.registrationDate ? p.registrationDate.split(' ')[0] : undefined))),
+        };
+    },
+
+    doctors(doctors) {
+        return {
+            specialization: chart(countBy(doctors, d => d.specialization)),
+            department: chart(countBy(doctors, d => d.departmentName || 'Unassigned')),
+            fee: bucketChart(doctors.map(d => d.fee), [
+                ['< $100', f => f < 100], ['$100-$200', f => f >= 100 && f <= 200], ['> $200', f => f > 200],
+            ]),
+            experience: bucketChart(doctors.map(d => d.experience), [
+                ['0-5', e => e >= 0 && e <= 5], ['6-10', e => e > 5 && e <= 10],
+                ['11-20', e => e > 10 && e <= 20], ['20+', e => e > 20],
+            ]),
+        };
+    },
+
+    appointments(appointments) {
+        return {
+            status: chart(countBy(appointments, a => a.status)),
+            top_doctors: topChart(countBy(appointments, a => a.doctorName)),
+            top_reasons: topChart(countBy(appointments, a => a.reason || 'Not Specified')),
+            trend: trendChart(countBy(appointments, a => a.date.split(' ')[0])),
+        };
+    },
+
+    bills(bills) {
+        const revenue = {};
+        const paidRevenue = {};
+        let outstanding = 0;
+        let paid = 0;
+        bills.forEach(b => {
+            const amount = parseFloat(b.amount);
+            const date = b.date.split(' ')[0];
+            revenue[date] = (revenue[date] || 0) + amount;
+            if (b.status === 'Paid') {
+                paid += amount;
+                paidRevenue[date] = (paidRevenue[date] || 0) + amount;
+            } else {
+                outstanding += amount;
+            }
+        });
+        return {
+            status: chart(countBy(bills, b => b.status)),
+            payment_method: chart(countBy(bills.filter(b => b.status === 'Paid'), b => b.paymentMethod || 'Unknown')),
+            revenue_trend: trendChart(revenue),
+            paid_revenue_trend: trendChart(paidRevenue),
+            outstanding_vs_paid: { labels: ['Outstanding', 'Paid'], values: [outstanding, paid] },
+        };
+    },
+
+    records(records) {
+        const patients = datasets.patients ? datasets.patients.rows : [];
+        return {
+            top_diagnoses: topChart(countBy(records, r => firstTerm(r.diagnosis))),
+            top_treatments: topChart(countBy(records, r => firstTerm(r.treatment))),
+            prescription_trend: trendChart(countBy(records.filter(r => r.prescription), r => r.date.split(' ')[0])),
+            patient_conditions: topChart(countBy(patients.filter(p => p.disease), p => firstTerm(p.disease))),
+        };
+    },
+};
+
+self.onmessage = event => {
+    const { id, op, name } = event.data;
+    if (op === 'load') {
+        const { rows, fields } = event.data;
+        datasets[name] = { rows, haystacks: fields ? buildHaystacks(rows, fields) : [] };
+        return;
+    }
+    try {
+        if (op === 'search') {
+            const result = search(name, event.data.query);
+            self.postMessage({ id, result }, [result.buffer]);
+        } else if (op === 'aggregate') {
+            const dataset = datasets[name];
+            self.postMessage({ id, result: aggregators[name](dataset ? dataset.rows : []) });
+        } else {
+            throw new Error(`Unknown operation ${op}`);
+        }
+    } catch (error) {
+        self.postMessage({ id, error: error.message });
+    }
+};
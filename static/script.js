@@ -1,13 +1,13 @@
 // Base URL for your Flask API
 const API_BASE_URL = '/api';
 const MOBILE_BREAKPOINT = 992;
+// Search filtering and fallback chart aggregation run in this worker (index.html passes the built URL)
+const DATA_WORKER_URL = document.currentScript.dataset.worker || '/static/data-worker.js';
+const SEARCH_DEBOUNCE_MS = 150;
 
 // Global variables for pagination and cached data
 let currentPage = {
-    patients: 1,
     doctors: 1,
-    appointments: 1,
-    bills: 1,
     medicalRecords: 1,
     departments: 1,
     staff: 1,
@@ -19,11 +19,9 @@ let currentPage = {
 
 const itemsPerPage = 10;
 
-// Cached data from backend (to avoid excessive API calls for dropdowns/charts)
-let cachedPatients = [];
+// Cached data from backend (to avoid excessive API calls for dropdowns/charts).
+// Patients, appointments and bills are not cached here; see loadDataset.
 let cachedDoctors = [];
-let cachedAppointments = [];
-let cachedBills = [];
 let cachedMedicalRecords = [];
 let cachedDepartments = [];
 let cachedStaff = [];
@@ -144,9 +142,49 @@ function resizeActiveCharts() {
  * @param {string} endpoint - The API endpoint.
  * @returns {Promise<Array|Object>} - The JSON response data.
  */
+/**
+ * Asks for credentials and logs in; the server sets the session cookie.
+ * Concurrent callers (e.g. the parallel preload) share a single prompt.
+ * @returns {Promise<boolean>} - Whether the login succeeded.
+ */
+let pendingLogin = null;
+function login() {
+    if (!pendingLogin) {
+        pendingLogin = (async () => {
+            const username = prompt('Please sign in.\nUsername:');
+            if (!username) return false;
+            const password = prompt('Password:');
+            if (password === null) return false;
+            const response = await fetch(`${API_BASE_URL}/auth/login`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ username, password }),
+            });
+            if (!response.ok) {
+                const errorData = await response.json().catch(() => ({}));
+                alert(`Login failed: ${errorData.error || response.status}`);
+                return false;
+            }
+            return true;
+        })().finally(() => { pendingLogin = null; });
+    }
+    return pendingLogin;
+}
+
+/**
+ * Performs a fetch, signing in and retrying once if the API answers 401.
+ */
+async function authorizedFetch(url, options = {}) {
+    const response = await fetch(url, options);
+    if (response.status === 401 && await login()) {
+        return fetch(url, options);
+    }
+    return response;
+}
+
 async function fetchData(endpoint) {
     try {
-        const response = await fetch(`${API_BASE_URL}/${endpoint}`);
+        const response = await authorizedFetch(`${API_BASE_URL}/${endpoint}`);
         if (!response.ok) {
             const errorData = await response.json();
             throw new Error(errorData.error || `HTTP error! Status: ${response.status}`);
@@ -175,7 +213,7 @@ async function sendData(endpoint, method, data = null) {
             },
             body: data ? JSON.stringify(data) : null,
         };
-        const response = await fetch(`${API_BASE_URL}/${endpoint}`, options);
+        const response = await authorizedFetch(`${API_BASE_URL}/${endpoint}`, options);
         if (!response.ok) {
             const errorData = await response.json();
             throw new Error(errorData.error || `HTTP error! Status: ${response.status}`);
@@ -253,10 +291,7 @@ function renderPagination(elementId, totalItems, type) {
 async function changePage(type, page) {
     let data;
     switch (type) {
-        case 'patients': data = cachedPatients; break;
         case 'doctors': data = cachedDoctors; break;
-        case 'appointments': data = cachedAppointments; break;
-        case 'bills': data = cachedBills; break;
         case 'medicalRecords': data = cachedMedicalRecords; break;
         case 'departments': data = cachedDepartments; break;
         case 'staff': data = cachedStaff; break;
@@ -274,10 +309,7 @@ async function changePage(type, page) {
     currentPage[type] = page;
 
     switch (type) {
-        case 'patients': renderPatientsTable(data); break;
         case 'doctors': renderDoctorsTable(data); break;
-        case 'appointments': renderAppointmentsTable(data); break;
-        case 'bills': renderBillsTable(data); break;
         case 'medicalRecords': renderMedicalRecordsTable(data); break;
         case 'departments': renderDepartmentsTable(data); break;
         case 'staff': renderStaffTable(data); break;
@@ -288,6 +320,301 @@ async function changePage(type, page) {
     }
 }
 
+// --- Virtual tables and the data worker ---
+// The patient, appointment and bill lists and the search results render only
+// the rows in (and just around) their scroll viewport. The lists page through
+// the API (?limit=&offset=) as they scroll; search results index into the
+// arrays of loadDataset.
+
+const VIRTUAL_PAGE_SIZE = 200;
+const VIRTUAL_MAX_PAGES = 50;
+const VIRTUAL_ROW_HEIGHT = 57; // Until the first rendered row is measured
+const VIRTUAL_OVERSCAN = 10;
+const VIRTUAL_MIN_ROWS = 20; // Rendered while the table is hidden and has no height
+
+const virtualTables = {};
+
+/**
+ * Rows of an in-memory array, or only those at `indices` (a search result).
+ */
+class ArraySource {
+    constructor(rows, indices = null) {
+        this.rows = rows;
+        this.indices = indices;
+    }
+
+    get length() {
+        return this.indices ? this.indices.length : this.rows.length;
+    }
+
+    get(index) {
+        return this.rows[this.indices ? this.indices[index] : index];
+    }
+}
+
+/**
+ * Rows of an API collection, fetched a page at a time as they are first needed.
+ * The most recent VIRTUAL_MAX_PAGES pages are kept.
+ */
+class PagedSource {
+    constructor(endpoint, pageSize = VIRTUAL_PAGE_SIZE) {
+        this.endpoint = endpoint;
+        this.pageSize = pageSize;
+        this.length = 0;
+        this.pages = new Map(); // page number -> rows, or the pending fetch
+        this.onLoad = null;
+    }
+
+    /**
+     * Fetches one page (once); also updates the total row count.
+     * @param {number} page - Zero-based page number.
+     * @returns {Promise<Array<Object>>} - The page's rows ([] on error).
+     */
+    load(page) {
+        if (this.pages.has(page)) {
+            return Promise.resolve(this.pages.get(page));
+        }
+        const pending = authorizedFetch(`${API_BASE_URL}/${this.endpoint}?limit=${this.pageSize}&offset=${page * this.pageSize}`)
+            .then(async response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! Status: ${response.status}`);
+                }
+                const body = await response.json();
+                if (body.total !== null) {
+                    this.length = body.total; // Counted with the first page only
+                }
+                this.pages.set(page, body.rows);
+                for (const [cached, rows] of this.pages) {
+                    if (this.pages.size <= VIRTUAL_MAX_PAGES) break;
+                    if (Array.isArray(rows) && cached !== page) this.pages.delete(cached);
+                }
+                if (this.onLoad) this.onLoad();
+                return body.rows;
+            })
+            .catch(error => {
+                console.error('Fetch error:', error);
+                this.pages.delete(page); // Retried when next scrolled into view
+                return [];
+            });
+        this.pages.set(page, pending);
+        return pending;
+    }
+
+    /**
+     * The row at `index`, or undefined while its page loads.
+     */
+    get(index) {
+        const page = Math.floor(index / this.pageSize);
+        const rows = this.pages.get(page);
+        if (Array.isArray(rows)) {
+            return rows[index % this.pageSize];
+        }
+        if (!rows) {
+            this.load(page);
+        }
+        return undefined;
+    }
+}
+
+/**
+ * A table body that holds only the rows visible in its scroll container,
+ * with spacer rows standing in for the rest.
+ */
+class VirtualTable {
+    constructor(tableBody) {
+        this.body = tableBody;
+        this.columns = tableBody.closest('table').querySelectorAll('thead th').length;
+        this.viewport = tableBody.closest('.table-responsive');
+        this.viewport.classList.add('virtual-scroll');
+        this.rowHeight = VIRTUAL_ROW_HEIGHT;
+        this.measured = false;
+        this.source = new ArraySource([]);
+        this.renderRow = null;
+        this.range = null;
+        this.frame = null;
+        this.viewport.addEventListener('scroll', () => this.schedule(), { passive: true });
+        window.addEventListener('resize', () => this.schedule());
+    }
+
+    setSource(source, renderRow) {
+        this.source = source;
+        this.renderRow = renderRow;
+        if ('onLoad' in source) {
+            source.onLoad = () => {
+                this.range = null;
+                this.schedule();
+            };
+        }
+        this.range = null;
+        this.viewport.scrollTop = 0;
+        this.render();
+    }
+
+    schedule() {
+        if (this.frame === null) {
+            this.frame = requestAnimationFrame(() => {
+                this.frame = null;
+                this.render();
+            });
+        }
+    }
+
+    render() {
+        const total = this.source.length;
+        const top = this.viewport.scrollTop;
+        const height = this.viewport.clientHeight || this.rowHeight * VIRTUAL_MIN_ROWS;
+        const first = Math.min(total, Math.max(0, Math.floor(top / this.rowHeight) - VIRTUAL_OVERSCAN));
+        const last = Math.min(total, Math.ceil((top + height) / this.rowHeight) + VIRTUAL_OVERSCAN);
+        if (this.range && this.range[0] === first && this.range[1] === last && this.range[2] === total) {
+            return;
+        }
+        this.range = [first, last, total];
+
+        const html = [this.spacer(first)];
+        for (let i = first; i < last; i++) {
+            const item = this.source.get(i);
+            html.push(item === undefined
+                ? `<tr class="virtual-loading"><td colspan="${this.columns}">Loading...</td></tr>`
+                : `<tr>${this.renderRow(item)}</tr>`);
+        }
+        html.push(this.spacer(total - last));
+        this.body.innerHTML = html.join('');
+
+        if (!this.measured) {
+            const row = this.body.querySelector('tr:not(.virtual-spacer)');
+            if (row && row.offsetHeight) {
+                this.rowHeight = row.offsetHeight;
+                this.measured = true;
+                this.schedule(); // Recompute the window with the real height
+            }
+        }
+    }
+
+    spacer(rows) {
+        return rows > 0 ? `<tr class="virtual-spacer" style="height: ${rows * this.rowHeight}px"></tr>` : '';
+    }
+}
+
+/**
+ * Shows `source` in a table body, rendering only its visible rows.
+ * @param {string} tableBodyId - ID of the table body element.
+ * @param {ArraySource|PagedSource} source - The rows.
+ * @param {Function} renderRow - Returns the cells (<td> markup) of one row.
+ */
+function renderVirtualTable(tableBodyId, source, renderRow) {
+    if (!virtualTables[tableBodyId]) {
+        virtualTables[tableBodyId] = new VirtualTable(document.getElementById(tableBodyId));
+    }
+    virtualTables[tableBodyId].setSource(source, renderRow);
+}
+
+// Searchable columns per dataset, as matched by the search forms.
+const SEARCH_FIELDS = {
+    patients: ['name', 'patient_id', 'phone', 'disease'],
+    appointments: ['patientName', 'doctorName', 'date', 'id'],
+    bills: ['patientName', 'invoiceNumber', 'status', 'id'],
+    records: ['patientName', 'doctorName', 'diagnosis', 'id'],
+};
+
+// Patients, appointments and bills can run to hundreds of thousands of rows, so
+// none of them is downloaded at startup: tables page through the API, counts and
+// charts come from the server, and a full list is fetched the first time a
+// search, a dropdown or a chart fallback needs it.
+const lazyDatasets = {}; // Endpoint -> promise of its rows
+
+/**
+ * The rows of `endpoint`, fetched once until invalidateDataset(endpoint).
+ * @param {string} endpoint - e.g. 'patients' or 'patients/list'.
+ * @returns {Promise<Array<Object>>} - The rows ([] on error, retried on the next call).
+ */
+function loadDataset(endpoint) {
+    if (!lazyDatasets[endpoint]) {
+        lazyDatasets[endpoint] = fetchData(endpoint).then(rows => {
+            if (!rows) {
+                delete lazyDatasets[endpoint];
+            }
+            return rows || [];
+        });
+    }
+    return lazyDatasets[endpoint];
+}
+
+/**
+ * Drops the cached rows of every given endpoint after a write.
+ */
+function invalidateDataset(...endpoints) {
+    endpoints.forEach(endpoint => delete lazyDatasets[endpoint]);
+}
+
+let dataWorker = null;
+let dataWorkerSeq = 0;
+const dataWorkerCalls = new Map();
+const dataWorkerRows = {}; // Dataset name -> the array last sent to the worker
+const latestSearch = {};
+
+function getDataWorker() {
+    if (!dataWorker) {
+        dataWorker = new Worker(DATA_WORKER_URL);
+        dataWorker.onmessage = event => {
+            const { id, result, error } = event.data;
+            const call = dataWorkerCalls.get(id);
+            dataWorkerCalls.delete(id);
+            if (call) {
+                if (error) call.reject(new Error(error)); else call.resolve(result);
+            }
+        };
+        dataWorker.onerror = event => {
+            // The script failed to load; start a fresh worker on the next call
+            console.error('Data worker error:', event.message);
+            dataWorkerCalls.forEach(call => call.reject(new Error(event.message || 'Data worker failed')));
+            dataWorkerCalls.clear();
+            Object.keys(dataWorkerRows).forEach(name => delete dataWorkerRows[name]);
+            dataWorker.terminate();
+            dataWorker = null;
+        };
+    }
+    return dataWorker;
+}
+
+/**
+ * Sends `rows` to the worker unless it already holds this array. The cached
+ * arrays are replaced, never mutated, when they are refreshed.
+ */
+function syncWorkerDataset(name, rows) {
+    if (dataWorkerRows[name] !== rows) {
+        getDataWorker().postMessage({ op: 'load', name, rows, fields: SEARCH_FIELDS[name] });
+        dataWorkerRows[name] = rows;
+    }
+}
+
+/**
+ * Runs `op` ('search' or 'aggregate') over a dataset in the data worker.
+ * @returns {Promise<*>} - The worker's result.
+ */
+function callDataWorker(op, name, rows, args = {}) {
+    syncWorkerDataset(name, rows);
+    const id = ++dataWorkerSeq;
+    return new Promise((resolve, reject) => {
+        dataWorkerCalls.set(id, { resolve, reject });
+        getDataWorker().postMessage({ id, op, name, ...args });
+    });
+}
+
+/**
+ * Filters `rows` in the data worker.
+ * @returns {Promise<ArraySource|null>} - The matches, or null if a newer search superseded this one.
+ */
+async function searchRows(name, rows, query) {
+    const ticket = latestSearch[name] = (latestSearch[name] || 0) + 1;
+    try {
+        const indices = await callDataWorker('search', name, rows, { query });
+        return ticket === latestSearch[name] ? new ArraySource(rows, indices) : null;
+    } catch (error) {
+        console.error('Search error:', error);
+        return null;
+    }
+}
+
 /**
  * Creates or updates a Chart.js chart.
  * @param {string} canvasId - The ID of the canvas element.
@@ -374,6 +701,60 @@ function createChart(canvasId, type, label, labels, data, chartCache) {
     chartCache[canvasId] = newChart;
 }
 
+/**
+ * Fetches a section's chart aggregates, computed in SQL by /api/stats/<entity>.
+ * @param {string} entity - patients, doctors, appointments, bills or records.
+ * @param {string} [start] - Optional first day, 'YYYY-MM-DD'.
+ * @param {string} [end] - Last day (inclusive) when `start` is given.
+ * @returns {Promise<Object|null>} - {chartName: {labels, values}}, or null if unavailable.
+ */
+async function fetchChartStats(entity, start = null, end = null) {
+    const range = start ? `?start=${start}&end=${end}` : '';
+    try {
+        const response = await authorizedFetch(`${API_BASE_URL}/stats/${entity}${range}`);
+        if (!response.ok) {
+            return null;
+        }
+        return (await response.json()).charts;
+    } catch (error) {
+        console.warn(`Chart statistics for ${entity} unavailable:`, error);
+        return null;
+    }
+}
+
+/**
+ * Draws a section's charts from the server-side aggregates, or from the
+ * section's rows aggregated in the data worker if the stats endpoint is unavailable.
+ * @param {string} entity - The /api/stats entity.
+ * @param {Array<Array<string>>} specs - [chartName, canvasId, type, title] per chart.
+ * @param {Object} chartCache - The global object to store chart instances.
+ * @param {Function} getRows - Returns the section's rows (or a promise of them), for the fallback.
+ * @returns {Promise<boolean>} - False if neither source produced the aggregates or they hold no data.
+ */
+async function renderServerCharts(entity, specs, chartCache, getRows) {
+    let charts = await fetchChartStats(entity);
+    if (!charts) {
+        try {
+            if (entity === 'records') {
+                syncWorkerDataset('patients', await loadDataset('patients')); // For the patient conditions chart
+            }
+            charts = await callDataWorker('aggregate', entity, await getRows());
+        } catch (error) {
+            console.error(`Chart aggregation for ${entity} failed:`, error);
+            return false;
+        }
+    }
+    if (!specs.some(([name]) => charts[name] && charts[name].values.some(value => value))) {
+        return false;
+    }
+    specs.forEach(([name, canvasId, type, title]) => {
+        if (charts[name]) {
+            createChart(canvasId, type, title, charts[name].labels, charts[name].values, chartCache);
+        }
+    });
+    return true;
+}
+
 /**
  * Formats a date string to a more readable format.
  * @param {string} dateStr - The date string (e.g., 'YYYY-MM-DD').
@@ -421,88 +802,87 @@ function getStatusClass(status) {
 }
 
 /**
- * Renders search results in a table.
+ * The cells of one search result row.
+ * @param {Object} item - The matching row.
+ * @param {string} type - Type of data (e.g., 'patient', 'doctor').
+ * @returns {string} - The row's <td> markup.
+ */
+function searchResultCells(item, type) {
+    if (type === 'patient') {
+        return `
+            <td>${item.patient_id}</td>
+            <td>${item.name}</td>
+            <td>${item.age}</td>
+            <td>${item.gender}</td>
+            <td>${item.phone || ''}</td>
+            <td>${item.blood_type || ''}</td>
+            <td>
+                <button class="btn btn-primary" onclick="viewPatientDetails(${item.patient_id})"><i class="fas fa-eye"></i> View</button>
+            </td>
+        `;
+    } else if (type === 'doctor') {
+        return `
+            <td>${item.doctor_id}</td>
+            <td>${item.name}</td>
+            <td>${item.specialization}</td>
+            <td>${item.department_name || ''}</td>
+            <td>$${item.consultation_fee.toFixed(2)}</td>
+            <td>
+                <button class="btn btn-primary" onclick="viewDoctorDetails(${item.doctor_id})"><i class="fas fa-eye"></i> View</button>
+            </td>
+        `;
+    } else if (type === 'appointment') {
+        return `
+            <td>${item.appointment_id}</td>
+            <td>${item.patient_name}</td>
+            <td>${item.doctor_name}</td>
+            <td>${formatDate(item.date)}</td>
+            <td>${formatTime(item.time)}</td>
+            <td><span class="status-badge status-${getStatusClass(item.status)}">${item.status}</span></td>
+            <td>
+                <button class="btn btn-primary" onclick="viewAppointmentDetails(${item.appointment_id})"><i class="fas fa-eye"></i> View</button>
+            </td>
+        `;
+    } else if (type === 'bill') {
+        return `
+            <td>${item.invoice_number}</td>
+            <td>${item.patient_name}</td>
+            <td>${formatDate(item.date)}</td>
+            <td>$${item.amount.toFixed(2)}</td>
+            <td><span class="status-badge status-${getStatusClass(item.status)}">${item.status}</span></td>
+            <td>
+                <button class="btn btn-primary" onclick="viewBillDetails(${item.bill_id})"><i class="fas fa-eye"></i> View</button>
+            </td>
+        `;
+    } else if (type === 'medicalRecord') {
+        return `
+            <td>${item.record_id}</td>
+            <td>${item.patient_name}</td>
+            <td>${item.doctor_name || 'N/A'}</td>
+            <td>${truncateText(item.diagnosis, 30)}</td>
+            <td>${formatDate(item.date)}</td>
+            <td>
+                <button class="btn btn-primary" onclick="viewMedicalRecordDetails(${item.record_id})"><i class="fas fa-eye"></i> View</button>
+            </td>
+        `;
+    }
+    return '';
+}
+
+/**
+ * Renders search results in a table, only the rows in view.
  * @param {string} tableBodyId - ID of the table body element.
- * @param {Array<Object>} results - Array of search results.
+ * @param {Array<Object>|ArraySource} results - The search results.
  * @param {string} type - Type of data (e.g., 'patient', 'doctor').
  */
 function renderSearchResults(tableBodyId, results, type) {
-    const tableBody = document.getElementById(tableBodyId);
-    tableBody.innerHTML = '';
+    const source = Array.isArray(results) ? new ArraySource(results) : results;
     const noResultsMessage = document.getElementById(`no${type.charAt(0).toUpperCase() + type.slice(1)}SearchResults`);
     const resultsContainer = document.getElementById(`search${type.charAt(0).toUpperCase() + type.slice(1)}Results`);
 
-    if (results.length === 0) {
-        noResultsMessage.style.display = 'block';
-        resultsContainer.style.display = 'block';
-    } else {
-        noResultsMessage.style.display = 'none';
-        results.forEach(item => {
-            const row = document.createElement('tr');
-            let innerHTML = ''; // Initialize as empty string
-            if (type === 'patient') {
-                innerHTML = `
-                    <td>${item.patient_id}</td>
-                    <td>${item.name}</td>
-                    <td>${item.age}</td>
-                    <td>${item.gender}</td>
-                    <td>${item.phone || ''}</td>
-                    <td>${item.blood_type || ''}</td>
-                    <td>
-                        <button class="btn btn-primary" onclick="viewPatientDetails(${item.patient_id})"><i class="fas fa-eye"></i> View</button>
-                    </td>
-                `;
-            } else if (type === 'doctor') {
-                innerHTML = `
-                    <td>${item.doctor_id}</td>
-                    <td>${item.name}</td>
-                    <td>${item.specialization}</td>
-                    <td>${item.department_name || ''}</td>
-                    <td>$${item.consultation_fee.toFixed(2)}</td>
-                    <td>
-                        <button class="btn btn-primary" onclick="viewDoctorDetails(${item.doctor_id})"><i class="fas fa-eye"></i> View</button>
-                    </td>
-                `;
-            } else if (type === 'appointment') {
-                innerHTML = `
-                    <td>${item.appointment_id}</td>
-                    <td>${item.patient_name}</td>
-                    <td>${item.doctor_name}</td>
-                    <td>${formatDate(item.date)}</td>
-                    <td>${formatTime(item.time)}</td>
-                    <td><span class="status-badge status-${getStatusClass(item.status)}">${item.status}</span></td>
-                    <td>
-                        <button class="btn btn-primary" onclick="viewAppointmentDetails(${item.appointment_id})"><i class="fas fa-eye"></i> View</button>
-                    </td>
-                `;
-            } else if (type === 'bill') {
-                innerHTML = `
-                    <td>${item.invoice_number}</td>
-                    <td>${item.patient_name}</td>
-                    <td>${formatDate(item.date)}</td>
-                    <td>$${item.amount.toFixed(2)}</td>
-                    <td><span class="status-badge status-${getStatusClass(item.status)}">${item.status}</span></td>
-                    <td>
-                        <button class="btn btn-primary" onclick="viewBillDetails(${item.bill_id})"><i class="fas fa-eye"></i> View</button>
-                    </td>
-                `;
-            } else if (type === 'medicalRecord') {
-                innerHTML = `
-                    <td>${item.record_id}</td>
-                    <td>${item.patient_name}</td>
-                    <td>${item.doctor_name || 'N/A'}</td>
-                    <td>${truncateText(item.diagnosis, 30)}</td>
-                    <td>${formatDate(item.date)}</td>
-                    <td>
-                        <button class="btn btn-primary" onclick="viewMedicalRecordDetails(${item.record_id})"><i class="fas fa-eye"></i> View</button>
-                    </td>
-                `;
-            }
-            row.innerHTML = innerHTML;
-            tableBody.appendChild(row);
-        });
-        resultsContainer.style.display = 'block';
-    }
+    noResultsMessage.style.display = source.length === 0 ? 'block' : 'none';
+    resultsContainer.style.display = 'block'; // Visible first, so the table can measure its viewport
+    renderVirtualTable(tableBodyId, source, item => searchResultCells(item, type));
 }
 
 // --- Common UI/Navigation Logic ---
@@ -511,7 +891,25 @@ document.addEventListener('DOMContentLoaded', async function () {
     // Initial data load for dropdowns etc.
     await preloadAllData();
 
-    // Set hospital name
+    // Search as the user types; the filtering runs in the data worker
+    [
+        ['searchPatientQuery', searchPatient],
+        ['searchAppointmentQuery', searchAppointment],
+        ['searchBillQuery', searchBill],
+        ['searchMedicalRecordQuery', searchMedicalRecord],
+    ].forEach(([inputId, search]) => {
+        let timer = null;
+        document.getElementById(inputId).addEventListener('input', () => {
+            clearTimeout(timer);
+            timer = setTimeout(search, SEARCH_DEBOUNCE_MS);
+        });
+    });
+
+    // Set hospital name (the server's, when it serves several hospitals)
+    const tenant = await fetch(`${API_BASE_URL}/tenant`).then(r => (r.ok ? r.json() : null)).catch(() => null);
+    if (tenant && tenant.name) {
+        localStorage.setItem('hospitalName', tenant.name);
+    }
     if (!localStorage.getItem('hospitalName')) {
         if (hospitalNameModal) {
             hospitalNameModal.style.display = 'block';
@@ -620,13 +1018,13 @@ function updateChartsOnThemeChange() {
         if (sectionId === 'dashboard-section') {
             updateDashboardCharts();
         } else if (sectionId === 'patient-management') {
-            renderPatientCharts(cachedPatients);
+            renderPatientCharts();
         } else if (sectionId === 'doctor-management') {
             renderDoctorCharts(cachedDoctors);
         } else if (sectionId === 'appointment-management') {
-            renderAppointmentCharts(cachedAppointments);
+            renderAppointmentCharts();
         } else if (sectionId === 'billing-management') {
-            renderBillingCharts(cachedBills);
+            renderBillingCharts();
         } else if (sectionId === 'medical-records') {
             renderMedicalRecordCharts(cachedMedicalRecords);
         } else if (sectionId === 'reports-analytics') {
@@ -677,11 +1075,11 @@ function updateNavActive(activeId) {
     });
 }
 
-function logout() {
+async function logout() {
     if (confirm('Are you sure you want to exit?')) {
         closeMobileSidebar();
+        await fetch(`${API_BASE_URL}/auth/logout`, { method: 'POST' }).catch(() => null);
         alert('Exiting Hospital Management System. Goodbye!');
-        // In a real web app, you might clear session data or redirect to a login page.
         // window.close() might not work in all modern browsers due to security policies.
     }
 }
@@ -698,11 +1096,8 @@ function hideAllSubSections(sectionId) {
 
 // --- Preload Data Function ---
 async function preloadAllData() {
-    cachedPatients = await fetchData('patients') || [];
     cachedDoctors = await fetchData('doctors') || [];
-    cachedAppointments = await fetchData('appointments') || [];
     cachedDepartments = await fetchData('departments') || [];
-    cachedBills = await fetchData('bills') || [];
     cachedMedicalRecords = await fetchData('records') || [];
     cachedStaff = await fetchData('staff') || [];
     cachedInsuranceProviders = await fetchData('insurance') || [];
@@ -710,13 +1105,8 @@ async function preloadAllData() {
     cachedPatientTests = await fetchData('tests/patients') || [];
     cachedInventoryItems = await fetchData('inventory') || [];
 
-    // Populate dropdowns once data is loaded
-    populatePatientDropdown('appointmentPatient');
-    populatePatientDropdown('updateAppointmentPatient');
-    populatePatientDropdown('billPatient');
-    populatePatientDropdown('medicalRecordPatient');
-    populatePatientDropdown('patientTestPatient');
-
+    // Populate dropdowns once data is loaded; patient and appointment
+    // dropdowns are filled when their forms open.
     populateDoctorDropdown('appointmentDoctor');
     populateDoctorDropdown('updateAppointmentDoctor');
     populateDoctorDropdown('medicalRecordDoctor');
@@ -727,8 +1117,6 @@ async function preloadAllData() {
     populateDepartmentDropdown('staffDepartment');
     populateDepartmentDropdown('updateStaffDepartment');
 
-    populateAppointmentDropdown('billAppointment');
-
     populateTestTypeDropdown('patientTestType');
 }
 
@@ -743,16 +1131,56 @@ async function showDashboard() {
     updateDashboardCharts();
 }
 
-async function updateDashboardMetrics() {
-    const patients = await fetchData('patients');
-    const doctors = await fetchData('doctors');
-    const todayAppointments = await fetchData('reports/today-appointments');
-    const pendingBills = await fetchData('bills'); // Fetch all to filter client-side
+/**
+ * Row count of a paged collection: the total sent with a one-row first page.
+ */
+async function fetchTotal(endpoint) {
+    const page = await fetchData(`${endpoint}?limit=1`);
+    return page ? page.total : 0;
+}
 
-    document.getElementById('totalPatients').textContent = patients ? patients.length : 0;
-    document.getElementById('totalDoctors').textContent = doctors ? doctors.length : 0;
+async function updateDashboardMetrics() {
+    const [totalPatients, totalDoctors, todayAppointments, billStats] = await Promise.all([
+        fetchTotal('patients'),
+        fetchTotal('doctors'),
+        fetchData('reports/today-appointments'),
+        fetchChartStats('bills'),
+    ]);
+    const billStatus = billStats ? billStats.status : { labels: [], values: [] };
+    const pendingBills = billStatus.labels.reduce((sum, status, i) =>
+        sum + (status === 'Unpaid' || status === 'Overdue' ? billStatus.values[i] : 0), 0);
+
+    document.getElementById('totalPatients').textContent = totalPatients;
+    document.getElementById('totalDoctors').textContent = totalDoctors;
     document.getElementById('todaysAppointments').textContent = todayAppointments ? todayAppointments.length : 0;
-    document.getElementById('pendingBills').textContent = pendingBills ? pendingBills.filter(bill => bill.status === 'Unpaid' || bill.status === 'Overdue').length : 0;
+    document.getElementById('pendingBills').textContent = pendingBills;
+}
+
+/**
+ * One value per day for the last `days` days (zero where a day has none),
+ * from a date-labelled chart of /api/stats/<entity>.
+ * @returns {Promise<Object|null>} - {labels, values}, or null if the statistics are unavailable.
+ */
+async function fetchDailyTrend(entity, chartName, days = 7) {
+    const dates = [];
+    const today = new Date();
+    for (let i = days - 1; i >= 0; i--) {
+        const date = new Date(today);
+        date.setDate(today.getDate() - i);
+        dates.push(date.toISOString().split('T')[0]);
+    }
+    const charts = await fetchChartStats(entity, dates[0], dates[dates.length - 1]);
+    if (!charts) {
+        return null;
+    }
+    const totals = {};
+    charts[chartName].labels.forEach((label, i) => {
+        totals[label] = charts[chartName].values[i];
+    });
+    return {
+        labels: dates.map(d => new Date(d).toLocaleDateString('en-US', { weekday: 'short', day: 'numeric' })),
+        values: dates.map(d => totals[d] || 0),
+    };
 }
 
 async function updateDashboardCharts() {
@@ -761,51 +1189,15 @@ async function updateDashboardCharts() {
     currentDashboardCharts = {};
 
     // Appointments Trend (Daily)
-    const appointmentsData = await fetchData('appointments');
-    if (appointmentsData) {
-        const dailyAppointments = {};
-        const today = new Date();
-        for (let i = 6; i >= 0; i--) { // Last 7 days
-            const date = new Date(today);
-            date.setDate(date.getDate() - i);
-            const dateStr = date.toISOString().split('T')[0];
-            dailyAppointments[dateStr] = 0;
-        }
-
-        appointmentsData.forEach(app => {
-            const appDate = app.date.split('T')[0]; // Ensure date format matches
-            if (dailyAppointments.hasOwnProperty(appDate)) {
-                dailyAppointments[appDate]++;
-            }
-        });
-
-        const labels = Object.keys(dailyAppointments).map(d => new Date(d).toLocaleDateString('en-US', { weekday: 'short', day: 'numeric' }));
-        const data = Object.values(dailyAppointments);
-        createChart('appointmentsChart', 'line', 'Appointments Trend (Last 7 Days)', labels, data, currentDashboardCharts);
+    const appointmentsTrend = await fetchDailyTrend('appointments', 'trend');
+    if (appointmentsTrend) {
+        createChart('appointmentsChart', 'line', 'Appointments Trend (Last 7 Days)', appointmentsTrend.labels, appointmentsTrend.values, currentDashboardCharts);
     }
 
-    // Revenue Trend (Daily)
-    const billsData = await fetchData('bills');
-    if (billsData) {
-        const dailyRevenue = {};
-        const today = new Date();
-        for (let i = 6; i >= 0; i--) { // Last 7 days
-            const date = new Date(today);
-            date.setDate(date.getDate() - i);
-            const dateStr = date.toISOString().split('T')[0];
-            dailyRevenue[dateStr] = 0;
-        }
-
-        billsData.filter(bill => bill.status === 'Paid').forEach(bill => {
-            const billDate = bill.date.split('T')[0];
-            if (dailyRevenue.hasOwnProperty(billDate)) {
-                dailyRevenue[billDate] += parseFloat(bill.amount);
-            }
-        });
-
-        const labels = Object.keys(dailyRevenue).map(d => new Date(d).toLocaleDateString('en-US', { weekday: 'short', day: 'numeric' }));
-        const data = Object.values(dailyRevenue);
-        createChart('revenueChart', 'line', 'Revenue Trend (Last 7 Days)', labels, data, currentDashboardCharts);
+    // Revenue Trend (Daily), paid bills only
+    const revenueTrend = await fetchDailyTrend('bills', 'paid_revenue_trend');
+    if (revenueTrend) {
+        createChart('revenueChart', 'line', 'Revenue Trend (Last 7 Days)', revenueTrend.labels, revenueTrend.values, currentDashboardCharts);
     }
 }
 
@@ -819,68 +1211,36 @@ async function changeDashboardTimePeriod(type, period) {
     });
 
     if (type === 'appointments') {
-        const appointmentsData = await fetchData('appointments');
-        if (appointmentsData) {
-            let aggregatedData = {};
-            const now = new Date();
-
-            if (period === 'daily') {
-                for (let i = 6; i >= 0; i--) { // Last 7 days
-                    const date = new Date(now);
-                    date.setDate(now.getDate() - i);
-                    aggregatedData[date.toISOString().split('T')[0]] = 0;
-                }
-                appointmentsData.forEach(app => {
-                    const appDate = app.date.split('T')[0];
-                    if (aggregatedData.hasOwnProperty(appDate)) {
-                        aggregatedData[appDate]++;
-                    }
-                });
-                const labels = Object.keys(aggregatedData).map(d => new Date(d).toLocaleDateString('en-US', { weekday: 'short', day: 'numeric' }));
-                const data = Object.values(aggregatedData);
-                createChart('appointmentsChart', 'line', 'Appointments Trend (Daily)', labels, data, currentDashboardCharts);
-            } else if (period === 'weekly') {
-                // For simplicity, generate random data for weekly/monthly for now
-                // In a real app, you'd aggregate database data by week/month
-                const labels = ['Week 1', 'Week 2', 'Week 3', 'Week 4'];
-                const data = labels.map(() => Math.floor(Math.random() * 100) + 50);
-                createChart('appointmentsChart', 'bar', 'Appointments Trend (Weekly)', labels, data, currentDashboardCharts);
-            } else if (period === 'monthly') {
-                const labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun']; // Example months
-                const data = labels.map(() => Math.floor(Math.random() * 300) + 100);
-                createChart('appointmentsChart', 'bar', 'Appointments Trend (Monthly)', labels, data, currentDashboardCharts);
+        if (period === 'daily') {
+            const trend = await fetchDailyTrend('appointments', 'trend');
+            if (trend) {
+                createChart('appointmentsChart', 'line', 'Appointments Trend (Daily)', trend.labels, trend.values, currentDashboardCharts);
             }
+        } else if (period === 'weekly') {
+            // For simplicity, generate random data for weekly/monthly for now
+            // In a real app, you'd aggregate database data by week/month
+            const labels = ['Week 1', 'Week 2', 'Week 3', 'Week 4'];
+            const data = labels.map(() => Math.floor(Math.random() * 100) + 50);
+            createChart('appointmentsChart', 'bar', 'Appointments Trend (Weekly)', labels, data, currentDashboardCharts);
+        } else if (period === 'monthly') {
+            const labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun']; // Example months
+            const data = labels.map(() => Math.floor(Math.random() * 300) + 100);
+            createChart('appointmentsChart', 'bar', 'Appointments Trend (Monthly)', labels, data, currentDashboardCharts);
         }
     } else { // Revenue
-        const billsData = await fetchData('bills');
-        if (billsData) {
-            let aggregatedData = {};
-            const now = new Date();
-
-            if (period === 'daily') {
-                for (let i = 6; i >= 0; i--) { // Last 7 days
-                    const date = new Date(now);
-                    date.setDate(now.getDate() - i);
-                    aggregatedData[date.toISOString().split('T')[0]] = 0;
-                }
-                billsData.filter(bill => bill.status === 'Paid').forEach(bill => {
-                    const billDate = bill.date.split('T')[0];
-                    if (aggregatedData.hasOwnProperty(billDate)) {
-                        aggregatedData[billDate] += parseFloat(bill.amount);
-                    }
-                });
-                const labels = Object.keys(aggregatedData).map(d => new Date(d).toLocaleDateString('en-US', { weekday: 'short', day: 'numeric' }));
-                const data = Object.values(aggregatedData);
-                createChart('revenueChart', 'line', 'Revenue Trend (Daily)', labels, data, currentDashboardCharts);
-            } else if (period === 'weekly') {
-                const labels = ['Week 1', 'Week 2', 'Week 3', 'Week 4'];
-                const data = labels.map(() => Math.floor(Math.random() * 5000) + 2000);
-                createChart('revenueChart', 'bar', 'Revenue Trend (Weekly)', labels, data, currentDashboardCharts);
-            } else if (period === 'monthly') {
-                const labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun'];
-                const data = labels.map(() => Math.floor(Math.random() * 10000) + 5000);
-                createChart('revenueChart', 'bar', 'Revenue Trend (Monthly)', labels, data, currentDashboardCharts);
+        if (period === 'daily') {
+            const trend = await fetchDailyTrend('bills', 'paid_revenue_trend');
+            if (trend) {
+                createChart('revenueChart', 'line', 'Revenue Trend (Daily)', trend.labels, trend.values, currentDashboardCharts);
             }
+        } else if (period === 'weekly') {
+            const labels = ['Week 1', 'Week 2', 'Week 3', 'Week 4'];
+            const data = labels.map(() => Math.floor(Math.random() * 5000) + 2000);
+            createChart('revenueChart', 'bar', 'Revenue Trend (Weekly)', labels, data, currentDashboardCharts);
+        } else if (period === 'monthly') {
+            const labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun'];
+            const data = labels.map(() => Math.floor(Math.random() * 10000) + 5000);
+            createChart('revenueChart', 'bar', 'Revenue Trend (Monthly)', labels, data, currentDashboardCharts);
         }
     }
 }
@@ -941,8 +1301,8 @@ function hidePatientForm(type) {
 
 function showAllPatients() {
     hideAllSubSections('patient-management');
-    renderPatientsTable(cachedPatients);
-    renderPatientCharts(cachedPatients);
+    renderPatientsTable();
+    renderPatientCharts();
     document.getElementById('patient-list').style.display = 'block';
     document.getElementById('patient-visualizations').classList.remove('hidden-section');
 }
@@ -978,7 +1338,7 @@ async function addPatient() {
     if (result) {
         alert(result.message);
         document.getElementById('patientForm').reset();
-        cachedPatients = await fetchData('patients') || []; // Refresh cache
+        invalidateDataset('patients', 'patients/list');
         showAllPatients();
         await updateDashboardMetrics();
     }
@@ -1028,7 +1388,7 @@ async function updatePatient() {
         document.getElementById('updatePatientForm').reset();
         document.getElementById('updatePatientForm').classList.add('hidden-section');
         document.getElementById('updatePatientId').value = '';
-        cachedPatients = await fetchData('patients') || []; // Refresh cache
+        invalidateDataset('patients', 'patients/list');
         showAllPatients();
     }
 }
@@ -1044,83 +1404,48 @@ async function confirmDeletePatient() {
         if (result) {
             alert(result.message);
             document.getElementById('deletePatientId').value = '';
-            cachedPatients = await fetchData('patients') || []; // Refresh cache
+            invalidateDataset('patients', 'patients/list');
             showAllPatients();
             await updateDashboardMetrics();
         }
     }
 }
 
-function renderPatientsTable(patients) {
-    const tableBody = document.getElementById('patientsTableBody');
-    tableBody.innerHTML = '';
-    const paginatedPatients = paginate(patients, currentPage.patients, itemsPerPage);
-    if (paginatedPatients.length === 0) {
-        document.getElementById('noPatientsMessage').style.display = 'block';
-    } else {
-        document.getElementById('noPatientsMessage').style.display = 'none';
-        paginatedPatients.forEach(patient => {
-            const row = document.createElement('tr');
-            row.innerHTML = `
-                <td>${patient.patient_id}</td>
-                <td>${patient.name}</td>
-                <td>${patient.age}</td>
-                <td>${patient.gender}</td>
-                <td>${patient.phone || ''}</td>
-                <td>${patient.blood_type || ''}</td>
-                <td>
-                    <button class="btn btn-primary" onclick="viewPatientDetails(${patient.patient_id})"><i class="fas fa-eye"></i> View</button>
-                    <button class="btn btn-success" onclick="editPatient(${patient.patient_id})"><i class="fas fa-edit"></i> Edit</button>
-                </td>
-            `;
-            tableBody.appendChild(row);
-        });
-    }
-    renderPagination('patientPagination', patients.length, 'patients');
+async function renderPatientsTable() {
+    const source = new PagedSource('patients');
+    await source.load(0);
+    document.getElementById('noPatientsMessage').style.display = source.length === 0 ? 'block' : 'none';
+    renderVirtualTable('patientsTableBody', source, patient => `
+        <td>${patient.patient_id}</td>
+        <td>${patient.name}</td>
+        <td>${patient.age}</td>
+        <td>${patient.gender}</td>
+        <td>${patient.phone || ''}</td>
+        <td>${patient.blood_type || ''}</td>
+        <td>
+            <button class="btn btn-primary" onclick="viewPatientDetails(${patient.patient_id})"><i class="fas fa-eye"></i> View</button>
+            <button class="btn btn-success" onclick="editPatient(${patient.patient_id})"><i class="fas fa-edit"></i> Edit</button>
+        </td>
+    `);
 }
 
-function renderPatientCharts(patients) {
+async function renderPatientCharts() {
     // Destroy existing charts if any
     Object.values(currentPatientCharts).forEach(chart => chart.destroy());
     currentPatientCharts = {};
 
-    if (patients.length === 0) {
-        document.getElementById('patient-visualizations').classList.add('hidden-section');
-        return;
-    }
-
-    document.getElementById('patient-visualizations').classList.remove('hidden-section'); // Ensure charts container is visible
-
-    const genderCounts = patients.reduce((acc, p) => {
-        acc[p.gender] = (acc[p.gender] || 0) + 1;
-        return acc;
-    }, {});
-    createChart('patientGenderChart', 'pie', 'Patient Gender Distribution', Object.keys(genderCounts), Object.values(genderCounts), currentPatientCharts);
-
-    const ageGroups = { '0-18': 0, '19-35': 0, '36-50': 0, '51+': 0 };
-    patients.forEach(p => {
-        if (p.age <= 18) ageGroups['0-18']++; else if (p.age <= 35) ageGroups['19-35']++; else if (p.age <= 50) ageGroups['36-50']++; else ageGroups['51+']++;
-    });
-    createChart('patientAgeDistributionChart', 'bar', 'Patient Age Distribution', Object.keys(ageGroups), Object.values(ageGroups), currentPatientCharts);
-
-    const bloodTypeCounts = patients.reduce((acc, p) => {
-        if (p.blood_type) {
-            acc[p.blood_type] = (acc[p.blood_type] || 0) + 1;
-        }
-        return acc;
-    }, {});
-    createChart('patientBloodTypeChart', 'doughnut', 'Patient Blood Type', Object.keys(bloodTypeCounts), Object.values(bloodTypeCounts), currentPatientCharts);
+    const container = document.getElementById('patient-visualizations');
+    container.classList.remove('hidden-section'); // Ensure charts container is visible
 
-    // Assuming 'created_at' for registration date, adjust if your schema uses a different column
-    const registrationTrend = patients.reduce((acc, p) => {
-        const date = p.registrationDate ? p.registrationDate.split(' ')[0] : 'Unknown'; // Extract date part from 'YYYY-MM-DD HH:MM:SS'
-        if (date !== 'Unknown') {
-            acc[date] = (acc[date] || 0) + 1;
-        }
-        return acc;
-    }, {});
-    const sortedDates = Object.keys(registrationTrend).sort();
-    createChart('patientRegistrationTrendChart', 'line', 'Patient Registrations Over Time', sortedDates, sortedDates.map(d => registrationTrend[d]), currentPatientCharts);
+    const drawn = await renderServerCharts('patients', [
+        ['gender', 'patientGenderChart', 'pie', 'Patient Gender Distribution'],
+        ['age', 'patientAgeDistributionChart', 'bar', 'Patient Age Distribution'],
+        ['blood_type', 'patientBloodTypeChart', 'doughnut', 'Patient Blood Type'],
+        ['registration_trend', 'patientRegistrationTrendChart', 'line', 'Patient Registrations Over Time'],
+    ], currentPatientCharts, () => loadDataset('patients'));
+    if (!drawn) {
+        container.classList.add('hidden-section');
+    }
 }
 
 async function viewPatientDetails(id) {
@@ -1156,14 +1481,11 @@ function editPatient(id) {
 }
 
 async function searchPatient() {
-    const query = document.getElementById('searchPatientQuery').value.toLowerCase();
-    const results = cachedPatients.filter(p =>
-        p.name.toLowerCase().includes(query) ||
-        p.patient_id.toString().includes(query) ||
-        (p.phone && p.phone.includes(query)) ||
-        (p.disease && p.disease.toLowerCase().includes(query))
-    );
-    renderSearchResults('searchPatientResultsBody', results, 'patient');
+    const query = document.getElementById('searchPatientQuery').value;
+    const results = await searchRows('patients', await loadDataset('patients'), query);
+    if (results) {
+        renderSearchResults('searchPatientResultsBody', results, 'patient');
+    }
 }
 
 async function exportPatients() {
@@ -1332,7 +1654,7 @@ function renderDoctorsTable(doctors) {
     renderPagination('doctorPagination', doctors.length, 'doctors');
 }
 
-function renderDoctorCharts(doctors) {
+async function renderDoctorCharts(doctors) {
     Object.values(currentDoctorCharts).forEach(chart => chart.destroy());
     currentDoctorCharts = {};
 
@@ -1342,56 +1664,12 @@ function renderDoctorCharts(doctors) {
     }
     document.getElementById('doctor-visualizations').classList.remove('hidden-section');
 
-
-    const specializationCounts = doctors.reduce((acc, d) => {
-        acc[d.specialization] = (acc[d.specialization] || 0) + 1;
-        return acc;
-    }, {});
-    createChart('doctorSpecializationChart', 'pie', 'Doctor Specializations', Object.keys(specializationCounts), Object.values(specializationCounts), currentDoctorCharts);
-
-    const departmentCounts = doctors.reduce((acc, d) => {
-        const deptName = d.departmentName || 'Unassigned';
-        acc[deptName] = (acc[deptName] || 0) + 1;
-        return acc;
-    }, {});
-    createChart('doctorDepartmentChart', 'bar', 'Doctors by Department', Object.keys(departmentCounts), Object.values(departmentCounts), currentDoctorCharts);
-
-    const feeData = doctors.map(d => d.fee); // Changed from consultation_fee
-    if (feeData.length > 0) {
-        const feeLabels = ['< $100', '$100-$200', '> $200'];
-        const feeCounts = [
-            feeData.filter(f => f < 100).length,
-            feeData.filter(f => f >= 100 && f <= 200).length,
-            feeData.filter(f => f > 200).length
-        ];
-        createChart('doctorFeeDistributionChart', 'bar', 'Consultation Fee Distribution', feeLabels, feeCounts, currentDoctorCharts);
-    } else {
-         // Clear previous chart if no data
-        const canvas = document.getElementById('doctorFeeDistributionChart');
-        if (canvas) {
-            const ctx = canvas.getContext('2d');
-            ctx.clearRect(0, 0, canvas.width, canvas.height); // Clear canvas
-        }
-    }
-
-
-    const experienceData = doctors.map(d => d.experience); // Changed from years_of_experience
-    if (experienceData.length > 0) {
-        const experienceLabels = ['0-5', '6-10', '11-20', '20+'];
-        const experienceCounts = [
-            experienceData.filter(e => e >= 0 && e <= 5).length,
-            experienceData.filter(e => e > 5 && e <= 10).length,
-            experienceData.filter(e => e > 10 && e <= 20).length,
-            experienceData.filter(e => e > 20).length
-        ];
-        createChart('doctorExperienceChart', 'bar', 'Years of Experience', experienceLabels, experienceCounts, currentDoctorCharts);
-    } else {
-        const canvas = document.getElementById('doctorExperienceChart');
-        if (canvas) {
-            const ctx = canvas.getContext('2d');
-            ctx.clearRect(0, 0, canvas.width, canvas.height);
-        }
-    }
+    await renderServerCharts('doctors', [
+        ['specialization', 'doctorSpecializationChart', 'pie', 'Doctor Specializations'],
+        ['department', 'doctorDepartmentChart', 'bar', 'Doctors by Department'],
+        ['fee', 'doctorFeeDistributionChart', 'bar', 'Consultation Fee Distribution'],
+        ['experience', 'doctorExperienceChart', 'bar', 'Years of Experience'],
+    ], currentDoctorCharts, () => doctors);
 }
 
 async function viewDoctorDetails(id) {
@@ -1459,8 +1737,8 @@ function hideAppointmentForm(type) {
 
 async function showAllAppointments() {
     hideAllSubSections('appointment-management');
-    renderAppointmentsTable(cachedAppointments);
-    renderAppointmentCharts(cachedAppointments);
+    renderAppointmentsTable();
+    renderAppointmentCharts();
     document.getElementById('appointment-list').style.display = 'block';
     document.getElementById('appointment-visualizations').classList.remove('hidden-section');
 }
@@ -1492,9 +1770,9 @@ async function addAppointment() {
 
     const result = await sendData('appointments', 'POST', appointmentData);
     if (result) {
-        alert(result.message + ` Invoice: ${result.invoice_number}`);
+        alert(result.message + ` Appointment: ${result.appointment_number}`);
         document.getElementById('appointmentForm').reset();
-        cachedAppointments = await fetchData('appointments') || [];
+        invalidateDataset('appointments', 'appointments/list');
         showAllAppointments();
         await updateDashboardMetrics();
     }
@@ -1506,7 +1784,10 @@ async function loadAppointmentForUpdate() {
         alert('Please enter an Appointment ID.');
         return;
     }
-    const appointment = await fetchData(`appointments/${appointmentId}`);
+    const [appointment] = await Promise.all([
+        fetchData(`appointments/${appointmentId}`),
+        populatePatientDropdown('updateAppointmentPatient'), // Its options must exist before the value is set
+    ]);
     if (appointment) {
         document.getElementById('updateAppointmentPatient').value = appointment.patient_id;
         document.getElementById('updateAppointmentDoctor').value = appointment.doctor_id;
@@ -1539,7 +1820,7 @@ async function updateAppointment() {
         document.getElementById('updateAppointmentForm').reset();
         document.getElementById('updateAppointmentForm').classList.add('hidden-section');
         document.getElementById('updateAppointmentId').value = '';
-        cachedAppointments = await fetchData('appointments') || [];
+        invalidateDataset('appointments', 'appointments/list');
         showAllAppointments();
     }
 }
@@ -1555,86 +1836,54 @@ async function confirmCancelAppointment() {
         if (result) {
             alert(result.message);
             document.getElementById('cancelAppointmentId').value = '';
-            cachedAppointments = await fetchData('appointments') || [];
+            invalidateDataset('appointments', 'appointments/list');
             showAllAppointments();
             await updateDashboardMetrics();
         }
     }
 }
 
-function renderAppointmentsTable(appointments) {
-    const tableBody = document.getElementById('appointmentsTableBody');
-    tableBody.innerHTML = '';
-    const paginatedAppointments = paginate(appointments, currentPage.appointments, itemsPerPage);
-    if (paginatedAppointments.length === 0) {
-        document.getElementById('noAppointmentsMessage').style.display = 'block';
-    } else {
-        document.getElementById('noAppointmentsMessage').style.display = 'none';
-        paginatedAppointments.forEach(app => {
-            const row = document.createElement('tr');
-            row.innerHTML = `
-                <td>${app.id}</td>
-                <td>${app.patientName}</td>
-                <td>${app.doctorName}</td>
-                <td>${formatDate(app.date)}</td>
-                <td>${formatTime(app.time)}</td>
-                <td><span class="status-badge status-${getStatusClass(app.status)}">${app.status}</span></td>
-                <td>
-                    <button class="btn btn-primary" onclick="viewAppointmentDetails(${app.id})"><i class="fas fa-eye"></i> View</button>
-                    <button class="btn btn-success" onclick="editAppointment(${app.id})"><i class="fas fa-edit"></i> Edit</button>
-                </td>
-            `;
-            tableBody.appendChild(row);
-        });
-    }
-    renderPagination('appointmentPagination', appointments.length, 'appointments');
+async function renderAppointmentsTable() {
+    const source = new PagedSource('appointments');
+    await source.load(0);
+    document.getElementById('noAppointmentsMessage').style.display = source.length === 0 ? 'block' : 'none';
+    renderVirtualTable('appointmentsTableBody', source, app => `
+        <td>${app.id}</td>
+        <td>${app.patientName}</td>
+        <td>${app.doctorName}</td>
+        <td>${formatDate(app.date)}</td>
+        <td>${formatTime(app.time)}</td>
+        <td><span class="status-badge status-${getStatusClass(app.status)}">${app.status}</span></td>
+        <td>
+            <button class="btn btn-primary" onclick="viewAppointmentDetails(${app.id})"><i class="fas fa-eye"></i> View</button>
+            <button class="btn btn-success" onclick="editAppointment(${app.id})"><i class="fas fa-edit"></i> Edit</button>
+        </td>
+    `);
 }
 
-function renderAppointmentCharts(appointments) {
+async function renderAppointmentCharts() {
     Object.values(currentAppointmentCharts).forEach(chart => chart.destroy());
     currentAppointmentCharts = {};
 
-    if (appointments.length === 0) {
-        document.getElementById('appointment-visualizations').classList.add('hidden-section');
-        return;
-    }
-    document.getElementById('appointment-visualizations').classList.remove('hidden-section');
-
-
-    const statusCounts = appointments.reduce((acc, a) => {
-        acc[a.status] = (acc[a.status] || 0) + 1;
-        return acc;
-    }, {});
-    createChart('appointmentStatusChart', 'pie', 'Appointment Status Distribution', Object.keys(statusCounts), Object.values(statusCounts), currentAppointmentCharts);
-
-    const doctorCounts = appointments.reduce((acc, a) => {
-        acc[a.doctorName] = (acc[a.doctorName] || 0) + 1;
-        return acc;
-    }, {});
-    const sortedDoctorCounts = Object.entries(doctorCounts).sort(([, a], [, b]) => b - a).slice(0, 5); // Top 5 doctors
-    createChart('doctorAppointmentChart', 'bar', 'Top 5 Doctors by Appointments', sortedDoctorCounts.map(d => d[0]), sortedDoctorCounts.map(d => d[1]), currentAppointmentCharts);
+    const container = document.getElementById('appointment-visualizations');
+    container.classList.remove('hidden-section');
 
-    const reasonCounts = appointments.reduce((acc, a) => {
-        const reason = a.reason || 'Not Specified';
-        acc[reason] = (acc[reason] || 0) + 1;
-        return acc;
-    }, {});
-    const sortedReasonCounts = Object.entries(reasonCounts).sort(([, a], [, b]) => b - a).slice(0, 5); // Top 5 reasons
-    createChart('appointmentReasonChart', 'doughnut', 'Top 5 Appointment Reasons', sortedReasonCounts.map(r => r[0]), sortedReasonCounts.map(r => r[1]), currentAppointmentCharts);
-
-    const appointmentTrend = appointments.reduce((acc, a) => {
-        const date = a.date.split(' ')[0]; // Assuming date comes as 'YYYY-MM-DD HH:MM:SS'
-        acc[date] = (acc[date] || 0) + 1;
-        return acc;
-    }, {});
-    const sortedDates = Object.keys(appointmentTrend).sort();
-    createChart('appointmentTrendChart', 'line', 'Appointment Trend Over Time', sortedDates, sortedDates.map(d => appointmentTrend[d]), currentAppointmentCharts);
+    const drawn = await renderServerCharts('appointments', [
+        ['status', 'appointmentStatusChart', 'pie', 'Appointment Status Distribution'],
+        ['top_doctors', 'doctorAppointmentChart', 'bar', 'Top 5 Doctors by Appointments'],
+        ['top_reasons', 'appointmentReasonChart', 'doughnut', 'Top 5 Appointment Reasons'],
+        ['trend', 'appointmentTrendChart', 'line', 'Appointment Trend Over Time'],
+    ], currentAppointmentCharts, () => loadDataset('appointments'));
+    if (!drawn) {
+        container.classList.add('hidden-section');
+    }
 }
 
 async function viewAppointmentDetails(id) {
     const app = await fetchData(`appointments/${id}`);
     if (app) {
         const content = `
+            <p><strong>Appointment #:</strong> ${app.appointment_number || 'N/A'}</p>
             <p><strong>Patient:</strong> ${app.patient_name}</p>
             <p><strong>Doctor:</strong> ${app.doctor_name}</p>
             <p><strong>Date:</strong> ${formatDate(app.date)}</p>
@@ -1657,14 +1906,11 @@ function editAppointment(id) {
 }
 
 async function searchAppointment() {
-    const query = document.getElementById('searchAppointmentQuery').value.toLowerCase();
-    const results = cachedAppointments.filter(a =>
-        a.patientName.toLowerCase().includes(query) ||
-        a.doctorName.toLowerCase().includes(query) ||
-        a.date.includes(query) ||
-        a.id.toString().includes(query)
-    );
-    renderSearchResults('searchAppointmentResultsBody', results, 'appointment');
+    const query = document.getElementById('searchAppointmentQuery').value;
+    const results = await searchRows('appointments', await loadDataset('appointments'), query);
+    if (results) {
+        renderSearchResults('searchAppointmentResultsBody', results, 'appointment');
+    }
 }
 
 async function exportAppointments() {
@@ -1696,8 +1942,8 @@ function hideBillingForm(type) {
 
 async function showAllBills() {
     hideAllSubSections('billing-management');
-    renderBillsTable(cachedBills);
-    renderBillingCharts(cachedBills);
+    renderBillsTable();
+    renderBillingCharts();
     document.getElementById('bill-list').style.display = 'block';
     document.getElementById('billing-visualizations').classList.remove('hidden-section');
 }
@@ -1714,7 +1960,7 @@ async function addBill() {
     const appointmentId = document.getElementById('billAppointment').value ? parseInt(document.getElementById('billAppointment').value) : null;
     
     // Find associated doctor ID from appointment or default to null
-    const appointment = cachedAppointments.find(app => app.id === appointmentId);
+    const appointment = (await loadDataset('appointments/list')).find(app => app.id === appointmentId);
     const doctorId = appointment ? appointment.doctor_id : null;
 
     // Parse items from JSON textarea
@@ -1751,7 +1997,7 @@ async function addBill() {
     if (result) {
         alert(result.message + (result.invoice_number ? ` Invoice: ${result.invoice_number}` : ''));
         document.getElementById('billForm').reset();
-        cachedBills = await fetchData('bills') || [];
+        invalidateDataset('bills');
         showAllBills();
         await updateDashboardMetrics();
     }
@@ -1810,74 +2056,45 @@ async function updateBill() {
         document.getElementById('updateBillForm').reset();
         document.getElementById('updateBillForm').classList.add('hidden-section');
         document.getElementById('updateBillId').value = '';
-        cachedBills = await fetchData('bills') || [];
+        invalidateDataset('bills');
         showAllBills();
         await updateDashboardMetrics();
     }
 }
 
-function renderBillsTable(bills) {
-    const tableBody = document.getElementById('billsTableBody');
-    tableBody.innerHTML = '';
-    const paginatedBills = paginate(bills, currentPage.bills, itemsPerPage);
-    if (paginatedBills.length === 0) {
-        document.getElementById('noBillsMessage').style.display = 'block';
-    } else {
-        document.getElementById('noBillsMessage').style.display = 'none';
-        paginatedBills.forEach(bill => {
-            const row = document.createElement('tr');
-            row.innerHTML = `
-                <td>${bill.invoiceNumber}</td>
-                <td>${bill.patientName}</td>
-                <td>${formatDate(bill.date)}</td>
-                <td>$${(bill.amount || 0).toFixed(2)}</td>
-                <td><span class="status-badge status-${getStatusClass(bill.status)}">${bill.status}</span></td>
-                <td>
-                    <button class="btn btn-primary" onclick="viewBillDetails(${bill.id})"><i class="fas fa-eye"></i> View</button>
-                    <button class="btn btn-success" onclick="editBill(${bill.id})"><i class="fas fa-edit"></i> Edit</button>
-                </td>
-            `;
-            tableBody.appendChild(row);
-        });
-    }
-    renderPagination('billPagination', bills.length, 'bills');
+async function renderBillsTable() {
+    const source = new PagedSource('bills');
+    await source.load(0);
+    document.getElementById('noBillsMessage').style.display = source.length === 0 ? 'block' : 'none';
+    renderVirtualTable('billsTableBody', source, bill => `
+        <td>${bill.invoiceNumber}</td>
+        <td>${bill.patientName}</td>
+        <td>${formatDate(bill.date)}</td>
+        <td>$${(bill.amount || 0).toFixed(2)}</td>
+        <td><span class="status-badge status-${getStatusClass(bill.status)}">${bill.status}</span></td>
+        <td>
+            <button class="btn btn-primary" onclick="viewBillDetails(${bill.id})"><i class="fas fa-eye"></i> View</button>
+            <button class="btn btn-success" onclick="editBill(${bill.id})"><i class="fas fa-edit"></i> Edit</button>
+        </td>
+    `);
 }
 
-function renderBillingCharts(bills) {
+async function renderBillingCharts() {
     Object.values(currentBillingCharts).forEach(chart => chart.destroy());
     currentBillingCharts = {};
 
-    if (bills.length === 0) {
-        document.getElementById('billing-visualizations').classList.add('hidden-section');
-        return;
-    }
-    document.getElementById('billing-visualizations').classList.remove('hidden-section');
-
-
-    const statusCounts = bills.reduce((acc, b) => {
-        acc[b.status] = (acc[b.status] || 0) + 1;
-        return acc;
-    }, {});
-    createChart('billingStatusChart', 'pie', 'Bill Status Distribution', Object.keys(statusCounts), Object.values(statusCounts), currentBillingCharts);
-
-    const paymentMethodCounts = bills.filter(b => b.status === 'Paid').reduce((acc, b) => {
-        const method = b.paymentMethod || 'Unknown';
-        acc[method] = (acc[method] || 0) + 1;
-        return acc;
-    }, {});
-    createChart('paymentMethodChart', 'doughnut', 'Paid Bills by Payment Method', Object.keys(paymentMethodCounts), Object.values(paymentMethodCounts), currentBillingCharts);
-
-    const revenueTrend = bills.reduce((acc, b) => {
-        const date = b.date.split(' ')[0]; // Assuming date comes as 'YYYY-MM-DD HH:MM:SS'
-        acc[date] = (acc[date] || 0) + parseFloat(b.amount);
-        return acc;
-    }, {});
-    const sortedDates = Object.keys(revenueTrend).sort();
-    createChart('revenueTrendChart', 'line', 'Revenue Trend Over Time', sortedDates, sortedDates.map(d => revenueTrend[d]), currentBillingCharts);
+    const container = document.getElementById('billing-visualizations');
+    container.classList.remove('hidden-section');
 
-    const outstandingBills = bills.filter(b => b.status !== 'Paid').reduce((acc, b) => acc + parseFloat(b.amount), 0);
-    const paidBills = bills.filter(b => b.status === 'Paid').reduce((acc, b) => acc + parseFloat(b.amount), 0);
-    createChart('outstandingBillsChart', 'bar', 'Outstanding vs Paid Bills', ['Outstanding', 'Paid'], [outstandingBills, paidBills], currentBillingCharts);
+    const drawn = await renderServerCharts('bills', [
+        ['status', 'billingStatusChart', 'pie', 'Bill Status Distribution'],
+        ['payment_method', 'paymentMethodChart', 'doughnut', 'Paid Bills by Payment Method'],
+        ['revenue_trend', 'revenueTrendChart', 'line', 'Revenue Trend Over Time'],
+        ['outstanding_vs_paid', 'outstandingBillsChart', 'bar', 'Outstanding vs Paid Bills'],
+    ], currentBillingCharts, () => loadDataset('bills'));
+    if (!drawn) {
+        container.classList.add('hidden-section');
+    }
 }
 
 async function viewBillDetails(id) {
@@ -1912,14 +2129,11 @@ function editBill(id) {
 }
 
 async function searchBill() {
-    const query = document.getElementById('searchBillQuery').value.toLowerCase();
-    const results = cachedBills.filter(b =>
-        b.patientName.toLowerCase().includes(query) ||
-        b.invoiceNumber.toLowerCase().includes(query) ||
-        b.status.toLowerCase().includes(query) ||
-        b.id.toString().includes(query)
-    );
-    renderSearchResults('searchBillResultsBody', results, 'bill');
+    const query = document.getElementById('searchBillQuery').value;
+    const results = await searchRows('bills', await loadDataset('bills'), query);
+    if (results) {
+        renderSearchResults('searchBillResultsBody', results, 'bill');
+    }
 }
 
 async function exportBills() {
@@ -2000,8 +2214,8 @@ async function loadMedicalRecordForUpdate() {
     const record = await fetchData(`records/${recordId}`);
     if (record) {
         // Assume patient and doctor dropdowns are already populated
-        document.getElementById('updateMedicalRecordPatientName').value = cachedPatients.find(p => p.patient_id === record.patient_id)?.name || 'N/A';
-        document.getElementById('updateMedicalRecordDoctorName').value = cachedDoctors.find(d => d.doctor_id === record.doctor_id)?.name || 'N/A';
+        document.getElementById('updateMedicalRecordPatientName').value = record.patient_name || 'N/A';
+        document.getElementById('updateMedicalRecordDoctorName').value = record.doctor_name || 'N/A';
         document.getElementById('updateMedicalRecordDate').value = record.date;
         document.getElementById('updateMedicalRecordDiagnosis').value = record.diagnosis;
         document.getElementById('updateMedicalRecordTreatment').value = record.treatment || '';
@@ -2089,7 +2303,7 @@ function renderMedicalRecordsTable(records) {
     renderPagination('medicalRecordPagination', records.length, 'medicalRecords');
 }
 
-function renderMedicalRecordCharts(records) {
+async function renderMedicalRecordCharts(records) {
     Object.values(currentMedicalRecordCharts).forEach(chart => chart.destroy());
     currentMedicalRecordCharts = {};
 
@@ -2099,39 +2313,12 @@ function renderMedicalRecordCharts(records) {
     }
     document.getElementById('medical-records-visualizations').classList.remove('hidden-section');
 
-
-    const diagnosisCounts = records.reduce((acc, r) => {
-        const diag = r.diagnosis ? r.diagnosis.split(',')[0].trim() : 'Unknown';
-        acc[diag] = (acc[diag] || 0) + 1;
-        return acc;
-    }, {});
-    const sortedDiagnoses = Object.entries(diagnosisCounts).sort(([, a], [, b]) => b - a).slice(0, 5);
-    createChart('diagnosisChart', 'bar', 'Top 5 Diagnoses', sortedDiagnoses.map(d => d[0]), sortedDiagnoses.map(d => d[1]), currentMedicalRecordCharts);
-
-    const treatmentCounts = records.reduce((acc, r) => {
-        const treat = r.treatment ? r.treatment.split(',')[0].trim() : 'Unknown';
-        acc[treat] = (acc[treat] || 0) + 1;
-        return acc;
-    }, {});
-    const sortedTreatments = Object.entries(treatmentCounts).sort(([, a], [, b]) => b - a).slice(0, 5);
-    createChart('treatmentChart', 'pie', 'Top 5 Treatments', sortedTreatments.map(t => t[0]), sortedTreatments.map(t => t[1]), currentMedicalRecordCharts);
-
-    const prescriptionTrend = records.filter(r => r.prescription).reduce((acc, r) => {
-        const date = r.date.split(' ')[0]; // Assuming date format 'YYYY-MM-DD HH:MM:SS'
-        acc[date] = (acc[date] || 0) + 1; // Count prescriptions per day
-        return acc;
-    }, {});
-    const sortedPrescriptionDates = Object.keys(prescriptionTrend).sort();
-    createChart('prescriptionTrendChart', 'line', 'Prescription Trend Over Time', sortedPrescriptionDates, sortedPrescriptionDates.map(d => prescriptionTrend[d]), currentMedicalRecordCharts);
-
-    // This chart uses cachedPatients.disease, ensure it aligns with backend data structure
-    const patientConditions = cachedPatients.filter(p => p.disease).reduce((acc, p) => {
-        const condition = p.disease.split(',')[0].trim();
-        acc[condition] = (acc[condition] || 0) + 1;
-        return acc;
-    }, {});
-    const sortedPatientConditions = Object.entries(patientConditions).sort(([, a], [, b]) => b - a).slice(0, 5);
-    createChart('patientConditionChart', 'doughnut', 'Top Patient Conditions (from Patient Data)', sortedPatientConditions.map(c => c[0]), sortedPatientConditions.map(c => c[1]), currentMedicalRecordCharts);
+    await renderServerCharts('records', [
+        ['top_diagnoses', 'diagnosisChart', 'bar', 'Top 5 Diagnoses'],
+        ['top_treatments', 'treatmentChart', 'pie', 'Top 5 Treatments'],
+        ['prescription_trend', 'prescriptionTrendChart', 'line', 'Prescription Trend Over Time'],
+        ['patient_conditions', 'patientConditionChart', 'doughnut', 'Top Patient Conditions (from Patient Data)'],
+    ], currentMedicalRecordCharts, () => records);
 }
 
 async function viewMedicalRecordDetails(id) {
@@ -2165,14 +2352,11 @@ function editMedicalRecord(id) {
 }
 
 async function searchMedicalRecord() {
-    const query = document.getElementById('searchMedicalRecordQuery').value.toLowerCase();
-    const results = cachedMedicalRecords.filter(r =>
-        r.patientName.toLowerCase().includes(query) ||
-        (r.doctorName && r.doctorName.toLowerCase().includes(query)) ||
-        r.diagnosis.toLowerCase().includes(query) ||
-        r.id.toString().includes(query)
-    );
-    renderSearchResults('searchMedicalRecordResultsBody', results, 'medicalRecord');
+    const query = document.getElementById('searchMedicalRecordQuery').value;
+    const results = await searchRows('records', cachedMedicalRecords, query);
+    if (results) {
+        renderSearchResults('searchMedicalRecordResultsBody', results, 'medicalRecord');
+    }
 }
 
 async function exportMedicalRecords() {
@@ -3355,13 +3539,11 @@ async function updateInventoryItem() {
     const inventoryData = {
         name: document.getElementById('updateInventoryItemName').value,
         category: document.getElementById('updateInventoryItemCategory').value,
-        quantity: parseInt(document.getElementById('updateInventoryItemQuantity').value),
         unit: document.getElementById('updateInventoryItemUnit').value,
         price: parseFloat(document.getElementById('updateInventoryItemPrice').value),
         supplier: document.getElementById('updateInventoryItemSupplier').value || null,
         expiry_date: document.getElementById('updateInventoryItemExpiryDate').value || null,
         threshold: parseInt(document.getElementById('updateInventoryItemThreshold').value) || null,
-        last_restocked: document.getElementById('updateInventoryItemLastRestocked').value || null,
         location: document.getElementById('updateInventoryItemLocation').value || null,
         description: document.getElementById('updateInventoryItemDescription').value || null
     };
@@ -3453,14 +3635,15 @@ function editInventoryItem(id) {
 
 // --- Dropdown Population Functions ---
 
-function populatePatientDropdown(selectId) {
+async function populatePatientDropdown(selectId) {
     const selectElement = document.getElementById(selectId);
     if (!selectElement) return;
+    const patients = await loadDataset('patients/list');
     selectElement.innerHTML = '<option value="">Select Patient</option>';
-    cachedPatients.forEach(patient => {
+    patients.forEach(patient => {
         const option = document.createElement('option');
-        option.value = patient.patient_id;
-        option.textContent = `${patient.name} (ID: ${patient.patient_id})`;
+        option.value = patient.id;
+        option.textContent = `${patient.name} (ID: ${patient.id})`;
         selectElement.appendChild(option);
     });
 }
@@ -3489,11 +3672,12 @@ function populateDepartmentDropdown(selectId) {
     });
 }
 
-function populateAppointmentDropdown(selectId) {
+async function populateAppointmentDropdown(selectId) {
     const selectElement = document.getElementById(selectId);
     if (!selectElement) return;
+    const appointments = await loadDataset('appointments/list');
     selectElement.innerHTML = '<option value="">Select Appointment (Optional)</option>'; // Mark as optional
-    cachedAppointments.forEach(app => {
+    appointments.forEach(app => {
         const option = document.createElement('option');
         option.value = app.id;
         option.textContent = `Appt ID: ${app.id} - ${app.patientName} with Dr. ${app.doctorName} on ${formatDate(app.date)}`;
@@ -0,0 +1,393 @@
+"""Fingerprinted, precompressed static assets and a cached index page.
+
+``flask build-assets`` minifies static/script.js, data-worker.js and
+style.css and writes them to ``static/dist/`` under content-hashed names
+(``script.<hash>.js``). Next to each file it writes a gzip copy, and a
+brotli copy when the ``brotli`` package is installed. ``manifest.json``
+maps each source name to its built name. Files of the previous build are
+kept, so pages rendered before a deploy still load; older ones are removed.
+
+``/static/dist/<file>`` serves the best precompressed variant the client
+accepts, with ``Cache-Control: public, max-age=31536000, immutable``. The
+name changes whenever the content does, so browsers never revalidate.
+Templates link assets with ``asset_url(name)``, which falls back to the
+plain static file when there is no build.
+
+``/`` renders index.html once per worker. It strips indentation, blank lines
+and comments (``<pre>``/``<textarea>`` are left alone), compresses the
+result, and re-renders only when a new build appears or in debug mode. The
+page itself is revalidated on every load (``no-cache`` with an ETag), so a
+repeat visit costs a 304 and cached assets.
+
+The minifiers are deliberately conservative. JavaScript keeps its line
+breaks, so automatic semicolon insertion behaves exactly as before. Only
+comments and redundant spaces go, and strings, template literals and regex
+literals are copied verbatim.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+
+import click
+from flask import Response, render_template, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_SOURCES = ('script.js', 'data-worker.js', 'style.css')
+ASSET_MAX_AGE_S = 365 * 24 * 3600
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+_WORD = re.compile(r'[\w$\\]')
+# After these, a '/' starts a regex literal rather than a division.
+_REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case', 'do',
+                   'else', 'yield', 'await'}
+
+
+# --- Minifiers ---
+def _skip_string(source, i):
+    """Index just past the string or template literal starting at ``i``."""
+    quote = source[i]
+    i += 1
+    while i < len(source):
+        c = source[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == quote:
+            return i + 1
+        if quote == '`' and source.startswith('${', i):
+            i = _skip_code(source, i + 2, '}')
+            continue
+        i += 1
+    return i
+
+
+def _skip_code(source, i, closing):
+    """Index just past the ``closing`` brace matching an already opened one (template ``${...}``)."""
+    depth = 0
+    while i < len(source):
+        c = source[i]
+        if c in '\'"`':
+            i = _skip_string(source, i)
+            continue
+        if c == '{':
+            depth += 1
+        elif c == closing:
+            if depth == 0:
+                return i + 1
+            depth -= 1
+        i += 1
+    return i
+
+
+def _skip_regex(source, i):
+    """Index just past the regex literal (and flags) starting at ``i``."""
+    i += 1
+    in_class = False
+    while i < len(source):
+        c = source[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '\n':
+            break  # Not a regex after all; leave the rest untouched
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            i += 1
+            while i < len(source) and _WORD.match(source[i]):
+                i += 1
+            break
+        i += 1
+    return i
+
+
+def _regex_allowed(out, last_word):
+    if last_word in _REGEX_KEYWORDS:
+        return True
+    for chunk in reversed(out):
+        stripped = chunk.rstrip()
+        if stripped:
+            return stripped[-1] not in ')]}' and not _WORD.match(stripped[-1])
+    return True
+
+
+def minify_js(source):
+    """Drops comments, indentation, blank lines and spaces not needed between tokens."""
+    out = []
+    pending = ''  # Whitespace seen since the last token: '', ' ' or '\n'
+    last_word = ''
+    i, n = 0, len(source)
+
+    def emit(token):
+        nonlocal pending
+        if pending and out:
+            prev = out[-1][-1]
+            if pending == '\n':
+                out.append('\n')
+            elif (_WORD.match(prev) and _WORD.match(token[0])) or (prev in '+-' and token[0] == prev):
+                out.append(' ')
+        pending = ''
+        out.append(token)
+
+    while i < n:
+        c = source[i]
+        if c in ' \t\r\n':
+            j = i
+            while j < n and source[j] in ' \t\r\n':
+                j += 1
+            pending = '\n' if '\n' in source[i:j] or pending == '\n' else ' '
+            i = j
+        elif source.startswith('//', i):
+            j = source.find('\n', i)
+            i = n if j < 0 else j
+        elif source.startswith('/*', i):
+            j = source.find('*/', i + 2)
+            j = n if j < 0 else j + 2
+            if not pending or pending == ' ':
+                pending = '\n' if '\n' in source[i:j] else ' '
+            i = j
+        elif c in '\'"`':
+            j = _skip_string(source, i)
+            emit(source[i:j])
+            last_word = ''
+            i = j
+        elif c == '/' and _regex_allowed(out, last_word):
+            j = _skip_regex(source, i)
+            emit(source[i:j])
+            last_word = ''
+            i = j
+        elif _WORD.match(c):
+            j = i
+            while j < n and _WORD.match(source[j]):
+                j += 1
+            emit(source[i:j])
+            last_word = source[i:j]
+            i = j
+        else:
+            emit(c)
+            last_word = ''
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/|(\s+)', re.DOTALL)
+
+
+def minify_css(source):
+    """Drops comments and whitespace around ``{};,>`` and after ``:``; ``calc()`` spacing is kept."""
+
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        return ' '
+
+    css = _CSS_TOKENS.sub(replace, source)
+    # Outside strings only: split on them again and tidy the code parts.
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', css)
+    for k in range(0, len(parts), 2):
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', parts[k])
+        part = re.sub(r':\s+', ':', part)
+        parts[k] = part.replace(';}', '}')
+    return ''.join(parts).strip() + '\n'
+
+
+_VERBATIM = re.compile(r'(<(pre|textarea)\b.*?</\2>)', re.DOTALL | re.IGNORECASE)
+
+
+def minify_html(html):
+    """Strips indentation, blank lines and comments, except inside ``<pre>``/``<textarea>``."""
+    parts = _VERBATIM.split(html)
+    out = []
+    for k in range(0, len(parts), 3):
+        text = re.sub(r'<!--(?!\[if).*?-->', '', parts[k], flags=re.DOTALL)
+        text = '\n'.join(line.strip() for line in text.split('\n') if line.strip())
+        # Keep one separator where whitespace met a verbatim block.
+        if k and parts[k][:1].isspace():
+            text = '\n' + text
+        if k + 1 < len(parts) and parts[k][-1:].isspace():
+            text += '\n'
+        out.append(text)
+        if k + 1 < len(parts):
+            out.append(parts[k + 1])
+    return ''.join(out)
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+
+def _compressed(data):
+    """``{encoding: body}`` for the encodings available here."""
+    variants = {'gzip': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return variants
+
+
+_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def _write(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_assets(static_folder, sources=ASSET_SOURCES):
+    """Builds ``static_folder/dist``; returns the new manifest."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+    manifest_path = os.path.join(dist, MANIFEST)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    manifest = {}
+    for name in sources:
+        with open(os.path.join(static_folder, name), encoding='utf-8') as f:
+            source = f.read()
+        stem, ext = os.path.splitext(name)
+        data = MINIFIERS[ext](source).encode('utf-8')
+        built = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+        _write(os.path.join(dist, built), data)
+        for encoding, body in _compressed(data).items():
+            _write(os.path.join(dist, built + _SUFFIXES[encoding]), body)
+        manifest[name] = built
+    _write(manifest_path, json.dumps(manifest, indent=1).encode('utf-8'))
+
+    keep = set(manifest.values()) | set(previous.values())
+    for filename in os.listdir(dist):
+        base = filename
+        for suffix in _SUFFIXES.values():
+            base = base[:-len(suffix)] if base.endswith(suffix) else base
+        if filename != MANIFEST and base not in keep:
+            os.remove(os.path.join(dist, filename))
+    return manifest
+
+
+def _encoding_for(available):
+    """The preferred of ``available`` encodings the request accepts, or ``None``."""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and request.accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+class IndexPage:
+    """index.html rendered and compressed once, until the asset build changes."""
+
+    def __init__(self, manifest_path, debug=False):
+        self.manifest_path = manifest_path
+        self.debug = debug
+        self._lock = threading.Lock()
+        self._version = None
+        self._etag = None
+        self._bodies = {}
+
+    def _build_version(self):
+        try:
+            return os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def response(self, assets):
+        version = self._build_version()
+        if self.debug or version != self._version:
+            with self._lock:
+                if self.debug or version != self._version:
+                    assets.reload()
+                    html = minify_html(render_template('index.html')).encode('utf-8')
+                    self._bodies = dict(_compressed(html), identity=html)
+                    self._etag = hashlib.sha256(html).hexdigest()[:16]
+                    self._version = version
+        etag, bodies = self._etag, self._bodies
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            encoding = _encoding_for(bodies)
+            response = Response(bodies[encoding or 'identity'], mimetype='text/html')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+class Assets:
+    """The current build's manifest, if there is one."""
+
+    def __init__(self, static_folder):
+        self.dist = os.path.join(static_folder, DIST_DIR)
+        self.manifest_path = os.path.join(self.dist, MANIFEST)
+        self.manifest = {}
+        self.reload()
+
+    def reload(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def url(self, name):
+        built = self.manifest.get(name)
+        if built is None:
+            return url_for('static', filename=name)
+        return url_for('static_asset', filename=built)
+
+
+def init_static_assets(app):
+    """Installs ``asset_url`` for templates, the ``/static/dist`` route, ``/`` and ``flask build-assets``."""
+    assets = Assets(app.static_folder)
+    page = IndexPage(assets.manifest_path, debug=app.debug)
+
+    @app.context_processor
+    def asset_helpers():
+        return {'asset_url': assets.url}
+
+    @app.route('/')
+    def index():
+        return page.response(assets)
+
+    @app.route(f'/static/{DIST_DIR}/<path:filename>')
+    def static_asset(filename):
+        available = [encoding for encoding, suffix in _SUFFIXES.items()
+                     if os.path.isfile(os.path.join(assets.dist, filename + suffix))]
+        encoding = _encoding_for(available)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(assets.dist, filename + (_SUFFIXES[encoding] if encoding else ''),
+                                       mimetype=mimetype, max_age=ASSET_MAX_AGE_S)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE_S}, immutable'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    @app.cli.command('build-assets')
+    def build_static_assets():
+        """Minify, fingerprint and precompress script.js, data-worker.js and style.css."""
+        manifest = build_assets(app.static_folder)
+        for name, built in manifest.items():
+            sizes = [os.path.getsize(os.path.join(app.static_folder, name))]
+            sizes += [os.path.getsize(os.path.join(assets.dist, built + suffix))
+                      for suffix in ('',) + tuple(_SUFFIXES.values())
+                      if os.path.exists(os.path.join(assets.dist, built + suffix))]
+            click.echo(f"{name} -> {built}: " + ' / '.join(f"{size / 1024:.1f} KiB" for size in sizes))
+        if brotli is None:
+            click.echo("brotli is not installed; only gzip variants were written.")
+
+    return assets
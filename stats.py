@@ -0,0 +1,202 @@
+"""Chart aggregates for the dashboard sections, computed in SQL.
+
+``GET /api/stats/<entity>`` returns, for each chart the section draws, its
+labels and values (``{"charts": {name: {"labels": [...], "values": [...]}}}``),
+so the browser downloads a few hundred bytes instead of the whole table.
+The buckets, top-5 cut-offs and "Unknown"/"Not Specified" fallbacks mirror
+the render*Charts functions in static/script.js. ``start``/``end``
+(YYYY-MM-DD, inclusive) narrow entities that have a date; results go through
+the query cache, so they stay valid until one of the underlying tables is
+written.
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from flask import jsonify, request
+
+from coalesce import coalesced
+from db_resilience import CircuitOpenError
+from resources import Session
+
+TOP_N = 5
+
+
+class Chart:
+    """One chart's query; ``{range}`` is replaced by the date filter.
+
+    ``labels`` fixes the bucket order (missing buckets count as zero).
+    """
+
+    __slots__ = ('name', 'sql', 'labels')
+
+    def __init__(self, name, sql, labels=None):
+        self.name = name
+        self.sql = sql
+        self.labels = labels
+
+
+class EntityStats:
+    """The charts of one dashboard section and the column its range filters on."""
+
+    __slots__ = ('name', 'date_column', 'charts')
+
+    def __init__(self, name, date_column, charts):
+        self.name = name
+        self.date_column = date_column
+        self.charts = charts
+
+
+def _buckets(cases, otherwise):
+    """``CASE`` expression labelling the first matching ``(condition, label)``."""
+    whens = ' '.join(f"WHEN {condition} THEN '{label}'" for condition, label in cases)
+    return f"CASE {whens} ELSE '{otherwise}' END"
+
+
+# script.js compares missing numbers as 0, so NULLs land in the lowest bucket.
+_AGE = _buckets([('COALESCE(age, 0) <= 18', '0-18'), ('age <= 35', '19-35'), ('age <= 50', '36-50')], '51+')
+_FEE = _buckets([('COALESCE(consultation_fee, 0) < 100', '< $100'),
+                 ('consultation_fee <= 200', '$100-$200')], '> $200')
+_EXPERIENCE = _buckets([('COALESCE(years_of_experience, 0) <= 5', '0-5'), ('years_of_experience <= 10', '6-10'),
+                        ('years_of_experience <= 20', '11-20')], '20+')
+
+
+def _first_term(column):
+    return (f"CASE WHEN {column} IS NULL OR {column} = '' THEN 'Unknown' "
+            f"ELSE TRIM(SUBSTRING_INDEX({column}, ',', 1)) END")
+
+
+ENTITIES = {entity.name: entity for entity in [
+    EntityStats('patients', 'created_at', [
+        Chart('gender', "SELECT gender as label, COUNT(*) as value FROM patient WHERE {range} GROUP BY gender"),
+        Chart('age', f"SELECT {_AGE} as label, COUNT(*) as value FROM patient WHERE {{range}} GROUP BY label",
+              labels=['0-18', '19-35', '36-50', '51+']),
+        Chart('blood_type', """SELECT blood_type as label, COUNT(*) as value FROM patient
+                               WHERE blood_type IS NOT NULL AND blood_type <> '' AND {range}
+                               GROUP BY blood_type"""),
+        Chart('registration_trend', """SELECT DATE(created_at) as label, COUNT(*) as value FROM patient
+                                       WHERE created_at IS NOT NULL AND {range}
+                                       GROUP BY DATE(created_at) ORDER BY label"""),
+    ]),
+    EntityStats('doctors', None, [
+        Chart('specialization', "SELECT specialization as label, COUNT(*) as value FROM doctor GROUP BY specialization"),
+        Chart('department', """SELECT COALESCE(dept.name, 'Unassigned') as label, COUNT(*) as value
+                               FROM doctor d LEFT JOIN department dept ON d.department_id = dept.department_id
+                               GROUP BY label"""),
+        Chart('fee', f"SELECT {_FEE} as label, COUNT(*) as value FROM doctor GROUP BY label",
+              labels=['< $100', '$100-$200', '> $200']),
+        Chart('experience', f"SELECT {_EXPERIENCE} as label, COUNT(*) as value FROM doctor GROUP BY label",
+              labels=['0-5', '6-10', '11-20', '20+']),
+    ]),
+    EntityStats('appointments', 'a.date', [
+        Chart('status', "SELECT a.status as label, COUNT(*) as value FROM appointment a WHERE {range} GROUP BY a.status"),
+        Chart('top_doctors', f"""SELECT d.name as label, COUNT(*) as value
+                                 FROM appointment a JOIN doctor d ON a.doctor_id = d.doctor_id
+                                 JOIN patient p ON a.patient_id = p.patient_id
+                                 WHERE {{range}} GROUP BY d.name ORDER BY value DESC, label LIMIT {TOP_N}"""),
+        Chart('top_reasons', f"""SELECT COALESCE(NULLIF(a.reason, ''), 'Not Specified') as label, COUNT(*) as value
+                                 FROM appointment a WHERE {{range}}
+                                 GROUP BY label ORDER BY value DESC, label LIMIT {TOP_N}"""),
+        Chart('trend', """SELECT a.date as label, COUNT(*) as value FROM appointment a
+                          WHERE {range} GROUP BY a.date ORDER BY a.date"""),
+    ]),
+    EntityStats('bills', 'b.date', [
+        Chart('status', "SELECT b.status as label, COUNT(*) as value FROM billing b WHERE {range} GROUP BY b.status"),
+        Chart('payment_method', """SELECT COALESCE(NULLIF(b.payment_method, ''), 'Unknown') as label, COUNT(*) as value
+                                   FROM billing b WHERE b.status = 'Paid' AND {range} GROUP BY label"""),
+        Chart('revenue_trend', """SELECT b.date as label, SUM(b.amount) as value FROM billing b
+                                  WHERE {range} GROUP BY b.date ORDER BY b.date"""),
+        Chart('paid_revenue_trend', """SELECT b.date as label, SUM(b.amount) as value FROM billing b
+                                       WHERE b.status = 'Paid' AND {range} GROUP BY b.date ORDER BY b.date"""),
+        Chart('outstanding_vs_paid', """SELECT IF(b.status = 'Paid', 'Paid', 'Outstanding') as label,
+                                               SUM(b.amount) as value
+                                        FROM billing b WHERE {range} GROUP BY label""",
+              labels=['Outstanding', 'Paid']),
+    ]),
+    EntityStats('records', 'mr.date', [
+        Chart('top_diagnoses', f"""SELECT {_first_term('mr.diagnosis')} as label, COUNT(*) as value
+                                   FROM medical_record mr WHERE {{range}}
+                                   GROUP BY label ORDER BY value DESC, label LIMIT {TOP_N}"""),
+        Chart('top_treatments', f"""SELECT {_first_term('mr.treatment')} as label, COUNT(*) as value
+                                    FROM medical_record mr WHERE {{range}}
+                                    GROUP BY label ORDER BY value DESC, label LIMIT {TOP_N}"""),
+        Chart('prescription_trend', """SELECT mr.date as label, COUNT(*) as value FROM medical_record mr
+                                       WHERE mr.prescription IS NOT NULL AND mr.prescription <> '' AND {range}
+                                       GROUP BY mr.date ORDER BY mr.date"""),
+        Chart('patient_conditions', f"""SELECT TRIM(SUBSTRING_INDEX(disease, ',', 1)) as label, COUNT(*) as value
+                                        FROM patient WHERE disease IS NOT NULL AND disease <> ''
+                                        GROUP BY label ORDER BY value DESC, label LIMIT {TOP_N}"""),
+    ]),
+]}
+
+
+def parse_range():
+    """``(start, end_exclusive)`` dates from the query string; raises ``ValueError``."""
+    start = request.args.get('start')
+    end = request.args.get('end')
+    start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+    end = datetime.strptime(end, '%Y-%m-%d').date() + timedelta(days=1) if end else None
+    return start, end
+
+
+def chart_query(chart, date_column, start, end):
+    """SQL and parameters of ``chart`` restricted to ``[start, end)``."""
+    conditions = []
+    params = []
+    if date_column and start:
+        conditions.append(f"{date_column} >= %s")
+        params.append(start)
+    if date_column and end:
+        conditions.append(f"{date_column} < %s")
+        params.append(end)
+    return chart.sql.replace('{range}', ' AND '.join(conditions) or 'TRUE'), tuple(params)
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+def compute(entity, start, end, fetch):
+    """Runs every chart of ``entity`` through ``fetch(sql, params)``."""
+    charts = {}
+    for chart in entity.charts:
+        sql, params = chart_query(chart, entity.date_column, start, end)
+        _, rows = fetch(sql, params)
+        if chart.labels:
+            found = {row['label']: _plain(row['value']) for row in rows}
+            labels = list(chart.labels)
+            values = [found.get(label, 0) for label in labels]
+        else:
+            labels = [_plain(row['label']) for row in rows]
+            values = [_plain(row['value']) for row in rows]
+        charts[chart.name] = {"labels": labels, "values": values}
+    return charts
+
+
+def init_stats(app, get_db_connection, query_cache):
+    """Installs ``GET /api/stats/<entity>``."""
+
+    @app.route('/api/stats/<entity>', methods=['GET'])
+    @coalesced
+    def get_entity_stats(entity):
+        spec = ENTITIES.get(entity)
+        if spec is None:
+            return jsonify({"error": f"No statistics for '{entity}'", "available": sorted(ENTITIES)}), 404
+        try:
+            start, end = parse_range()
+        except ValueError:
+            return jsonify({"error": "start and end must be dates in YYYY-MM-DD format"}), 400
+        db = Session(get_db_connection) # Connects only on a cache miss
+        try:
+            charts = compute(spec, start, end, lambda sql, params: query_cache.fetch(sql, params, db.run))
+            return jsonify({"entity": entity, "start": request.args.get('start'),
+                            "end": request.args.get('end'), "charts": charts}), 200
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            db.close()
@@ -0,0 +1,70 @@
+"""Scheduling and pacing shared by the background sweepers (``dunning``, ``archive``).
+
+``TenantScheduler`` runs a sweeper's ``sweep()`` for every hospital every
+``interval`` seconds from one daemon thread per worker; a failed sweep is
+counted in ``stats["failed"]`` and retried at the next interval.
+
+``BatchPacer`` sizes batches so each takes about ``target_ms``, halving or
+doubling within ``[min_size, max_size]``, and sleeps after each batch so the
+sweeper keeps the database busy no more than ``target_load`` of the time.
+"""
+import os
+import threading
+import time
+
+from tenancy import use_tenant
+
+
+class TenantScheduler:
+    """Calls ``sweep()`` for every hospital every ``interval`` seconds."""
+
+    def __init__(self, tenants, sweep, interval, stats, name, enabled=True):
+        self.tenants = tenants
+        self.sweep = sweep
+        self.interval = interval
+        self.stats = stats
+        self.name = name
+        self.enabled = enabled
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Starts this worker's thread; cheap once it runs."""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name=self.name, daemon=True).start()
+
+    def _run(self):
+        while True:
+            for tenant_id in list(self.tenants.tenants):
+                try:
+                    with use_tenant(tenant_id):
+                        self.sweep()
+                except Exception:
+                    self.stats["failed"] += 1  # Retried at the next interval
+            time.sleep(self.interval)
+
+
+class BatchPacer:
+    """Adapts the batch size to ``target_ms`` per batch and rests to stay under ``target_load``."""
+
+    def __init__(self, size, min_size, max_size, target_ms, target_load):
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_ms = target_ms
+        self.target_load = target_load
+
+    def pace(self, elapsed, adapt=True):
+        """Called after each batch with its duration in seconds; resizes (if ``adapt``) and sleeps."""
+        if adapt:
+            if elapsed * 1000 > self.target_ms * 1.5:
+                self.size = max(self.min_size, self.size // 2)
+            elif elapsed * 1000 < self.target_ms / 2:
+                self.size = min(self.max_size, self.size * 2)
+        if 0 < self.target_load < 1:
+            time.sleep(elapsed * (1 / self.target_load - 1))
@@ -0,0 +1,190 @@
+"""Multi-hospital tenancy: per-request tenant resolution and per-tenant routing.
+
+Hospitals are listed in the JSON file named by ``TENANTS_FILE``::
+
+    {
+      "north": {"name": "North General", "database": "hms_north",
+                "hosts": ["north.hms.example.org"]},
+      "stmary": {"name": "St. Mary's", "host": "10.0.2.5", "database": "hms",
+                 "user": "hms", "password": "...", "replicas": "10.0.2.6:3306",
+                 "max_concurrency": 4, "rate_limit_capacity": 60}
+    }
+
+Every field other than ``name``, ``hosts``, ``replicas`` and the limits
+overrides the matching ``DB_*`` connection setting, so hospitals can share a
+server with one schema each or have servers of their own. Adding a hospital
+is adding an entry and restarting. Without ``TENANTS_FILE`` the API serves a
+single ``default`` tenant from the ``DB_*`` settings, as before.
+
+A request's tenant is, in order: the ``X-Tenant-ID`` header, its host (a
+listed ``hosts`` entry or a subdomain named after the tenant), the tenant its
+token was issued for, then ``DEFAULT_TENANT``. Naming an unknown tenant is a
+404; ``auth`` rejects tokens issued for another tenant.
+
+Each tenant gets its own ``Router`` (primary, replicas, health checks), its
+own admission slots and rate-limit buckets (see ``admission``) and its own
+namespace in the table versions, query cache, reference snapshot and
+coalescing keys, so one hospital's load or writes never reach another's.
+Code without a request (background flushers, refreshers) binds a tenant
+with ``use_tenant``; CLI commands use ``HMS_TENANT``.
+"""
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, jsonify, request
+
+import db_resilience
+from db_routing import Router, parse_replicas
+
+TENANTS_FILE = os.getenv('TENANTS_FILE')
+DEFAULT_TENANT = os.getenv('DEFAULT_TENANT', 'default')
+TENANT_HEADER = 'X-Tenant-ID'
+
+_TENANT_ID = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+_SETTINGS = ('name', 'hosts', 'replicas', 'max_concurrency', 'queue_size',
+             'rate_limit_capacity', 'rate_limit_refill_per_sec')
+
+_local = threading.local()
+
+
+class UnknownTenant(Exception):
+    pass
+
+
+def current_tenant_id():
+    """The tenant of the current request or ``use_tenant`` block."""
+    if has_request_context():
+        tenant = g.get('tenant')
+        if tenant is not None:
+            return tenant.id
+    return getattr(_local, 'tenant_id', None) or os.getenv('HMS_TENANT') or DEFAULT_TENANT
+
+
+@contextmanager
+def use_tenant(tenant_id):
+    """Binds ``tenant_id`` for code running outside a request on this thread."""
+    previous = getattr(_local, 'tenant_id', None)
+    _local.tenant_id = tenant_id
+    try:
+        yield
+    finally:
+        _local.tenant_id = previous
+
+
+class Tenant:
+    """One hospital: its connection settings, router and admission limits."""
+
+    __slots__ = ('id', 'name', 'db_config', 'hosts', 'router', 'max_concurrency', 'queue_size',
+                 'rate_limit_capacity', 'rate_limit_refill_per_sec')
+
+    def __init__(self, tenant_id, spec, base_config):
+        if not _TENANT_ID.match(tenant_id):
+            raise ValueError(f"invalid tenant id {tenant_id!r}: use lowercase letters, digits, '-' and '_'")
+        self.id = tenant_id
+        self.name = spec.get('name')
+        self.hosts = tuple(host.lower() for host in spec.get('hosts', ()))
+        self.db_config = dict(base_config)
+        self.db_config.update({key: value for key, value in spec.items() if key not in _SETTINGS})
+        if 'replicas' in spec:
+            replicas = parse_replicas(spec['replicas'], self.db_config)
+        elif self.db_config.get('host') == base_config.get('host'):
+            replicas = None  # Same server as DB_HOST: same DB_REPLICAS
+        else:
+            replicas = []
+        self.router = Router(self.db_config, replicas)
+        self.max_concurrency = spec.get('max_concurrency')
+        self.queue_size = spec.get('queue_size')
+        self.rate_limit_capacity = spec.get('rate_limit_capacity')
+        self.rate_limit_refill_per_sec = spec.get('rate_limit_refill_per_sec')
+
+
+def load_tenants(path):
+    """``{tenant_id: spec}`` from ``path``, or the single default tenant."""
+    if not path:
+        return {DEFAULT_TENANT: {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class TenantRegistry:
+    """All configured tenants and the request-to-tenant resolution."""
+
+    def __init__(self, base_config, tenants=None):
+        specs = tenants if tenants is not None else load_tenants(TENANTS_FILE)
+        self.tenants = {tenant_id: Tenant(tenant_id, spec, base_config) for tenant_id, spec in specs.items()}
+        self._hosts = {host: tenant for tenant in self.tenants.values() for host in tenant.hosts}
+        self.default = self.tenants.get(DEFAULT_TENANT)
+        if self.default is None and len(self.tenants) == 1:
+            self.default = next(iter(self.tenants.values()))
+
+    def get(self, tenant_id):
+        tenant = self.tenants.get(tenant_id)
+        if tenant is None:
+            if self.default is not None and tenant_id == DEFAULT_TENANT:
+                return self.default
+            raise UnknownTenant(tenant_id)
+        return tenant
+
+    def current(self):
+        return self.get(current_tenant_id())
+
+    def connect(self):
+        """A connection to the current tenant's database (replica or primary)."""
+        return self.current().router.connect()
+
+    def connect_read(self):
+        """A connection to one of the current tenant's replicas, for background reads."""
+        return self.current().router.connect_read()
+
+    def connect_primary(self):
+        """A connection to the current tenant's primary, for background jobs that write."""
+        return db_resilience.connect(self.current().router.primary)
+
+    def has_replicas(self):
+        return any(tenant.router.replicas.replicas for tenant in self.tenants.values())
+
+    def resolve(self):
+        """The tenant for the current request; raises ``UnknownTenant``."""
+        tenant_id = request.headers.get(TENANT_HEADER)
+        if tenant_id:
+            return self.get(tenant_id.strip().lower())
+        host = request.host.split(':')[0].lower()
+        if host in self._hosts:
+            return self._hosts[host]
+        labels = host.split('.')
+        if len(labels) > 2 and labels[0] in self.tenants:
+            return self.tenants[labels[0]]
+        authority = current_app.extensions.get('auth')
+        tenant_id = authority.claimed_tenant() if authority is not None else None
+        if tenant_id:
+            return self.get(tenant_id)
+        if self.default is None:
+            raise UnknownTenant(None)
+        return self.default
+
+    def init_app(self, app):
+        """Resolves ``g.tenant`` before any other hook and adds ``/api/tenant``."""
+
+        @app.before_request
+        def resolve_tenant():
+            g.tenant = None
+            try:
+                g.tenant = self.resolve()
+            except UnknownTenant as e:
+                if not request.path.startswith('/api/'):
+                    return None
+                if e.args[0] is None:
+                    return jsonify({"error": f"No hospital specified. Send {TENANT_HEADER} "
+                                             "or use the hospital's address."}), 400
+                return jsonify({"error": f"Unknown hospital '{e.args[0]}'"}), 404
+            return None
+
+        @app.route('/api/tenant', methods=['GET'])
+        def tenant_info():
+            return jsonify({"id": g.tenant.id, "name": g.tenant.name}), 200
+
+        # The read-your-writes cookie is the same for every tenant's router.
+        next(iter(self.tenants.values())).router.init_app(app)